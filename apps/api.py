@@ -0,0 +1,68 @@
+#HTTP routes for data that is not shown in the dashboard
+
+import io
+
+from flask import Response, abort, jsonify, request, stream_with_context
+
+from app import app
+import config
+
+from apps.targets import engine
+
+server = app.server
+
+
+def requested_targets():
+    '''
+    Target ids or names of a batch request: JSON body {"targets": [...]} (POST),
+    or repeated or comma separated 'targets' parameters (GET).
+    '''
+    if request.is_json:
+        terms = (request.get_json(silent=True) or {}).get('targets') or []
+    else:
+        terms = [term for value in request.args.getlist('targets') for term in value.split(',')]
+    terms = [str(term).strip() for term in terms if str(term).strip()]
+
+    if not terms:
+        abort(400, 'No targets given')
+    if len(terms) > config.BATCH_MAX_TARGETS:
+        abort(413, f'At most {config.BATCH_MAX_TARGETS} targets per request')
+
+    return terms
+
+
+#Rankings of many targets, see modules/batch.py
+@server.route('/api/rankings', methods=['GET', 'POST'])
+def batch_rankings():
+    '''
+    Streams the rankings of the requested targets as CSV, written target by target as they are ranked,
+    or as Parquet with format=parquet (needs pyarrow, built in memory before it is sent).
+    Targets that are not found or fail have one row with the error. X-Target-Count is the number of targets.
+    metric, top_k and min_n0 parameters cut the rankings of each target, see sql_helper.get_rankings.
+    '''
+    #Imported on first use: batch loads pandas and sql_helper, which the app only needs later (see apps/targets.py)
+    import batch
+
+    terms = requested_targets()
+    output = request.args.get('format', 'csv')
+    if output not in ('csv', 'parquet'):
+        abort(400, f'Unknown format: {output}')
+    metric = request.args.get('metric', 'pmi')
+    if metric not in ('f0', 'f1', 'f2', 'pmi'):
+        abort(400, f'Unknown metric: {metric}')
+    frames = batch.rank_targets(terms, config.DB_PATH, workers=config.BATCH_WORKERS, engine=engine, metric=metric,
+                                top_k=request.args.get('top_k', type=int), min_n0=request.args.get('min_n0', type=int))
+    headers = {'X-Target-Count': str(len(terms))}
+
+    if output == 'csv':
+        headers['Content-Disposition'] = 'attachment; filename=rankings.csv'
+        return Response(stream_with_context(batch.iter_csv(frames)), mimetype='text/csv', headers=headers)
+
+    #parquet
+    buffer = io.BytesIO()
+    try:
+        batch.write_parquet(frames, buffer)
+    except ImportError as e:
+        return jsonify({'error': str(e)}), 501
+    headers['Content-Disposition'] = 'attachment; filename=rankings.parquet'
+    return Response(buffer.getvalue(), mimetype='application/vnd.apache.parquet', headers=headers)
@@ -3,18 +3,18 @@
 #MODULES
 #Core components
 import dash
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State, ClientsideFunction
 import dash_core_components as dcc
 import dash_html_components as html
 import dash_table
-import pandas as pd
 import textwrap
+import json
+import logging
+import threading
+from functools import partial
 
 from app import app
-
-#Visualization
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
+import config
 
 #SQLite libraries
 import sqlite3
@@ -25,22 +25,64 @@ from sqlalchemy import create_engine
 import sys
 sys.path.insert(0,'./modules')
 
-import sql_helper
-import counts
+import db
+import lookup
+import cache
+
+#sql_helper, suggest and figures load pandas, plotly and fuzzywuzzy. They are imported where they are used 
+#(and by warmup in the background), so a worker can serve the page before they are loaded.
 
 
 # DATA
-#Load DB connection
-engine = create_engine('sqlite:///data/20200729pubmed_mini.db', echo=False)
-con = engine.connect()
+#DB engine with a pool of read-only connections, opened on first use
+engine = db.get_engine(config.DB_PATH, immutable=config.DB_IMMUTABLE, pool_size=config.DB_POOL_SIZE, **config.DB_PRAGMAS)
+
+cache.results.configure(max_entries=config.CACHE_MAX_ENTRIES, max_bytes=config.CACHE_MAX_BYTES)
+cache.figures.configure(max_entries=config.FIGURE_CACHE_MAX_ENTRIES, max_bytes=config.FIGURE_CACHE_MAX_BYTES)
+if config.SHARED_CACHE_DIR:
+    #One side file per host, shared by all gunicorn workers
+    try:
+        shared_cache = cache.SharedCache(config.SHARED_CACHE_DIR, engine, max_bytes=config.SHARED_CACHE_MAX_BYTES)
+        cache.results.attach(shared_cache)
+        cache.figures.attach(shared_cache)
+    except OSError:
+        #e.g. a directory that is not private (see cache.SharedCache): run with the in-process caches only
+        logging.getLogger(__name__).exception('shared cache disabled')
+
+#Columns of the tables. Their data is loaded by the callbacks when the page opens
+ranking_columns = ['disease', 'f0', 'f1', 'f2', 'pmi']
+#Rankings table in disease search mode: targets of the searched disease
+target_ranking_columns = ['target', 'f0', 'f1', 'f2', 'pmi']
+drug_columns = ['Drug_name', 'Drug_status', 'INDICATI']
+
+
+def warmup(target=config.WARMUP_TARGET):
+    '''
+    Runs in a background thread after import: loads the heavy modules, builds the lookup and suggestion indexes 
+    and caches the first page of rankings and the drugs of a default target. 
+    Requests that come in before it is done do the same work themselves.
+    Arguments:
+        target: target abbreviation to cache, None to skip
+    '''
+    try:
+        import sql_helper
+        import suggest
+        import figures
+        
+        index = lookup.get_index(engine)
+        suggest.get_index(engine)
+        
+        info = index.get_target_id(target) if target else 'NaN'
+        if info != 'NaN':
+            sql_helper.get_rankings_page(info[0], engine)
+            sql_helper.get_drug_info(info[0], engine)
+    except Exception:
+        #The app works without it, requests just pay for the first loads
+        logging.getLogger(__name__).exception('warmup failed')
 
 
-#Default values for the first view. These global variables are overwritten by update_table callback.
-search_term = (1841,'ANG','Angiogenin')
-df = sql_helper.get_rankings(search_term[0], engine)
-drug_df = sql_helper.get_drug_info(search_term[0], engine)
-drug_df_filt = drug_df.copy() #This is a shortcut way of dealing with filtering while overwriting global df. 
-df_filt = df.copy()
+if config.WARMUP:
+    threading.Thread(target=warmup, name='warmup', daemon=True).start()
 
 #Explanatory popups in the datatable
 
@@ -63,7 +105,7 @@ tooltip_data= [{c:
             'value': explanations[c],
             'delay':100, 'duration': 3000
         } for c in ['f0', 'f1', 'f2', 'pmi']} #shows info on all columns but 'disease'. Otherwise just use 'df.columns'
-               for row in df.to_dict('rows') #remove if only want tooltip on the first row
+               for row in range(10) #one per row of a table page. Remove if only want tooltip on the first row
               ]
 
 #This is a shorter way, but only shows info for the first row in the table
@@ -75,6 +117,17 @@ tooltip_data= [{c:
 # }]
 
 
+def chart_template():
+    '''
+    Plotly template for the clientside charts, None when the charts are built on the server.
+    '''
+    if not config.CLIENTSIDE_CHARTS:
+        return None
+    
+    import plotly.io as pio
+    return pio.templates[pio.templates.default].to_plotly_json()
+
+
 # STYLE
 
 table_header_style = {
@@ -144,8 +197,40 @@ layout = html.Div(
                             className="four columns pkcalc-settings",
                             children=[
                                 html.Div([
+                                    #Search a target (diseases ranked for it) or a disease (targets ranked for it)
+                                    dcc.RadioItems(id='search-mode',
+                                                   options=[{'label': 'Target', 'value': 'target'},
+                                                            {'label': 'Disease', 'value': 'disease'}],
+                                                   value='target',
+                                                   labelStyle={'display': 'inline-block', 'margin-right': '10px'}),
                                     #https://dash.plotly.com/dash-core-components/input                                 
                                     dcc.Input(id="input1", type="text", placeholder="Enter the target abbreviation..", debounce=True),
+                                    #Resolved search target or disease, shared by both tables. See resolve_target
+                                    dcc.Store(id='target-store'),
+                                    #Disease shown in the charts. See select_disease
+                                    dcc.Store(id='selected-disease'),
+                                    #Cut of the rankings table, done in SQL (see sql_helper.get_rankings_page)
+                                    html.Label('Show top', htmlFor='top-k'),
+                                    dcc.Dropdown(id='top-k',
+                                                 options=[{'label': 'all', 'value': 0}] + [{'label': str(k), 'value': k} for k in [10, 25, 50, 100]],
+                                                 value=0, clearable=False),
+                                    html.Label('by', htmlFor='top-metric'),
+                                    dcc.Dropdown(id='top-metric',
+                                                 options=[{'label': c, 'value': c} for c in ['f0', 'f1', 'f2', 'pmi']],
+                                                 value='pmi', clearable=False),
+                                    html.Label('Minimum joint articles', htmlFor='min-n0'),
+                                    dcc.Input(id='min-n0', type='number', min=1, step=1, placeholder='1', debounce=True),
+                                    #Rankings from the articles of a range of years (sql_helper.get_year_rankings)
+                                    #Hidden until set_year_range finds the per-year cube
+                                    html.Div(
+                                        id='year-settings',
+                                        style={'display': 'none'},
+                                        children=[
+                                            html.Label('Publication years', htmlFor='year-range'),
+                                            dcc.RangeSlider(id='year-range', step=1),
+                                            html.Label('Recency half-life (years)', htmlFor='half-life'),
+                                            dcc.Input(id='half-life', type='number', min=0.5, step=0.5, placeholder='none', debounce=True),
+                                        ]),
                                         ]),#div search field
                                     html.Div(id="output"),
                                     ], #children "four columns pkcalc-settings"
@@ -157,8 +242,8 @@ layout = html.Div(
                                 dash_table.DataTable(
                                     style_cell={'whiteSpace': 'normal'},
                                     id='drug_table',
-                                    columns=[{"name": i, "id": i} for i in drug_df.columns],
-                                    data = drug_df.to_dict('records'),
+                                    columns=[{"name": i, "id": i} for i in drug_columns],
+                                    data = [],
                                     page_current=0,
                                     page_size=10, #change this for number of rows displayed on one page in table
                                     page_action='native',
@@ -197,16 +282,18 @@ layout = html.Div(
                                 dash_table.DataTable(
                                     style_cell={'whiteSpace': 'normal'},
                                     id='table-paging-with-graph',
-                                    columns=[{"name": i, "id": i} for i in df.columns],
-                                    data = df.to_dict('records'),
+                                    columns=[{"name": i, "id": i} for i in ranking_columns],
+                                    data = [],
                                     page_current=0,
                                     page_size=10, #change this for number of rows displayed on one page in table
-                                    page_action='native',
+                                    #Paging, filtering and sorting are done in SQL, see update_table
+                                    page_action='custom',
+                                    page_count=1,
                                     
-                                    filter_action='native',
+                                    filter_action='custom',
                                     filter_query='',
                                     
-                                    sort_action='native',
+                                    sort_action='custom',
                                     
                                     #This part not in example code. Delete if needed.
                                     #This adds a column with row selection. Need to use this as output in the next graph. 
@@ -236,6 +323,9 @@ layout = html.Div(
                 ),#div row2
                 html.Hr(),
                 html.H3('Disease statistics'),
+                #Used by clientside charts only: selected disease data and the plotly template (sent once per page)
+                dcc.Store(id='disease-series'),
+                dcc.Store(id='chart-template', data=chart_template()),
                 html.Div(
                     className="row pkcalc-container",
                     style={},
@@ -264,73 +354,315 @@ layout = html.Div(
     
     
 #CALLBACKS & FUNCTIONS
-# Update table: load new data on search or update on sort & filter
+# Resolve the searched target once. Both tables read the result from target-store
 
 @app.callback(
-    [Output('table-paging-with-graph', 'data'),
-    Output('output','children')],
-    [Input('input1', 'value'),]
+    [Output('year-range', 'min'),
+     Output('year-range', 'max'),
+     Output('year-range', 'value'),
+     Output('year-range', 'marks'),
+     Output('year-settings', 'style')],
+    [Input('url', 'pathname')]
+    )
+
+def set_year_range(pathname):
+    '''
+    Years of the year slider, set when the page opens rather than when the app starts (which
+    would query the database at import). Without the per-year cube the slider stays hidden.
+    '''
+    import sql_helper
+
+    bounds = sql_helper.get_year_range(engine)
+    if not bounds:
+        return 0, 0, None, {}, {'display': 'none'}
+    first_year, last_year = bounds
+
+    return first_year, last_year, [first_year, last_year], {y: str(y) for y in range(first_year, last_year + 1, 2)}, {}
+
+
+@app.callback(
+    Output('input1', 'placeholder'),
+    [Input('search-mode', 'value')]
+    )
+
+def update_placeholder(mode):
+    return 'Enter the disease name..' if mode == 'disease' else 'Enter the target abbreviation..'
+
+
+@app.callback(
+    Output('target-store', 'data'),
+    [Input('input1', 'value'),
+     Input('search-mode', 'value')]
     )
 
-def update_table(input1):
+def resolve_target(input1, mode='target'):
+    '''
+    Looks up the search term once per search, so update_table and update_table2 
+    do not each resolve it and always show the same target.
+    Arguments:
+        input1: search input from the search field
+        mode: 'target' or 'disease', see the search-mode radio items
+    Returns:
+        target: dictionary with the search term, mode and either target_id, abbr, name (found) or suggestions (not found).
+            In disease mode: disease_id and name (found) or suggested disease names (not found)
+    '''
+    if mode == 'disease':
+        disease_id = lookup.get_index(engine).get_dis_id(input1)
+        if disease_id == 'NaN':
+            import suggest
+            suggestions = suggest.get_disease_index(engine).suggest(input1) if input1 else []
+            return {'query': input1, 'mode': mode, 'found': False, 'suggestions': suggestions}
+        return {'query': input1, 'mode': mode, 'found': True, 'disease_id': disease_id, 'name': input1}
     
-    info = sql_helper.get_target_id(input1, engine)
+    info = lookup.get_index(engine).get_target_id(input1)
     
     if info == 'NaN':
-        if not input1:
-            return [], ''#u'Target not found'
-        else:
-            suggestions = sql_helper.find_similar(input1, engine)
-            return [], (html.P(['Target not found.', html.Br(), 'Maybe you meant:', html.Br(), html.Br(), ', '.join(suggestions)]))
+        import suggest
+        suggestions = suggest.get_index(engine).suggest(input1) if input1 else []
+        return {'query': input1, 'mode': mode, 'found': False, 'suggestions': suggestions}
     
-    else:
-        try:
-            df = sql_helper.get_rankings(info[0], engine)
-            df = df.reset_index().drop(columns='index')
+    return {'query': input1, 'mode': mode, 'found': True, 'target_id': info[0], 'abbr': info[1], 'name': info[2]}
 
-            return df.to_dict('records'), (html.P(['Found:', html.Br(), html.Br(), f'Abbr: {info[1]}', html.Br(), f'Full: {info[2]}']))
 
-        except ValueError:
-            return [], (html.P(['No articles match the target:', html.Br(), html.Br(), f'Abbr: {info[1]}', html.Br(), f'Full: {info[2]}']))
+# Update table: load a page of rankings on search, paging, sort & filter
 
+operators = [['ge ', '>='],
+             ['le ', '<='],
+             ['lt ', '<'],
+             ['gt ', '>'],
+             ['ne ', '!='],
+             ['eq ', '='],
+             ['contains '],
+             ['datestartswith ']]
 
 
+def split_filter_part(filter_part):
+    '''
+    Parses one part of the DataTable filter query, e.g. '{pmi} ge 3'.
+    See https://dash.plotly.com/datatable/callbacks
+    Returns:
+        name, operator, value. [None, None, None] if the part could not be parsed.
+    '''
+    for operator_type in operators:
+        for operator in operator_type:
+            if operator in filter_part:
+                name_part, value_part = filter_part.split(operator, 1)
+                name = name_part[name_part.find('{') + 1: name_part.rfind('}')]
+
+                value_part = value_part.strip()
+                v0 = value_part[0]
+                if (v0 == value_part[-1] and v0 in ("'", '"', '`')):
+                    value = value_part[1: -1].replace('\\' + v0, v0)
+                else:
+                    try:
+                        value = float(value_part)
+                    except ValueError:
+                        value = value_part
+
+                # word operators need spaces after them in the filter string,
+                # but we don't want these later
+                return name, operator_type[0].strip(), value
+
+    return [None] * 3
 
-#Update table 2
 
 @app.callback(
-    Output('drug_table', 'data'),
-    [Input('input1', 'value')]
-)
+    Output('table-paging-with-graph', 'page_current'),
+    [Input('target-store', 'data'),
+     Input('top-k', 'value'),
+     Input('top-metric', 'value'),
+     Input('min-n0', 'value'),
+     Input('year-range', 'value'),
+     Input('half-life', 'value')]
+    )
+
+def reset_page(target, top_k=0, metric='pmi', min_n0=None, year_range=None, half_life=None):
+    '''
+    Goes back to the first page when a new target is searched or the rankings are cut differently.
+    '''
+    return 0
+
+
+@app.callback(
+    [Output('table-paging-with-graph', 'selected_rows'),
+     Output('table-paging-with-graph', 'selected_row_ids')],
+    [Input('target-store', 'data'),
+     Input('table-paging-with-graph', "page_current"),
+     Input('table-paging-with-graph', "sort_by"),
+     Input('table-paging-with-graph', "filter_query"),
+     Input('top-k', 'value'),
+     Input('top-metric', 'value'),
+     Input('min-n0', 'value'),
+     Input('year-range', 'value'),
+     Input('half-life', 'value')]
+    )
+
+def reset_selection(target, page_current=0, sort_by=None, filter=None, top_k=0, metric='pmi', min_n0=None,
+                    year_range=None, half_life=None):
+    '''
+    Clears the selected row whenever the rows of the table change (new search, page, sorting, filter or cuts).
+    The table is paged by the server, so selected_rows are positions on the page: kept, they would mark
+    another row of the new page, while the drug table and charts still showed the previous disease.
+    '''
+    return [], []
+
 
-def update_table2(input1):
+@app.callback(
+    [Output('table-paging-with-graph', 'data'),
+     Output('table-paging-with-graph', 'page_count'),
+     Output('output','children'),
+     Output('table-paging-with-graph', 'columns')],
+    [Input('target-store', 'data'),
+     Input('table-paging-with-graph', "page_current"),
+     Input('table-paging-with-graph', "page_size"),
+     Input('table-paging-with-graph', "sort_by"),
+     Input('table-paging-with-graph', "filter_query"),
+     Input('top-k', 'value'),
+     Input('top-metric', 'value'),
+     Input('min-n0', 'value'),
+     Input('year-range', 'value'),
+     Input('half-life', 'value')]
+    )
+
+def update_table(target, page_current, page_size, sort_by, filter, top_k=0, metric='pmi', min_n0=None,
+                 year_range=None, half_life=None):
+    '''
+    Updates the rankings datatable shown on dashboard. Only the rows of the current page are 
+    queried and sent to the browser: sorting, filtering and paging are pushed into SQL (see sql_helper.get_rankings_page).
+    In disease search mode the table shows the targets of the disease instead (sql_helper.get_target_rankings_page).
+        
+    Arguments:
+        target: resolved search target or disease from target-store
+        page_current: current page number
+        page_size: number of rows to return per page
+        sort_by: sorting set in the table
+        filter: filter query set in the table
+        top_k: only show the top_k rows by metric, 0: all
+        metric: metric of top_k, also the default sort order
+        min_n0: only show rows with at least min_n0 articles mentioning both target and disease
+        year_range: [first, last] year of the articles. Other than all years it switches to sql_helper.get_year_rankings_page
+        half_life: half-life in years of the recency decay, None: no decay
     
-    info = sql_helper.get_target_id(input1, engine)
+    Returns:
+        data: rows of the current page
+        page_count: number of pages
+        output: search result message
+        columns: columns of the table, diseases or targets depending on the search mode
+    '''
+    by_disease = bool(target) and target.get('mode') == 'disease'
+    columns = [{"name": i, "id": i} for i in (target_ranking_columns if by_disease else ranking_columns)]
     
-    if info == 'NaN':
-        return []
+    if not target or not target['found']:
+        if not target or not target['query']:
+            return [], 1, '', columns#u'Target not found'
+        elif by_disease:
+            #Disease names can contain commas
+            return [], 1, (html.P(['Disease not found.', html.Br(), 'Maybe you meant:', html.Br(), html.Br(), '; '.join(target['suggestions'])])), columns
+        else:
+            return [], 1, (html.P(['Target not found.', html.Br(), 'Maybe you meant:', html.Br(), html.Br(), ', '.join(target['suggestions'])])), columns
+    
+    import sql_helper
     
+    if by_disease:
+        found = html.P(['Found:', html.Br(), html.Br(), f'Disease: {target["name"]}'])
+        not_found = html.P(['No articles match the disease:', html.Br(), html.Br(), f'Disease: {target["name"]}'])
+        get_page, key_id = sql_helper.get_target_rankings_page, target['disease_id']
     else:
-        try:  
-            drug_df = sql_helper.get_drug_info(info[0], engine)
-            drug_df = drug_df.reset_index().drop(columns='index')
+        found = html.P(['Found:', html.Br(), html.Br(), f'Abbr: {target["abbr"]}', html.Br(), f'Full: {target["name"]}'])
+        not_found = html.P(['No articles match the target:', html.Br(), html.Br(), f'Abbr: {target["abbr"]}', html.Br(), f'Full: {target["name"]}'])
+        get_page, key_id = sql_helper.get_rankings_page, target['target_id']
+    
+    bounds = sql_helper.get_year_range(engine)
+    years = tuple(year_range) if bounds and year_range else bounds
+    if bounds and (years != bounds or half_life):
+        #Metrics from the per-year counts instead of the precomputed whole-corpus rankings
+        get_page = partial(sql_helper.get_year_rankings_page, direction='disease' if by_disease else 'target',
+                           years=years, half_life=half_life or None)
+    
+    filters = tuple(tuple(split_filter_part(part)) for part in filter.split(' && ')) if filter else ()
+    sort = tuple((col['column_id'], col['direction'] == 'asc') for col in sort_by or [])
+    
+    try:
+        df, total = get_page(key_id, engine, page_current=page_current or 0, page_size=page_size, sort_by=sort, filters=filters,
+                             metric=metric or 'pmi', top_k=top_k or None, min_n0=int(min_n0) if min_n0 else None)
+    except ValueError:
+        #Filter the SQL side does not support, e.g. still being typed, or a column of the other search mode
+        return [], 1, found, columns
+    
+    if total == 0 and not filters and not min_n0:
+        return [], 1, not_found, columns
+    
+    page_count = max(1, -(-total // page_size))
+    #DataTable uses the 'id' key as row id: graph callbacks get the disease id of the selected row directly.
+    #In disease mode rows are targets, the drug table gets the target id of the selected row
+    df = df.rename(columns={'target_id' if by_disease else 'disease_id': 'id'})
+    
+    return df.to_dict('records'), page_count, found, columns
+
+
+
+
+#Update table 2
 
-            return drug_df.to_dict('records')
+@app.callback(
+    Output('drug_table', 'data'),
+    [Input('target-store', 'data'),
+     Input('table-paging-with-graph', 'selected_row_ids')]
+)
 
-        except ValueError:
+def update_table2(target, selected_row_ids=None):
+    '''
+    Drugs of the searched target, or in disease search mode of the target selected in the rankings table.
+    '''
+    if not target or not target['found']:
+        return []
+    
+    if target.get('mode') == 'disease':
+        if not selected_row_ids:
             return []
+        #Row ids are target ids in disease mode, see update_table
+        target_id = selected_row_ids[0]
+    else:
+        target_id = target['target_id']
+    
+    import sql_helper
+    
+    try:  
+        drug_df = sql_helper.get_drug_info(target_id, engine)
+        drug_df = drug_df.reset_index().drop(columns='index')
 
-#Update figure one: Number of articles published on disease per year
+        return drug_df.to_dict('records')
 
+    except ValueError:
+        return []
+
+#Disease of the charts: the selected row in target mode, the searched disease in disease mode
 
 @app.callback(
-    Output("dis_year","figure"),
-    [Input('table-paging-with-graph', 'derived_virtual_selected_rows'),
-     Input('table-paging-with-graph', "derived_virtual_data"),
-    ])
+    Output('selected-disease', 'data'),
+    [Input('target-store', 'data'),
+     Input('table-paging-with-graph', 'selected_row_ids')]
+)
+
+def select_disease(target, selected_row_ids):
+    '''
+    Arguments:
+        target: resolved search target or disease from target-store
+        selected_row_ids: ids of the rows selected in the rankings table
+    Returns:
+        disease_ids: list with the id of the disease to chart, None if there is none
+    '''
+    if target and target.get('mode') == 'disease':
+        return [target['disease_id']] if target['found'] else None
+    
+    #Row ids are disease ids in target mode, see update_table
+    return selected_row_ids or None
+
+
+#Update figure one: Number of articles published on disease per year
 
- 
-def update_graph(derived_virtual_selected_rows, rows):
+
+def update_graph(selected_row_ids):
     '''
     Takes information from the selected row in the datatable and 
     returns a bar chart with 
@@ -341,94 +673,28 @@ def update_graph(derived_virtual_selected_rows, rows):
     If nothing is given, returns an empty figure. If there is no data found, returns empty figure indicating trials were not
         found.
     Arguments:
-        selected rows: row with disease selected from the datatable     
+        selected_row_ids: disease ids from selected-disease (see select_disease)     
     Returns:
         fig: plotly.go barchart
     '''
     
-    if derived_virtual_selected_rows == []:
+    if not selected_row_ids:
 
-        fig = go.Figure(
-            data = []
-        )
+        #Empty figure without loading plotly
+        fig = {'data': []}
         
     else:
+        import figures
         
-        dff = pd.DataFrame(rows)
-        
-        disease_name = dff['disease'].iloc[derived_virtual_selected_rows[0]]
-        disease_id = sql_helper.get_dis_id(disease_name, engine)
-    
-        dis_print = '<br>'.join(textwrap.wrap(disease_name, width=40)) if len(disease_name)>40 else disease_name
+        fig = json.loads(figures.get_figure_json('pubmed', selected_row_ids[0], engine))
 
-        #dis_id = sql_helper.get_dis_id(disease_name, engine)
-        dis_years = sql_helper.get_pubmed_year(disease_id, engine)
-        
-        if dis_years == []:
-            fig = go.Figure(
-            data = [
-                   ],
-
-            layout = go.Layout(title=go.layout.Title(text = f'Publications not found:<br>{dis_print}', 
-                                                     font = dict(size=14)))
-            )
-        
-        
-        else:
-            dis_counts = counts.get_count_abstracts(dis_years)
-            
-            fig = make_subplots(specs=[[{"secondary_y": True}]])
-
-            fig.add_trace(
-                go.Bar(x=dis_counts["year"], y=dis_counts["count"], name="No of publications", marker_color = 'rgb(2,21,70)'),
-                secondary_y=False
-            )
-
-            fig.add_trace(
-                go.Scatter(x=dis_counts["year"], y=dis_counts["percentage"], name="% from total", marker_color='red', mode='lines'),
-                secondary_y=True
-            )
-
-            fig.update_layout(
-                title_text=f"Publications per year:<br>{dis_print}",
-                titlefont = dict(size=14)
-            )
-
-            fig.update_yaxes(
-                title_text=f"Annual publications",
-                secondary_y=False
-            )
-
-            fig.update_yaxes(
-                title_text="% of publications that year",
-                secondary_y=True
-            )
-
-            fig.update_xaxes(
-                title_text="Year"
-            )
-            
-            fig.update_layout(legend=dict(
-                yanchor="bottom",
-                y=-0.5, 
-                xanchor="center",
-                x=0.5
-))
-            
     return fig        
 
 
 
 #Update graph 2
 
-@app.callback(
-    Output("ct_year","figure"),
-    [Input('table-paging-with-graph', 'derived_virtual_selected_rows'),
-     Input('table-paging-with-graph', "derived_virtual_data"),
-    ])
-
-
-def update_graph2(derived_virtual_selected_rows, rows):
+def update_graph2(selected_row_ids):
     '''
     Takes information from the selected row in the datatable and 
     returns a bar chart with 
@@ -439,135 +705,70 @@ def update_graph2(derived_virtual_selected_rows, rows):
     If nothing is given, returns an empty figure. If there is no data found, returns empty figure indicating trials were not
         found.
     Arguments:
-        selected rows: row with disease selected from the datatable     
+        selected_row_ids: disease ids from selected-disease (see select_disease)     
     Returns:
         fig: plotly.go barchart
     '''
-    if derived_virtual_selected_rows == []:
+    if not selected_row_ids:
 
-        fig = go.Figure(
-            data = []
-        )
+        #Empty figure without loading plotly
+        fig = {'data': []}
         
     else:
+        import figures
         
-        dff = pd.DataFrame(rows)
-        
-        disease_name = dff['disease'].iloc[derived_virtual_selected_rows[0]]
-        #disease_id = sql_helper.get_dis_id(disease_name, engine)
-        dis_print = '<br>'.join(textwrap.wrap(disease_name, width=50)) if len(disease_name)>50 else disease_name
-    
+        fig = json.loads(figures.get_figure_json('ct', selected_row_ids[0], engine))
 
-        #dis_id = sql_helper.get_dis_id(disease_name, engine)
-        ct_years = sql_helper.get_ct_year(disease_name, engine)
-        
-        if ct_years == []:
-            fig = go.Figure(
-            data = [
-                   ],
-
-            layout = go.Layout(title=go.layout.Title(text = f'Trials not found:<br>{dis_print}', 
-                                                     font = dict(size=14)))
-            )
-        
-        
-        else:
-            dis_counts = counts.get_count_dataframe(ct_years)
-            dis_id = sql_helper.get_dis_id(disease_name, engine)
-            dis_pred = sql_helper.ct_forecast(dis_id, engine)
-            
-            
-            fig = make_subplots(specs=[[{"secondary_y": True}]])
-
-            fig.add_trace(
-                go.Bar(x=dis_counts["year"], y=dis_counts["count"], name="No of trials", marker_color = 'rgb(2,21,70)'),
-                secondary_y=False
-            )
-            if dis_pred == [0,0]:
-                fig.add_trace(
-                    go.Scatter(x = [2020, 2021], y=[i for i in dis_pred], name = "Forecast", marker_color = 'green', mode='lines'),
-                    secondary_y=False
-                )
-            else:
-                fig.add_trace(
-                    go.Bar(x = [2020, 2021], y=[i for i in dis_pred], name = "Forecast", marker_color = 'green', ),
-                    secondary_y=False
-                )
-            
-            fig.add_trace(
-                go.Scatter(x=dis_counts["year"], y=dis_counts["percentage"], name="% from total", marker_color='red', mode='lines'),
-                secondary_y=True
-            )
-            
-
-            fig.update_layout(
-                title_text=f"Clinical trials per year:<br>{dis_print}",
-                titlefont = dict(size=14),
-            )
-
-            fig.update_yaxes(
-                title_text=f"Annual trials",
-                secondary_y=False
-            )
-
-            fig.update_yaxes(
-                title_text="% of trials that year",
-                secondary_y=True
-            )
-
-            fig.update_xaxes(
-                title_text="Year",
-                #range = [1999, 2025]
-            )
-            
-            fig.update_layout(legend=dict(
-                yanchor="bottom",
-                y=-0.5, 
-                xanchor="center",
-                x=0.5
-))
-            
     return fig
 
 
-#LEGACY CODE
+#Clientside charts: only the numbers go to the browser, assets/charts.js builds the figures
 
-# #Sort table: custom 
-
-# operators = [['ge ', '>='],
-#              ['le ', '<='],
-#              ['lt ', '<'],
-#              ['gt ', '>'],
-#              ['ne ', '!='],
-#              ['eq ', '='],
-#              ['contains '],
-#              ['datestartswith ']]
-
-
-# def split_filter_part(filter_part):
-#     for operator_type in operators:
-#         for operator in operator_type:
-#             if operator in filter_part:
-#                 name_part, value_part = filter_part.split(operator, 1)
-#                 name = name_part[name_part.find('{') + 1: name_part.rfind('}')]
+def update_series(selected_row_ids):
+    '''
+    Sends the compact series of the selected disease (see figures.get_series) to the disease-series store.
+    Arguments:
+        selected_row_ids: disease ids from selected-disease (see select_disease)     
+    Returns:
+        series: dictionary with data for both charts, None if nothing is selected
+    '''
+    if not selected_row_ids:
+        return None
+    
+    import figures
+    return figures.get_series(selected_row_ids[0], engine)
 
-#                 value_part = value_part.strip()
-#                 v0 = value_part[0]
-#                 if (v0 == value_part[-1] and v0 in ("'", '"', '`')):
-#                     value = value_part[1: -1].replace('\\' + v0, v0)
-#                 else:
-#                     try:
-#                         value = float(value_part)
-#                     except ValueError:
-#                         value = value_part
 
-#                 # word operators need spaces after them in the filter string,
-#                 # but we don't want these later
-#                 return name, operator_type[0].strip(), value
+#Charts are built either on the server or in the browser, see config.CLIENTSIDE_CHARTS
 
-#     return [None] * 3
+if config.CLIENTSIDE_CHARTS:
+    app.callback(
+        Output('disease-series', 'data'),
+        [Input('selected-disease', 'data')])(update_series)
+    
+    app.clientside_callback(
+        ClientsideFunction(namespace='charts', function_name='pubmed'),
+        Output('dis_year', 'figure'),
+        [Input('disease-series', 'data')],
+        [State('chart-template', 'data')])
+    
+    app.clientside_callback(
+        ClientsideFunction(namespace='charts', function_name='trials'),
+        Output('ct_year', 'figure'),
+        [Input('disease-series', 'data')],
+        [State('chart-template', 'data')])
+
+else:
+    app.callback(
+        Output("dis_year","figure"),
+        [Input('selected-disease', 'data')])(update_graph)
+    
+    app.callback(
+        Output("ct_year","figure"),
+        [Input('selected-disease', 'data')])(update_graph2)
 
 
+#LEGACY CODE
 
 #Update table when sorting and filtering are set to 'custom'
 
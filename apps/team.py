@@ -7,14 +7,9 @@ from dash.dependencies import Input, Output
 import dash_core_components as dcc
 import dash_html_components as html
 import dash_table
-import pandas as pd
 
 from app import app
 
-#Visualization
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
-
 
 # APP
 
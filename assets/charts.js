@@ -0,0 +1,91 @@
+/*
+Clientside versions of the disease charts (figures.pubmed_figure and figures.ct_figure).
+Used when CLIENTSIDE_CHARTS is on: the server only sends the compact series from figures.get_series
+into the 'disease-series' store and the figures are built here.
+*/
+
+function wrapTitle(text, width) {
+    //Same as textwrap.wrap + '<br>'.join on the server
+    if (text.length <= width) {
+        return text;
+    }
+    var lines = [];
+    var line = '';
+    text.split(' ').forEach(function(word) {
+        if (line && (line + ' ' + word).length > width) {
+            lines.push(line);
+            line = word;
+        } else {
+            line = line ? line + ' ' + word : word;
+        }
+    });
+    lines.push(line);
+    return lines.join('<br>');
+}
+
+function emptyFigure(title) {
+    var layout = title ? {title: {text: title, font: {size: 14}}} : {};
+    return {data: [], layout: layout};
+}
+
+function seriesFigure(traces, title, yTitle, y2Title, template) {
+    return {
+        data: traces,
+        layout: {
+            title: {text: title, font: {size: 14}},
+            xaxis: {anchor: 'y', domain: [0.0, 0.94], title: {text: 'Year'}},
+            yaxis: {anchor: 'x', domain: [0.0, 1.0], title: {text: yTitle}},
+            yaxis2: {anchor: 'x', overlaying: 'y', side: 'right', title: {text: y2Title}},
+            legend: {yanchor: 'bottom', y: -0.5, xanchor: 'center', x: 0.5},
+            template: template
+        }
+    };
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    charts: {
+        pubmed: function(series, template) {
+            if (!series) {
+                return emptyFigure();
+            }
+            var name = wrapTitle(series.name, 40);
+            var s = series.pubmed;
+            if (!s) {
+                return emptyFigure('Publications not found:<br>' + name);
+            }
+            return seriesFigure([
+                {type: 'bar', x: s.year, y: s.count, name: 'No of publications',
+                 marker: {color: 'rgb(2,21,70)'}, xaxis: 'x', yaxis: 'y'},
+                {type: 'scatter', mode: 'lines', x: s.year, y: s.percentage, name: '% from total',
+                 marker: {color: 'red'}, xaxis: 'x', yaxis: 'y2'}
+            ], 'Publications per year:<br>' + name, 'Annual publications', '% of publications that year', template);
+        },
+
+        trials: function(series, template) {
+            if (!series) {
+                return emptyFigure();
+            }
+            var name = wrapTitle(series.name, 50);
+            var s = series.ct;
+            if (!s) {
+                return emptyFigure('Trials not found:<br>' + name);
+            }
+            var noForecast = s.forecast[0] === 0 && s.forecast[1] === 0;
+            var forecast = {x: [2020, 2021], y: s.forecast, name: 'Forecast', marker: {color: 'green'},
+                            xaxis: 'x', yaxis: 'y'};
+            if (noForecast) {
+                forecast.type = 'scatter';
+                forecast.mode = 'lines';
+            } else {
+                forecast.type = 'bar';
+            }
+            return seriesFigure([
+                {type: 'bar', x: s.year, y: s.count, name: 'No of trials',
+                 marker: {color: 'rgb(2,21,70)'}, xaxis: 'x', yaxis: 'y'},
+                forecast,
+                {type: 'scatter', mode: 'lines', x: s.year, y: s.percentage, name: '% from total',
+                 marker: {color: 'red'}, xaxis: 'x', yaxis: 'y2'}
+            ], 'Clinical trials per year:<br>' + name, 'Annual trials', '% of trials that year', template);
+        }
+    }
+});
@@ -0,0 +1,88 @@
+'''
+Benchmark of sql_helper query latency under concurrent callbacks, for different database engine settings:
+    default: sqlalchemy engine with default settings (a new SQLite connection per query)
+    pooled: db.get_engine with SQLite's default PRAGMAs, i.e. only the read-only connection pool
+    tuned: db.get_engine with the PRAGMAs from config.py (mmap_size, cache_size, temp_store, query_only)
+Each thread runs the queries of a search and a row selection (rankings page, drugs, publications and trials per year)
+for random targets and diseases. Results are not memoized: the uncached functions are called.
+
+Usage (from the repository root):
+    python benchmarks/bench_db.py data/20200729pubmed_mini.db [rounds] [threads ...]
+'''
+
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'modules'))
+
+from sqlalchemy import create_engine
+
+import config
+import db
+import sql_helper
+
+
+def engines(db_path):
+    return {'default': create_engine(f'sqlite:///{db_path}', echo=False),
+            'pooled': db.get_engine(db_path, **{name: None for name in db.DEFAULT_PRAGMAS}),
+            'tuned': db.get_engine(db_path, immutable=config.DB_IMMUTABLE, **config.DB_PRAGMAS)}
+
+
+def workload(engine, target_ids, disease_ids, rounds, seed, latencies):
+    rnd = random.Random(seed)
+    for _ in range(rounds):
+        target_id = rnd.choice(target_ids)
+        disease_id = rnd.choice(disease_ids)
+        for func, arg in [(sql_helper.get_rankings_page, target_id),
+                          (sql_helper.get_drug_info, target_id),
+                          (sql_helper.get_pubmed_year, disease_id),
+                          (sql_helper.get_ct_year, disease_id)]:
+            start = time.perf_counter()
+            try:
+                func.uncached(arg, engine)
+            except IndexError:
+                #disease without publications
+                pass
+            latencies.append(time.perf_counter() - start)
+
+
+def run(engine, target_ids, disease_ids, rounds, n_threads):
+    latencies = []
+    threads = [threading.Thread(target=workload, args=(engine, target_ids, disease_ids, rounds, seed, latencies))
+               for seed in range(n_threads)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {'p50': statistics.median(latencies) * 1000,
+            'p95': latencies[int(0.95 * (len(latencies) - 1))] * 1000,
+            'qps': len(latencies) / elapsed}
+
+
+if __name__ == '__main__':
+
+    db_path = sys.argv[1]
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    thread_counts = [int(i) for i in sys.argv[3:]] or [1, 4, 8]
+
+    with create_engine(f'sqlite:///{db_path}').connect() as con:
+        target_ids = [row[0] for row in con.execute('SELECT DISTINCT target_id FROM target_disease')]
+        disease_ids = [row[0] for row in con.execute('SELECT Disease_ID FROM malacard')]
+
+    print(f'{"engine":<8} {"threads":>7} {"p50 ms":>8} {"p95 ms":>8} {"queries/s":>10}')
+    for n_threads in thread_counts:
+        for name, engine in engines(db_path).items():
+            #one untimed round, so the pools are filled and has_table is memoized
+            run(engine, target_ids, disease_ids, 1, n_threads)
+            result = run(engine, target_ids, disease_ids, rounds, n_threads)
+            print(f'{name:<8} {n_threads:>7} {result["p50"]:>8.2f} {result["p95"]:>8.2f} {result["qps"]:>10.0f}')
+            engine.dispose()
@@ -0,0 +1,63 @@
+'''
+Cold-start benchmark of the app.
+Each run starts a fresh Python process (like a gunicorn worker booting or a sleeping dyno waking up) and measures:
+    import: time to import index.py, i.e. until the worker can serve requests
+    first search: time of the first target search (resolve_target + both table callbacks) right after import
+    warm: time until the background warm-up has finished (if the app starts one)
+
+Usage (from the repository root):
+    python benchmarks/bench_startup.py [runs] [target]
+The database is the one from config.py (DB_PATH environment variable).
+'''
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+#Runs inside the fresh process, prints timings as JSON
+PROBE = '''
+import json, sys, threading, time, warnings
+warnings.simplefilter('ignore')
+start = time.perf_counter()
+import index
+imported = time.perf_counter()
+
+from apps import targets
+unwrap = lambda f: getattr(f, '__wrapped__', f)
+target = unwrap(targets.resolve_target)(sys.argv[1])
+unwrap(targets.update_table)(target, 0, 10, [], '')
+unwrap(targets.update_table2)(target)
+searched = time.perf_counter()
+
+warmup = [t for t in threading.enumerate() if t.name == 'warmup']
+for t in warmup:
+    t.join()
+warm = time.perf_counter()
+
+print(json.dumps({'import': imported - start, 'first search': searched - imported,
+                  'warm': (warm - start) if warmup else None}))
+'''
+
+
+def run_once(target):
+    out = subprocess.run([sys.executable, '-c', PROBE, target], cwd=ROOT, check=True,
+                         stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    target = sys.argv[2] if len(sys.argv) > 2 else 'ANG'
+
+    results = [run_once(target) for _ in range(runs)]
+
+    print(f'{runs} cold starts, first search for {target}')
+    for key in ['import', 'first search', 'warm']:
+        values = [r[key] * 1000 for r in results if r[key] is not None]
+        if values:
+            print(f'{key:<14} median {statistics.median(values):8.1f} ms   min {min(values):8.1f} ms   max {max(values):8.1f} ms')
@@ -0,0 +1,108 @@
+'''
+Benchmark of target suggestions: sql_helper.find_similar (linear fuzzywuzzy scan over the targets table)
+against the pre-built trigram index in suggest.py.
+Queries are target abbreviations with one random typo, like the ones users type into the search field.
+The index is timed with different candidate pools (SuggestionIndex candidates, per suggestion asked for),
+each next to its agreement with find_similar:
+    overlap: share of the find_similar top-5 that the index also suggests
+    as good: share of the index suggestions that find_similar scores at least as high as its own 5th suggestion,
+        i.e. overlap that does not count different picks among equally scored targets
+    first: same first suggestion
+
+Usage:
+    python benchmarks/bench_suggest.py data/20200729pubmed_mini.db [number_of_queries]
+'''
+
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'modules'))
+
+from sqlalchemy import create_engine
+
+import sql_helper
+import suggest
+
+
+def make_typo(term, rnd):
+    '''
+    Deletes, replaces, inserts or swaps one character.
+    '''
+    letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+    i = rnd.randrange(len(term))
+    kind = rnd.choice(['delete', 'replace', 'insert', 'swap']) if len(term) > 2 else 'insert'
+    if kind == 'delete':
+        return term[:i] + term[i + 1:]
+    if kind == 'replace':
+        return term[:i] + rnd.choice(letters) + term[i + 1:]
+    if kind == 'insert':
+        return term[:i] + rnd.choice(letters) + term[i:]
+    i = min(i, len(term) - 2)
+    return term[:i] + term[i + 1] + term[i] + term[i + 2:]
+
+
+def timed(func, queries):
+    '''
+    Runs func on every query. Returns list of results and list of latencies in ms.
+    '''
+    results, latencies = [], []
+    for q in queries:
+        start = time.perf_counter()
+        results.append(func(q))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return results, latencies
+
+
+def describe(name, latencies, quality=''):
+    latencies = sorted(latencies)
+    p95 = latencies[int(0.95 * (len(latencies) - 1))]
+    print(f'{name:<28} mean {statistics.mean(latencies):7.3f} ms   median {statistics.median(latencies):7.3f} ms   '
+          f'p95 {p95:7.3f} ms   {quality}')
+
+
+def agreement(queries, old, new, abbrs):
+    '''
+    Agreement of new suggestions with the find_similar ones (old), see the module docstring.
+    '''
+    from fuzzywuzzy import process
+
+    overlap, as_good, first = [], [], []
+    for query, a, b in zip(queries, old, new):
+        overlap.append(len(set(a) & set(b)) / max(len(a), 1))
+        first.append(bool(a) and bool(b) and a[0] == b[0])
+        if a and b:
+            scores = dict(process.extract(query, abbrs, limit=len(abbrs)))
+            fifth = min(scores[x] for x in a)
+            as_good.append(statistics.mean(scores.get(x, 0) >= fifth for x in b))
+
+    return (f'overlap {statistics.mean(overlap):6.1%}   as good {statistics.mean(as_good):6.1%}   '
+            f'first {statistics.mean(first):6.1%}')
+
+
+if __name__ == '__main__':
+
+    db_path = sys.argv[1]
+    n_queries = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    engine = create_engine(f'sqlite:///{db_path}', echo=False)
+    rnd = random.Random(0)
+
+    with engine.connect() as con:
+        abbrs = [row[0] for row in con.execute('SELECT targ_abbr FROM targets') if row[0]]
+    queries = [make_typo(rnd.choice(abbrs), rnd) for _ in range(n_queries)]
+
+    start = time.perf_counter()
+    suggest.SuggestionIndex.from_engine(engine)
+    build_ms = (time.perf_counter() - start) * 1000
+    print(f'{len(abbrs)} targets, {n_queries} queries, index built in {build_ms:.1f} ms')
+
+    old, old_lat = timed(lambda q: sql_helper.find_similar(q, engine), queries)
+    describe('find_similar (linear scan)', old_lat)
+
+    for candidates in [1, 2, 4, 8]:
+        index = suggest.SuggestionIndex.from_engine(engine, candidates=candidates)
+        new, new_lat = timed(lambda q: index.suggest(q, limit=5), queries)
+        describe(f'suggest, candidates={candidates}', new_lat, agreement(queries, old, new, abbrs))
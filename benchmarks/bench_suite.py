@@ -0,0 +1,254 @@
+'''
+Benchmark suite of the hot paths, on synthetic databases of different sizes (see modules/synthetic.py):
+    get_rankings (fast and slow), find_similar, get_ct_year: sql_helper, results not memoized (the uncached functions)
+    get_count_dataframe: counts.py, with the trials per year of the disease
+    update_graph, update_graph2, update_series: chart callbacks of apps/targets.py, with empty result caches
+For each function and database it reports latency percentiles, the number of SQL queries per call and the
+peak memory of one call (Python allocations traced by tracemalloc, SQLite's own memory is not included).
+
+Databases are generated once per size and seed and reused by later runs. Each database is benchmarked
+in a fresh process with DB_PATH pointing at it, because the app opens its database at import.
+Results are written as JSON. Given a previous results file as --baseline, functions whose median latency,
+number of queries or peak memory grew by more than --threshold, and also by more than an absolute minimum
+(--min-ms, MIN_DELTAS), are flagged, and the exit status is 1.
+Latencies vary from run to run by some percent: compare runs on the same, otherwise idle machine.
+With --repeat, each database is benchmarked several times and the best result of each measure is kept.
+
+Usage (from the repository root):
+    python benchmarks/bench_suite.py --sizes small medium -o baseline.json
+    python benchmarks/bench_suite.py --sizes small medium -o results.json --baseline baseline.json --threshold 0.2
+    python benchmarks/bench_suite.py --db data/20200729pubmed_mini.db
+'''
+
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'modules'))
+
+#Generated databases, reused between runs
+DB_DIR = os.path.join(tempfile.gettempdir(), 'drug_matchmaker_bench')
+
+#Growth below these is jitter, not a regression, whatever the relative change (p50 in ms, peak memory in KiB)
+MIN_DELTAS = {'p50': 1.0, 'queries': 0, 'peak_kib': 64}
+
+
+def percentile(latencies, q):
+    latencies = sorted(latencies)
+    return latencies[int(q * (len(latencies) - 1))]
+
+
+def cases(engine, rnd, n_ids=20):
+    '''
+    Benchmarked functions, each called with random targets or diseases of the database.
+
+    Returns:
+        cases: dictionary of name: (function, list of arguments, function called before each call or None)
+    '''
+    import cache
+    import counts
+    import lookup
+    import sql_helper
+    from apps import targets
+
+    with engine.connect() as con:
+        target_ids = [row[0] for row in con.execute('SELECT DISTINCT target_id FROM target_disease')]
+        disease_ids = [row[0] for row in con.execute('SELECT Disease_ID FROM malacard')]
+    target_ids = rnd.sample(target_ids, min(n_ids, len(target_ids)))
+    disease_ids = rnd.sample(disease_ids, min(n_ids, len(disease_ids)))
+    abbrs = lookup.get_index(engine).get_target_names(target_ids)
+    ct_years = [sql_helper.get_ct_year.uncached(i, engine) for i in disease_ids]
+
+    def clear():
+        cache.results.clear()
+        cache.figures.clear()
+
+    return {'get_rankings fast': (lambda i: sql_helper.get_rankings.uncached(i, engine), target_ids, None),
+            'get_rankings slow': (lambda i: sql_helper.get_rankings.uncached(i, engine, fast=False), target_ids, None),
+            'find_similar': (lambda abbr: sql_helper.find_similar(abbr, engine), abbrs, None),
+            'get_ct_year': (lambda i: sql_helper.get_ct_year.uncached(i, engine), disease_ids, None),
+            'get_count_dataframe': (lambda years: counts.get_count_dataframe(years, engine), [y for y in ct_years if y], None),
+            'update_graph': (lambda i: targets.update_graph([i]), disease_ids, clear),
+            'update_graph2': (lambda i: targets.update_graph2([i]), disease_ids, clear),
+            'update_series': (lambda i: targets.update_series([i]), disease_ids, clear)}
+
+
+def measure(func, arguments, before, rounds, rnd, engine):
+    '''
+    Times rounds calls of func with random arguments, then counts the queries and traces the memory of one call.
+
+    Returns:
+        result: dictionary with latency percentiles in ms, queries per call and peak memory in KiB
+    '''
+    from sqlalchemy import event
+
+    queries = []
+    count = lambda *args: queries.append(1)
+
+    #One untimed call, so modules are imported and memoized helpers (e.g. has_table) are loaded
+    if before is not None:
+        before()
+    func(arguments[0])
+
+    latencies = []
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        for _ in range(rounds):
+            argument = rnd.choice(arguments)
+            if before is not None:
+                before()
+            start = time.perf_counter()
+            func(argument)
+            latencies.append((time.perf_counter() - start) * 1000)
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+
+    if before is not None:
+        before()
+    tracemalloc.start()
+    func(arguments[0])
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {'calls': rounds, 'mean': statistics.mean(latencies), 'p50': percentile(latencies, 0.5),
+            'p95': percentile(latencies, 0.95), 'p99': percentile(latencies, 0.99),
+            'queries': len(queries) / rounds, 'peak_kib': peak / 1024}
+
+
+def run_database(rounds, seed):
+    '''
+    Benchmarks the database of config.DB_PATH in this process. Returns dictionary of function name: result.
+    '''
+    import warnings
+    warnings.simplefilter('ignore')
+
+    import index
+    from apps import targets
+
+    rnd = random.Random(seed)
+    results = {}
+    for name, (func, arguments, before) in cases(targets.engine, rnd).items():
+        if arguments:
+            results[name] = measure(func, arguments, before, rounds, rnd, targets.engine)
+
+    return results
+
+
+def benchmark(db_path, rounds, seed, repeat=1):
+    '''
+    Runs run_database in a fresh process with DB_PATH set to db_path, repeat times.
+    Returns its results, with the best (lowest) value of each measure over the repeats.
+    '''
+    env = dict(os.environ, DB_PATH=os.path.abspath(db_path), WARMUP='0', SHARED_CACHE_DIR='')
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), '--run', '--rounds', str(rounds), '--seed', str(seed)],
+                             cwd=ROOT, env=env, check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+        runs.append(json.loads(out.strip().splitlines()[-1]))
+
+    return {name: {key: min(run[name][key] for run in runs) for key in result} for name, result in runs[0].items()}
+
+
+def generated_database(size, seed):
+    '''
+    Path of the synthetic database of a size preset, generated if it does not exist yet.
+    '''
+    import synthetic
+
+    os.makedirs(DB_DIR, exist_ok=True)
+    path = os.path.join(DB_DIR, f'{size}-{seed}.db')
+    if not os.path.exists(path):
+        print(f'generating {size} database: {path}', file=sys.stderr)
+        try:
+            synthetic.generate(path, seed=seed, workers=os.cpu_count() or 1, **synthetic.SIZES[size])
+        except BaseException:
+            #A partly written database would be reused by the next run
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+
+    return path
+
+
+def compare(results, baseline, threshold, min_deltas=MIN_DELTAS):
+    '''
+    Regressions of results against a baseline (both as written by this script): functions whose median latency,
+    number of queries per call or peak memory grew by more than the threshold (a fraction)
+    and by more than min_deltas (absolute, same units as the measures).
+
+    Returns:
+        regressions: list of (database, function, measure, baseline value, new value)
+    '''
+    regressions = []
+    for database, functions in results['databases'].items():
+        for name, result in functions.items():
+            old = baseline.get('databases', {}).get(database, {}).get(name)
+            if old is None:
+                continue
+            for key, min_delta in min_deltas.items():
+                if result[key] > old[key] * (1 + threshold) and result[key] - old[key] > min_delta:
+                    regressions.append((database, name, key, old[key], result[key]))
+
+    return regressions
+
+
+def report(results, baseline=None):
+    for database, functions in results['databases'].items():
+        print(f'\n{database}')
+        print(f'{"function":<20} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"queries":>8} {"peak KiB":>9} {"vs baseline":>12}')
+        for name, r in functions.items():
+            old = (baseline or {}).get('databases', {}).get(database, {}).get(name)
+            change = f'{(r["p50"] / old["p50"] - 1) * 100:+.0f}%' if old and old['p50'] else ''
+            print(f'{name:<20} {r["p50"]:>9.2f} {r["p95"]:>9.2f} {r["p99"]:>9.2f} {r["queries"]:>8.1f} {r["peak_kib"]:>9.0f} {change:>12}')
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmarks the hot paths on synthetic databases.')
+    parser.add_argument('--sizes', nargs='*', default=['small', 'medium', 'large'], help='sizes of generated databases, see synthetic.SIZES')
+    parser.add_argument('--db', nargs='*', default=[], help='existing databases to benchmark as well')
+    parser.add_argument('--rounds', type=int, default=50, help='timed calls per function and database')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the generated databases and of the calls')
+    parser.add_argument('-o', '--output', help='JSON file for the results, to use as a later baseline')
+    parser.add_argument('--baseline', help='JSON results of a previous run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2, help='growth flagged as regression (0.2: 20%%)')
+    parser.add_argument('--min-ms', type=float, default=MIN_DELTAS['p50'], help='smallest growth of the median latency flagged, in ms')
+    parser.add_argument('--repeat', type=int, default=1, help='benchmark each database this many times, keep the best results')
+    parser.add_argument('--run', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        #Inside the fresh process of benchmark()
+        print(json.dumps(run_database(args.rounds, args.seed)))
+        sys.exit(0)
+
+    databases = {size: generated_database(size, args.seed) for size in args.sizes}
+    databases.update((os.path.basename(path), path) for path in args.db)
+    results = {'rounds': args.rounds, 'repeat': args.repeat, 'seed': args.seed, 'python': sys.version.split()[0],
+               'databases': {label: benchmark(path, args.rounds, args.seed, args.repeat) for label, path in databases.items()}}
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    report(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold, dict(MIN_DELTAS, p50=args.min_ms))
+        print(f'\n{len(regressions)} regressions over {args.threshold:.0%} (and {args.min_ms:g} ms)')
+        for database, name, key, old, new in regressions:
+            print(f'{database} {name} {key}: {old:.2f} -> {new:.2f}')
+        sys.exit(1 if regressions else 0)
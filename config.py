@@ -0,0 +1,45 @@
+'''
+App settings. Each value can be overridden with an environment variable of the same name
+(e.g. Heroku config vars).
+'''
+
+import os
+
+#SQLite database snapshot used by the dashboard
+DB_PATH = os.environ.get('DB_PATH', 'data/20200729pubmed_mini.db')
+
+#Read-only connection pool and PRAGMAs (see modules/db.py). An empty string leaves the SQLite default.
+#DB_IMMUTABLE=1 is only safe when the snapshot is not replaced while the app runs
+DB_IMMUTABLE = os.environ.get('DB_IMMUTABLE', '1') == '1'
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+DB_PRAGMAS = {'mmap_size': os.environ.get('DB_MMAP_SIZE', str(256 * 2**20)) or None,
+              'cache_size': os.environ.get('DB_CACHE_SIZE', str(-64 * 2**10)) or None,
+              'temp_store': os.environ.get('DB_TEMP_STORE', 'MEMORY') or None,
+              'query_only': os.environ.get('DB_QUERY_ONLY', 'ON') or None}
+
+#Limits of the in-process result cache (see modules/cache.py)
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 512))
+CACHE_MAX_BYTES = int(os.environ.get('CACHE_MAX_BYTES', 64 * 2**20))
+
+#Limits of the in-process cache of disease chart JSON (cache.figures, see modules/figures.py)
+FIGURE_CACHE_MAX_ENTRIES = int(os.environ.get('FIGURE_CACHE_MAX_ENTRIES', 2048))
+FIGURE_CACHE_MAX_BYTES = int(os.environ.get('FIGURE_CACHE_MAX_BYTES', 64 * 2**20))
+
+#Cache side file shared by the gunicorn workers of a host. Set SHARED_CACHE_DIR to an empty string to disable.
+#It holds pickles, so it must be private to the app's user: not in the shared temp directory (see cache.SharedCache)
+SHARED_CACHE_DIR = os.environ.get('SHARED_CACHE_DIR', os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+                                                                   'drug_matchmaker'))
+SHARED_CACHE_MAX_BYTES = int(os.environ.get('SHARED_CACHE_MAX_BYTES', 256 * 2**20))
+
+#Build the disease charts in the browser from compact series (assets/charts.js) instead of on the server
+CLIENTSIDE_CHARTS = os.environ.get('CLIENTSIDE_CHARTS', '0') == '1'
+
+#Load modules, indexes and the rankings of a default target in a background thread when a worker starts (see apps/targets.py).
+#Set WARMUP_TARGET to an empty string to only load modules and indexes
+WARMUP = os.environ.get('WARMUP', '1') == '1'
+WARMUP_TARGET = os.environ.get('WARMUP_TARGET', 'ANG')
+
+#Batch rankings route /api/rankings (see apps/api.py and modules/batch.py). 
+#Worker processes per request (1: rank in the web worker) and the most targets per request
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', 1))
+BATCH_MAX_TARGETS = int(os.environ.get('BATCH_MAX_TARGETS', 1000))
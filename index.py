@@ -1,9 +1,12 @@
 import dash_core_components as dcc
 import dash_html_components as html
 from dash.dependencies import Input, Output
+from flask import jsonify
 
 from app import app
-from apps import targets, database, team
+from apps import targets, database, team, api
+
+import cache #modules/ is added to the path by apps/targets.py
 
 server = app.server
 app.layout = html.Div([
@@ -24,5 +27,10 @@ def display_page(pathname):
     else:
         return '404'
 
+#Counters of the result cache for monitoring
+@server.route('/stats/cache')
+def cache_stats():
+    return jsonify({'results': cache.results.stats(), 'figures': cache.figures.stats()})
+
 if __name__ == '__main__':
     app.run_server(debug=False)
@@ -0,0 +1,283 @@
+'''
+Rankings for many targets at once.
+Targets (ids or abbreviations/full names) are resolved with the lookup index, then ranked with
+sql_helper.get_rankings in a pool of worker processes, each with its own read-only engine (see db.py).
+Results come back in input order and are written as they arrive, to CSV or Parquet,
+so the output for hundreds of targets is never held in memory at once.
+A target that can not be found or fails gets one row with the error message instead of rankings,
+the other targets are not affected (also if a worker process crashes). A target whose top_k or min_n0 cut
+leaves no diseases has no rows.
+
+Parquet output needs pyarrow, which the app does not install (pip install pyarrow).
+
+Usage:
+    python modules/batch.py data/20200729pubmed_mini.db ANG 1841 TP53 -o rankings.csv
+    python modules/batch.py data/20200729pubmed_mini.db --file targets.txt -o rankings.parquet --workers 4
+apps/api.py serves the same as an HTTP route.
+'''
+
+import argparse
+import csv
+import io
+import os
+import sys
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import pandas as pd
+
+import db
+import lookup
+import sql_helper
+
+
+#Columns of the output. Rows of failed targets only have query and error
+COLUMNS = ['query', 'target_id', 'targ_abbr', 'disease', 'f0', 'f1', 'f2', 'pmi', 'error']
+
+
+def resolve_targets(terms, engine):
+    '''
+    Resolves search terms to targets. Terms made of digits are target ids,
+    others abbreviations or full names (like the search field of the app).
+
+    Arguments:
+        terms: list of target ids or names
+        engine: sqlalchemy engine, connected to the database
+    Returns:
+        targets: list of (query, target_id, targ_abbr, error), target_id is None if not found
+    '''
+    index = lookup.get_index(engine)
+    targets = []
+    for term in terms:
+        query = str(term).strip()
+        if query.isdigit():
+            abbr = index.get_target_names([int(query)])[0]
+            info = (int(query), abbr) if abbr is not None else None
+        else:
+            info = index.get_target_id(query)
+            info = info[:2] if info != 'NaN' else None
+        if info is None:
+            targets.append((query, None, None, 'target not found'))
+        else:
+            targets.append((query, int(info[0]), info[1], None))
+
+    return targets
+
+
+#Engine of the worker process, set by _init_worker
+_engine = None
+
+
+def _init_worker(db_path):
+    global _engine
+    _engine = db.get_engine(db_path, pool_size=1)
+
+
+def _error_row(target, error):
+    query, target_id, abbr, _ = target
+    return pd.DataFrame([{'query': query, 'target_id': target_id, 'targ_abbr': abbr, 'error': error}], columns=COLUMNS)
+
+
+def rank_target(target, engine=None, fast=True, metric='pmi', top_k=None, min_n0=None):
+    '''
+    Rankings of one resolved target, as rows for the output. Errors are returned, not raised.
+
+    Arguments:
+        target: (query, target_id, targ_abbr, error) from resolve_targets
+        engine: sqlalchemy engine, connected to the database. None: the engine of the worker process
+        fast, metric, top_k, min_n0: see sql_helper.get_rankings
+    Returns:
+        df: dataframe with COLUMNS. No rows if the top_k or min_n0 cut leaves no diseases
+    '''
+    query, target_id, abbr, error = target
+    if error is not None:
+        return _error_row(target, error)
+    try:
+        #Not memoized: a batch would fill the result cache with rankings nobody asks for again
+        df = sql_helper.get_rankings.uncached(target_id, engine or _engine, fast=fast,
+                                              metric=metric, top_k=top_k, min_n0=min_n0)
+    except Exception as e:
+        return _error_row(target, f'{type(e).__name__}: {e}')
+    if df.empty and top_k is None and min_n0 is None:
+        return _error_row(target, 'no rankings for target')
+
+    df = df[['disease', 'f0', 'f1', 'f2', 'pmi']].copy()
+    df.insert(0, 'query', query)
+    df.insert(1, 'target_id', target_id)
+    df.insert(2, 'targ_abbr', abbr)
+    df['error'] = None
+
+    return df[COLUMNS]
+
+
+def rank_chunk(targets, **kwargs):
+    '''
+    rank_target for a few targets, so a worker process gets them in one task. Returns a list of dataframes.
+    '''
+    return [rank_target(target, **kwargs) for target in targets]
+
+
+def _chunk_results(chunk, future):
+    #A crashed worker (BrokenProcessPool) fails all unfinished tasks: each of their targets gets an error row
+    try:
+        return future.result()
+    except Exception as e:
+        return [_error_row(target, f'{type(e).__name__}: {e}') for target in chunk]
+
+
+def _ranked_chunks(executor, chunks, options, window):
+    '''
+    Rankings of the chunks by the worker processes, in order. At most window chunks are submitted whose
+    results were not read yet, so a slow consumer does not make all results pile up in memory.
+    Chunks that were not started are cancelled when the generator is closed.
+    '''
+    chunks = iter(chunks)
+    pending = deque()
+
+    def submit():
+        for chunk in chunks:
+            try:
+                future = executor.submit(rank_chunk, chunk, **options)
+            except Exception as e:
+                #A broken pool also refuses new tasks, their targets get error rows too
+                future = Future()
+                future.set_exception(e)
+            pending.append((chunk, future))
+            return
+
+    for _ in range(window):
+        submit()
+    try:
+        while pending:
+            chunk, future = pending.popleft()
+            rows = _chunk_results(chunk, future)
+            submit()
+            yield from rows
+    finally:
+        for chunk, future in pending:
+            future.cancel()
+
+
+def rank_targets(terms, db_path, workers=1, fast=True, progress=None, engine=None, metric='pmi', top_k=None, min_n0=None,
+                 chunk_size=4):
+    '''
+    Generator of rankings for many targets, one dataframe per target in input order.
+
+    Arguments:
+        terms: list of target ids or names
+        db_path: path to the SQLite database
+        workers: number of worker processes. 1: rank in this process
+        fast: see sql_helper.get_rankings
+        progress: optional function called after each target with (done, total, query, error)
+        engine: engine used in this process (e.g. the one of the app). None: open one for db_path
+        metric, top_k, min_n0: see sql_helper.get_rankings
+        chunk_size: targets per task of a worker process
+    Yields:
+        df: dataframe with COLUMNS for one target
+    '''
+    if metric not in sql_helper.RANKING_METRICS:
+        raise ValueError(f'Unsupported metric: {metric}')
+    engine = engine or db.get_engine(db_path, pool_size=1)
+    targets = resolve_targets(terms, engine)
+    options = {'fast': fast, 'metric': metric, 'top_k': top_k, 'min_n0': min_n0}
+
+    if workers == 1:
+        results = (rank_target(target, engine, **options) for target in targets)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(db_path,))
+        chunks = (targets[start:start + chunk_size] for start in range(0, len(targets), chunk_size))
+        results = _ranked_chunks(executor, chunks, options, window=2 * workers)
+
+    try:
+        for done, (target, df) in enumerate(zip(targets, results), 1):
+            if progress is not None:
+                progress(done, len(targets), target[0], df['error'].iloc[0] if len(df) else None)
+            yield df
+    finally:
+        if executor is not None:
+            #Also when the consumer stops early, e.g. a closed HTTP connection: tasks not started are dropped
+            results.close()
+            executor.shutdown()
+
+
+def iter_csv(frames):
+    '''
+    Turns the dataframes of rank_targets into chunks of CSV text (header first), e.g. for a streamed HTTP response.
+    '''
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(COLUMNS)
+    yield buffer.getvalue()
+    for df in frames:
+        yield df.to_csv(header=False, index=False)
+
+
+def parquet_schema():
+    import pyarrow as pa
+    return pa.schema([('query', pa.string()), ('target_id', pa.int64()), ('targ_abbr', pa.string()),
+                      ('disease', pa.string()), ('f0', pa.float64()), ('f1', pa.float64()), ('f2', pa.float64()),
+                      ('pmi', pa.float64()), ('error', pa.string())])
+
+
+def write_parquet(frames, sink):
+    '''
+    Writes the dataframes of rank_targets to a Parquet file (path or binary file object), one row group per target.
+    Needs pyarrow.
+    '''
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError('Parquet output needs pyarrow: pip install pyarrow') from None
+
+    schema = parquet_schema()
+    with pq.ParquetWriter(sink, schema) as writer:
+        for df in frames:
+            writer.write_table(pa.Table.from_pandas(df.astype({'target_id': 'Int64'}), schema=schema, preserve_index=False))
+
+
+def write_output(frames, path):
+    '''
+    Writes the dataframes of rank_targets to a .csv or .parquet file.
+    '''
+    if path.endswith('.parquet'):
+        write_parquet(frames, path)
+    else:
+        with open(path, 'w', newline='') as f:
+            for chunk in iter_csv(frames):
+                f.write(chunk)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Ranks diseases for many targets.')
+    parser.add_argument('db', help='path to the SQLite database')
+    parser.add_argument('targets', nargs='*', help='target ids, abbreviations or full names')
+    parser.add_argument('--file', help='file with one target per line')
+    parser.add_argument('-o', '--output', required=True, help='output file, .csv or .parquet')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='worker processes')
+    parser.add_argument('--slow', action='store_true', help='compute rankings from the article tables (fast=False)')
+    parser.add_argument('--metric', default='pmi', choices=['f0', 'f1', 'f2', 'pmi'], help='metric to sort and cut by')
+    parser.add_argument('--top-k', type=int, default=None, help='only the top k diseases per target')
+    parser.add_argument('--min-n0', type=int, default=None, help='only diseases mentioned with the target in at least this many articles')
+    args = parser.parse_args()
+
+    terms = list(args.targets)
+    if args.file:
+        with open(args.file) as f:
+            terms += [line.strip() for line in f if line.strip()]
+
+    failed = []
+
+    def report(done, total, query, error):
+        if error is not None:
+            failed.append((query, error))
+        print(f'\r{done}/{total} targets', end='', file=sys.stderr)
+
+    frames = rank_targets(terms, args.db, args.workers, fast=not args.slow, progress=report,
+                          metric=args.metric, top_k=args.top_k, min_n0=args.min_n0)
+    write_output(frames, args.output)
+    print(file=sys.stderr)
+    for query, error in failed:
+        print(f'{query}: {error}', file=sys.stderr)
+    print(f'{len(terms) - len(failed)} targets ranked, {len(failed)} failed, written to {args.output}', file=sys.stderr)
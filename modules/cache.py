@@ -0,0 +1,478 @@
+'''
+Memoization of sql_helper results.
+The database is a read-only dated snapshot, so a result for given arguments never changes
+as long as the DB file is the same. The cache key includes the DB file identity (path, size, mtime),
+so copying a new snapshot in place invalidates old entries automatically.
+Each process has its own in-memory ResultCache. A SharedCache side file can be attached to it,
+so gunicorn workers on the same host compute each result only once.
+'''
+
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+#numpy and pandas are not imported here, so the app can configure caches before loading them (see apps/targets.py).
+#A value can only be a numpy or pandas object once the module has been imported by someone else.
+
+def _is_pandas(value):
+    pd = sys.modules.get('pandas')
+    return pd is not None and isinstance(value, (pd.DataFrame, pd.Series))
+
+
+def _dumps(value):
+    #Pickled value, None if it can not be pickled
+    try:
+        return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        return None
+
+
+def sizeof(value, blob=None):
+    '''
+    Approximate size of a cached value in bytes.
+    blob is the value already pickled, if the caller has it, so it is not pickled again.
+    '''
+    if _is_pandas(value):
+        usage = value.memory_usage(deep=True)
+        return int(usage.sum()) if value.ndim == 2 else int(usage)
+    blob = blob if blob is not None else _dumps(value)
+
+    return len(blob) if blob is not None else sys.getsizeof(value)
+
+
+def db_identity(engine):
+    '''
+    Identifies the database file behind the engine: path, size and modification time.
+    For in-memory databases it is just the engine url.
+    '''
+    path = engine.url.database
+    if not path or path == ':memory:':
+        return str(engine.url)
+    try:
+        st = os.stat(path)
+    except OSError:
+        return str(engine.url)
+
+    return (os.path.realpath(path), st.st_size, st.st_mtime_ns)
+
+
+class ResultCache:
+    '''
+    Thread-safe LRU cache bounded both by number of entries and by approximate size in bytes.
+    Keeps hit/miss/eviction counters, see stats().
+
+    Arguments:
+        max_entries: maximum number of entries
+        max_bytes: maximum total size of entries in bytes
+    '''
+
+    def __init__(self, max_entries=512, max_bytes=64 * 2**20):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.shared = None
+        self.shared_hits = 0
+
+    def attach(self, shared):
+        '''
+        Puts a SharedCache behind this cache: local misses are looked up there,
+        and new values are written to both.
+        '''
+        self.shared = shared
+
+    def configure(self, max_entries=None, max_bytes=None):
+        '''
+        Changes the limits, evicting entries if the cache is now over them.
+        '''
+        with self._lock:
+            if max_entries is not None:
+                self.max_entries = max_entries
+            if max_bytes is not None:
+                self.max_bytes = max_bytes
+            self._evict()
+
+    def get(self, key):
+        '''
+        Returns (True, value) on hit and (False, None) on miss.
+        '''
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, self._entries[key][0]
+
+        if self.shared is not None:
+            hit, value = self.shared.get(key)
+            if hit:
+                self._store(key, value)
+                with self._lock:
+                    self.shared_hits += 1
+                return True, value
+
+        with self._lock:
+            self.misses += 1
+        return False, None
+
+    def set(self, key, value):
+        '''
+        Stores the value. Values bigger than the whole byte budget are not stored.
+        '''
+        #Pickled once, for the shared cache and the size
+        blob = _dumps(value) if self.shared is not None or not _is_pandas(value) else None
+        if self.shared is not None and blob is not None:
+            self.shared.set(key, value, blob=blob)
+        self._store(key, value, sizeof(value, blob))
+
+    def _store(self, key, value, size=None):
+        size = size if size is not None else sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            self._evict()
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, (_, size) = self._entries.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        '''
+        Returns the counters and current usage as a dictionary.
+        '''
+        with self._lock:
+            stats = {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                     'entries': len(self._entries), 'bytes': self._bytes,
+                     'max_entries': self.max_entries, 'max_bytes': self.max_bytes,
+                     'shared_hits': self.shared_hits}
+        if self.shared is not None:
+            stats['shared'] = self.shared.stats()
+
+        return stats
+
+
+def _check_private(path):
+    '''
+    Raises PermissionError if path belongs to another user or can be written by others than its owner.
+    '''
+    st = os.stat(path)
+    if hasattr(os, 'getuid') and st.st_uid != os.getuid():
+        raise PermissionError(f'{path} belongs to another user')
+    if st.st_mode & 0o022:
+        raise PermissionError(f'{path} can be written by other users')
+
+
+class SharedCache:
+    '''
+    Cache in a SQLite side file that all worker processes on a host can read and write.
+    Values are pickled. Every write (insert + eviction) runs in one IMMEDIATE transaction,
+    so other processes never see a partial update. When the total size goes over max_bytes,
+    least recently used entries are deleted.
+    There is one file per database snapshot, named after it. If the snapshot file changes
+    (size or mtime), the side file is emptied on open.
+    Unpickling runs code named in the file, so the directory and file are created private (0o700, 0o600)
+    and PermissionError is raised if they belong to another user or others can write to them.
+
+    Arguments:
+        directory: directory for the side files, created if missing
+        engine: sqlalchemy engine of the served database
+        max_bytes: maximum total size of pickled values
+    '''
+
+    def __init__(self, directory, engine, max_bytes=256 * 2**20):
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        _check_private(directory)
+        snapshot = os.path.basename(engine.url.database or 'memory')
+        self.path = os.path.join(directory, f'{snapshot}.cache.sqlite')
+        #SQLite gives the -wal and -shm files the permissions of the database file
+        os.close(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600))
+        _check_private(self.path)
+        self.identity = repr(db_identity(engine))
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self.evictions = 0
+
+        con = self._connect()
+        with con:
+            con.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB, size INTEGER, accessed REAL)')
+            con.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)')
+            con.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)')
+        self._invalidate_if_stale()
+
+    def _connect(self):
+        #sqlite3 connections can not be shared between threads
+        con = getattr(self._local, 'con', None)
+        if con is None:
+            con = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            con.execute('PRAGMA journal_mode=WAL')
+            con.execute('PRAGMA synchronous=NORMAL')
+            self._local.con = con
+        return con
+
+    def _invalidate_if_stale(self):
+        con = self._connect()
+        con.execute('BEGIN IMMEDIATE')
+        try:
+            row = con.execute("SELECT value FROM meta WHERE name = 'snapshot'").fetchone()
+            if row is None or row[0] != self.identity:
+                con.execute('DELETE FROM entries')
+                con.execute("INSERT OR REPLACE INTO meta VALUES ('snapshot', ?)", (self.identity,))
+            con.execute('COMMIT')
+        except Exception:
+            con.execute('ROLLBACK')
+            raise
+
+    @staticmethod
+    def _key(key):
+        return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        '''
+        Returns (True, value) on hit and (False, None) on miss.
+        '''
+        k = self._key(key)
+        try:
+            con = self._connect()
+            row = con.execute('SELECT value FROM entries WHERE key = ?', (k,)).fetchone()
+            if row is None:
+                return False, None
+            try:
+                value = pickle.loads(row[0])
+            except Exception:
+                #Any unpickling error is a miss, e.g. a class that was renamed or moved since the entry was written
+                con.execute('DELETE FROM entries WHERE key = ?', (k,))
+                return False, None
+            #Recency is only a hint for eviction, skip it if another worker holds the lock
+            try:
+                con.execute('UPDATE entries SET accessed = ? WHERE key = ?', (time.time(), k))
+            except sqlite3.OperationalError:
+                pass
+            return True, value
+        except sqlite3.Error:
+            return False, None
+
+    def set(self, key, value, blob=None):
+        '''
+        Stores the value (blob: the value already pickled) and evicts least recently used entries if over max_bytes.
+        Failures (e.g. unpicklable value, locked file) are ignored: the shared cache is only an optimisation.
+        '''
+        blob = blob if blob is not None else _dumps(value)
+        if blob is None or len(blob) > self.max_bytes:
+            return
+
+        con = self._connect()
+        try:
+            con.execute('BEGIN IMMEDIATE')
+        except sqlite3.OperationalError:
+            return
+        try:
+            con.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)',
+                        (self._key(key), blob, len(blob), time.time()))
+            total = con.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+            if total > self.max_bytes:
+                evicted = 0
+                for k, size in con.execute('SELECT key, size FROM entries ORDER BY accessed').fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    con.execute('DELETE FROM entries WHERE key = ?', (k,))
+                    total -= size
+                    evicted += 1
+                self.evictions += evicted
+            con.execute('COMMIT')
+        except sqlite3.Error:
+            con.execute('ROLLBACK')
+
+    def clear(self):
+        con = self._connect()
+        con.execute('DELETE FROM entries')
+
+    def stats(self):
+        '''
+        Returns the counters and current usage as a dictionary. Served by the /stats/cache route,
+        so it leaves out the path of the file (self.path).
+        '''
+        try:
+            entries, size = self._connect().execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        except sqlite3.Error:
+            entries, size = None, None
+        return {'entries': entries, 'bytes': size,
+                'max_bytes': self.max_bytes, 'evictions': self.evictions}
+
+
+#Shared cache for sql_helper results. Limits can be changed with results.configure()
+results = ResultCache()
+
+#Disease chart JSON strings, keyed by chart, disease_id and DB snapshot (see figures.py)
+figures = ResultCache(max_entries=2048, max_bytes=64 * 2**20)
+
+
+def _plain(value):
+    #numpy scalars (e.g. ids taken from a dataframe) should give the same key as python ints
+    np = sys.modules.get('numpy')
+    if np is not None and isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _copy(value):
+    #Callers may modify returned frames/dicts, the cached copy must stay intact.
+    #Containers are copied with the frames inside them, e.g. (frame, page_count) results
+    if _is_pandas(value):
+        return value.copy()
+    if isinstance(value, tuple):
+        items = [_copy(v) for v in value]
+        return type(value)(*items) if hasattr(value, '_fields') else tuple(items)
+    if isinstance(value, list):
+        return [_copy(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _copy(v) for k, v in value.items()}
+    return value
+
+
+def _hash_code(code, digest):
+    digest.update(code.co_code)
+    digest.update(repr(code.co_names).encode('utf-8'))
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            #Comprehensions and nested functions: their repr has a memory address, hash their code instead
+            _hash_code(const, digest)
+        elif isinstance(const, frozenset):
+            #Set order depends on the per-process string hash seed
+            digest.update(repr(sorted(const, key=repr)).encode('utf-8'))
+        else:
+            digest.update(repr(const).encode('utf-8'))
+
+
+#Only functions of the app itself are followed by code_version
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _own(value):
+    return inspect.isfunction(value) and os.path.abspath(value.__code__.co_filename).startswith(_ROOT + os.sep)
+
+
+def _code_names(code):
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            names |= _code_names(const)
+    return names
+
+
+def _hash_global(value, digest, seen):
+    if inspect.isfunction(value):
+        value = inspect.unwrap(value)
+        if _own(value):
+            _hash_function(value, digest, seen)
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            _hash_global(key, digest, seen)
+            _hash_global(item, digest, seen)
+    elif isinstance(value, (tuple, list)):
+        for item in value:
+            _hash_global(item, digest, seen)
+    elif value is None or isinstance(value, (bool, int, float, str, bytes)):
+        digest.update(repr(value).encode('utf-8'))
+
+
+def _hash_function(func, digest, seen):
+    if func in seen:
+        return
+    seen.add(func)
+    _hash_code(func.__code__, digest)
+
+    names = sorted(_code_names(func.__code__))
+    for name in names:
+        #Modules imported inside the function are not in its globals
+        value = func.__globals__.get(name, sys.modules.get(name))
+        if inspect.ismodule(value):
+            #Functions of other app modules called as attributes, e.g. counts.get_count_dataframe
+            if os.path.abspath(getattr(value, '__file__', None) or '/').startswith(_ROOT + os.sep):
+                for attr in names:
+                    if _own(getattr(value, attr, None)):
+                        _hash_global(getattr(value, attr), digest, seen)
+        elif inspect.isfunction(value) or name.isupper():
+            #Called functions and constants (e.g. CHARTS, FIGURE_VERSION). Other globals can be
+            #mutable state (e.g. loaded indexes), which would give each process another version
+            _hash_global(value, digest, seen)
+
+
+def code_version(func):
+    '''
+    Hash of a function's code that is the same in every process (unlike repr(co_consts),
+    which contains addresses of nested code objects) and changes when the code changes.
+    It covers the functions of the app it calls by name (also through other app modules and
+    UPPER_CASE constants, e.g. a dictionary of functions) and those constants, recursively.
+    Methods of objects it gets at run time are not followed.
+    '''
+    digest = hashlib.sha1()
+    _hash_function(inspect.unwrap(func), digest, set())
+
+    return digest.hexdigest()[:12]
+
+
+def memoize(func=None, cache=None):
+    '''
+    Decorator for functions that take an `engine` argument and only read from the database.
+    The key is the function name and code version, the DB file identity and all other arguments 
+    (which need to be hashable).
+    Exceptions are not cached.
+
+    Arguments:
+        func: function to wrap
+        cache: ResultCache to use. Default: cache.results
+    '''
+    if func is None:
+        return functools.partial(memoize, cache=cache)
+
+    signature = inspect.signature(func)
+    #The shared side file outlives a deploy: a changed function, or a changed helper of it, must not
+    #get results of its old version. Computed at the first call, when the helpers are all defined
+    names = []
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        store = cache if cache is not None else results
+        if not names:
+            names.append(f'{func.__module__}.{func.__qualname__}:{code_version(func)}')
+        name = names[0]
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        arguments = dict(bound.arguments)
+        engine = arguments.pop('engine')
+        key = (name, db_identity(engine), tuple(sorted((k, _plain(v)) for k, v in arguments.items())))
+
+        hit, value = store.get(key)
+        if hit:
+            return _copy(value)
+
+        value = func(*args, **kwargs)
+        store.set(key, _copy(value))
+
+        return value
+
+    wrapper.uncached = func
+
+    return wrapper
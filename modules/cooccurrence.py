@@ -0,0 +1,326 @@
+'''
+Offline builder of the target_disease table, which the fast path of sql_helper.get_rankings and
+get_rankings_page read.
+The slow path of get_rankings counts co-occurrences of one target at a time with SQL joins. Here
+target_pubmed and disease_pubmed are loaded once as sparse incidence matrices (targets x articles and
+articles x diseases), and their product gives n0 for every target-disease pair at once.
+n2 and n3 are the numbers of rows per target and per disease (same as tg_count and dis_count),
+n1 is the number of articles in the pubmed table.
+Targets are split into chunks that worker processes multiply and score with ranking.score_batch.
+At most two chunks per worker are submitted and not yet written, so only those results are in memory
+at a time. Each worker has its own copy of the incidence matrices: shared copy-on-write where processes
+are forked (Linux), pickled into every worker where they are spawned (macOS, Windows). The rows are written to a new table that
+replaces target_disease in one transaction, then its indexes are rebuilt and the corpus counts
+(n1, n2, n3) that ingest.py updates are written (see migrations.py).
+
+With --years, the same matrices are also split by publication year into a per-year cube, from which
+sql_helper.get_year_rankings computes rankings for a range of years or with a recency decay:
+    target_disease_year (target_id, disease_id, year, n0)
+    corpus_year_counts (year, n1), target_year_counts (target_id, year, n2), disease_year_counts (disease_id, year, n3)
+Articles without a year are left out of the cube.
+
+Usage:
+    python modules/cooccurrence.py data/20200729pubmed_mini.db --workers 4 --chunk-size 2000
+    python modules/cooccurrence.py data/20200729pubmed_mini.db --years
+'''
+
+import argparse
+import os
+import sqlite3
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import numpy as np
+from scipy import sparse
+
+import migrations
+import ranking
+
+
+#Columns of the built table: ids, the counts behind the metrics and the metrics
+COLUMNS = ['target_id', 'disease_id', 'n0', 'n2', 'n3', 'f0', 'f1', 'f2', 'pmi']
+
+
+def load_pairs(con, table, column, batch_size=10**6):
+    '''
+    Reads the (pmid, id) rows of a link table (target_pubmed or disease_pubmed) in batches.
+
+    Arguments:
+        con: sqlite3 connection to the database
+        table: table name
+        column: id column, target_id or disease_id
+        batch_size: number of rows fetched at a time
+    Returns:
+        pmids: int64 array
+        ids: int64 array of the same length
+    '''
+    cursor = con.execute(f"""
+    SELECT pmid, {column}
+    FROM {table}
+    WHERE pmid IS NOT NULL AND {column} IS NOT NULL
+    """)
+    parts = []
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        parts.append(np.array(rows, dtype=np.int64))
+    pairs = np.concatenate(parts) if parts else np.empty((0, 2), dtype=np.int64)
+
+    return pairs[:, 0], pairs[:, 1]
+
+
+def incidence(rows, cols, row_ids, col_ids):
+    '''
+    Sparse matrix with the number of link rows for each (row id, column id) pair.
+    Ids are mapped to positions in the sorted arrays row_ids and col_ids.
+    Duplicate rows add up, like they do in the SQL joins of the slow path.
+    '''
+    matrix = sparse.coo_matrix((np.ones(len(rows), dtype=np.int64),
+                                (np.searchsorted(row_ids, rows), np.searchsorted(col_ids, cols))),
+                               shape=(len(row_ids), len(col_ids)))
+
+    return matrix.tocsr()
+
+
+def build_matrices(con):
+    '''
+    Loads the link tables as sparse matrices.
+
+    Arguments:
+        con: sqlite3 connection to the database
+    Returns:
+        state: dictionary with
+            targets: CSR matrix targets x articles
+            diseases: CSR matrix articles x diseases
+            target_ids, disease_ids: ids of the matrix rows and columns
+            pmids: articles of the matrix columns (targets) and rows (diseases)
+            n2, n3: rows per target and per disease in the link tables
+    '''
+    tp_pmid, tp_target = load_pairs(con, 'target_pubmed', 'target_id')
+    dp_pmid, dp_disease = load_pairs(con, 'disease_pubmed', 'disease_id')
+
+    target_ids = np.unique(tp_target)
+    disease_ids = np.unique(dp_disease)
+    n2 = np.bincount(np.searchsorted(target_ids, tp_target), minlength=len(target_ids))
+    n3 = np.bincount(np.searchsorted(disease_ids, dp_disease), minlength=len(disease_ids))
+
+    #Only articles that mention both a target and a disease add to n0, the matrices leave out the others
+    pmids = np.intersect1d(tp_pmid, dp_pmid)
+    keep = np.isin(tp_pmid, pmids)
+    targets = incidence(tp_target[keep], tp_pmid[keep], target_ids, pmids)
+    keep = np.isin(dp_pmid, pmids)
+    diseases = incidence(dp_pmid[keep], dp_disease[keep], pmids, disease_ids)
+
+    return {'targets': targets, 'diseases': diseases, 'target_ids': target_ids, 'disease_ids': disease_ids,
+            'pmids': pmids, 'n2': n2, 'n3': n3}
+
+
+#Matrices and counts of the worker process, set by _init_worker
+_state = {}
+
+
+def _init_worker(state):
+    _state.update(state)
+
+
+def score_chunk(start, stop):
+    '''
+    Computes n0 and the metrics for the targets in rows start:stop of the matrices in _state.
+    Returns:
+        columns: tuple of arrays in the order of COLUMNS, one element per pair with n0 > 0
+    '''
+    n0 = (_state['targets'][start:stop] @ _state['diseases']).tocoo()
+    rows = n0.row + start
+    n2 = _state['n2'][rows]
+    n3 = _state['n3'][n0.col]
+
+    scores = ranking.score_batch(n0=n0.data, n1=_state['n1'], n2=n2, n3=n3)
+
+    return (_state['target_ids'][rows], _state['disease_ids'][n0.col], n0.data, n2, n3,
+            *[scores[col].to_numpy() for col in ['f0', 'f1', 'f2', 'pmi']])
+
+
+def in_order(executor, func, args, window):
+    '''
+    Like executor.map(func, *zip(*args)), but with at most window calls submitted whose results were
+    not consumed yet (map submits all of them at once, and their results pile up until they are read).
+    Calls that were not started are cancelled when the generator is closed.
+    '''
+    args = iter(args)
+    pending = deque(executor.submit(func, *arg) for arg in islice(args, window))
+    try:
+        while pending:
+            result = pending.popleft().result()
+            for arg in islice(args, 1):
+                pending.append(executor.submit(func, *arg))
+            yield result
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def build_target_disease(db_path, workers=None, chunk_size=2000, n1=None):
+    '''
+    Computes all target-disease rankings and replaces the target_disease table.
+
+    Arguments:
+        db_path: path to the SQLite database
+        workers: number of worker processes. None: number of CPUs. 1: no worker processes
+        chunk_size: number of targets per chunk
+        n1: number of all articles. None: count the rows of the pubmed table
+    Returns:
+        n_rows: number of target-disease rows written
+    '''
+    con = sqlite3.connect(db_path)
+    state = build_matrices(con)
+    state['n1'] = n1 if n1 is not None else con.execute('SELECT COUNT(*) FROM pubmed').fetchone()[0]
+
+    n_targets = len(state['target_ids'])
+    starts = list(range(0, n_targets, chunk_size))
+    stops = [min(start + chunk_size, n_targets) for start in starts]
+    workers = workers or os.cpu_count() or 1
+
+    if workers == 1:
+        _init_worker(state)
+        chunks = map(score_chunk, starts, stops)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(state,))
+        #Results come in order, so rows are written sorted by target
+        chunks = in_order(executor, score_chunk, zip(starts, stops), window=2 * workers)
+
+    n_rows = 0
+    try:
+        with con:
+            con.execute('DROP TABLE IF EXISTS target_disease_new')
+            con.execute("""
+            CREATE TABLE target_disease_new (
+                target_id INTEGER NOT NULL,
+                disease_id INTEGER NOT NULL,
+                n0 INTEGER NOT NULL,
+                n2 INTEGER NOT NULL,
+                n3 INTEGER NOT NULL,
+                f0 REAL,
+                f1 REAL,
+                f2 REAL,
+                pmi REAL
+            )
+            """)
+            for chunk in chunks:
+                #NaN metrics (see ranking.score_batch) are stored as NULL
+                con.executemany(f'INSERT INTO target_disease_new VALUES ({", ".join("?" * len(COLUMNS))})',
+                                zip(*[column.tolist() for column in chunk]))
+                n_rows += len(chunk[0])
+            con.execute('DROP TABLE IF EXISTS target_disease')
+            con.execute('ALTER TABLE target_disease_new RENAME TO target_disease')
+    finally:
+        if executor is not None:
+            chunks.close()
+            executor.shutdown()
+
+    #Counts for incremental updates (see ingest.py), with the same n1
+    migrations.migrate_corpus_counts(con, n1=state['n1'])
+    migrations.create_indexes(con, tables=['target_disease'])
+    con.execute('ANALYZE target_disease')
+    con.commit()
+    con.close()
+
+    return n_rows
+
+
+#Tables of the per-year cube: (name, columns, primary key)
+YEAR_TABLES = [('target_disease_year', 'target_id INTEGER NOT NULL, disease_id INTEGER NOT NULL, year INTEGER NOT NULL, n0 INTEGER NOT NULL',
+                'target_id, year, disease_id'),
+               ('corpus_year_counts', 'year INTEGER NOT NULL, n1 INTEGER NOT NULL', 'year'),
+               ('target_year_counts', 'target_id INTEGER NOT NULL, year INTEGER NOT NULL, n2 INTEGER NOT NULL', 'target_id, year'),
+               ('disease_year_counts', 'disease_id INTEGER NOT NULL, year INTEGER NOT NULL, n3 INTEGER NOT NULL', 'disease_id, year')]
+
+
+def build_year_cube(db_path):
+    '''
+    Computes n0 for every target-disease pair and publication year, and n1, n2, n3 per year,
+    and replaces the tables in YEAR_TABLES.
+    The article columns of the incidence matrices are sorted by year, so the counts of one year are the product
+    of one contiguous slice of both matrices.
+
+    Arguments:
+        db_path: path to the SQLite database
+    Returns:
+        n_rows: number of target_disease_year rows written
+    '''
+    con = sqlite3.connect(db_path)
+    state = build_matrices(con)
+
+    #Year of each matrix article, articles without a year are dropped
+    pub_pmids, pub_years = load_pairs(con, 'pubmed', 'year')
+    order = np.argsort(pub_pmids, kind='stable')
+    pub_pmids, pub_years = pub_pmids[order], pub_years[order]
+    pos = np.minimum(np.searchsorted(pub_pmids, state['pmids']), max(len(pub_pmids) - 1, 0))
+    has_year = (pub_pmids[pos] == state['pmids']) if len(pub_pmids) else np.zeros(len(state['pmids']), dtype=bool)
+    articles = np.flatnonzero(has_year)
+    years = pub_years[pos[articles]]
+    order = np.argsort(years, kind='stable')
+    articles, years = articles[order], years[order]
+
+    targets = state['targets'].tocsc()[:, articles].tocsr()
+    diseases = state['diseases'][articles]
+    bounds = np.flatnonzero(np.diff(years)) + 1
+
+    n_rows = 0
+    with con:
+        for table, columns, key in YEAR_TABLES:
+            con.execute(f'DROP TABLE IF EXISTS {table}')
+            con.execute(f'CREATE TABLE {table} ({columns}, PRIMARY KEY ({key})) WITHOUT ROWID')
+
+        for start, stop in zip(np.r_[0, bounds], np.r_[bounds, len(years)]):
+            if start == stop:
+                continue
+            n0 = (targets[:, start:stop] @ diseases[start:stop]).tocoo()
+            con.executemany('INSERT INTO target_disease_year VALUES (?, ?, ?, ?)',
+                            zip(state['target_ids'][n0.row].tolist(), state['disease_ids'][n0.col].tolist(),
+                                [int(years[start])] * n0.nnz, n0.data.tolist()))
+            n_rows += n0.nnz
+
+        #Same counts as n1, n2, n3 of target_disease (see corpus_counts in migrations.py), per year
+        con.execute("""
+        INSERT INTO corpus_year_counts
+        SELECT year, COUNT(*)
+        FROM pubmed
+        WHERE year IS NOT NULL
+        GROUP BY year
+        """)
+        for table, column in [('target_year_counts', 'target_id'), ('disease_year_counts', 'disease_id')]:
+            link = table.split('_')[0] + '_pubmed'
+            con.execute(f"""
+            INSERT INTO {table}
+            SELECT {link}.{column}, pubmed.year, COUNT(*)
+            FROM {link}
+            JOIN pubmed ON pubmed.pmid = {link}.pmid
+            WHERE {link}.{column} IS NOT NULL AND pubmed.year IS NOT NULL
+            GROUP BY {link}.{column}, pubmed.year
+            """)
+
+    migrations.create_indexes(con, tables=[table for table, _, _ in YEAR_TABLES])
+    con.execute('ANALYZE target_disease_year')
+    con.commit()
+    con.close()
+
+    return n_rows
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Builds the target_disease table from the article link tables.')
+    parser.add_argument('db', help='path to the SQLite database')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: number of CPUs)')
+    parser.add_argument('--chunk-size', type=int, default=2000, help='targets per chunk')
+    parser.add_argument('--n1', type=int, default=None, help='number of all articles (default: rows of the pubmed table)')
+    parser.add_argument('--years', action='store_true', help='only build the per-year cube')
+    args = parser.parse_args()
+
+    if args.years:
+        print(f'target_disease_year rows: {build_year_cube(args.db)}')
+    else:
+        print(f'target_disease rows: {build_target_disease(args.db, args.workers, args.chunk_size, args.n1)}')
@@ -1,54 +1,141 @@
+'''
+Counts and yearly percentages for the disease charts.
+Yearly totals (all clinical trials / all abstracts per year) are read from the year_totals table
+(see migrations.py) and cached as arrays per DB snapshot. Snapshots without the table use the
+totals below, which were used before the table existed.
+'''
+
+import numpy as np
 import pandas as pd
 
+import cache
+import sql_helper
+
+
+#Number of all clinical trials per year
+CT_YEAR_TOTALS = {2017: 74290, 2015: 74481, 2010: 60554, 2014: 69950, 2019: 77051, 2009: 62768,
+                  2012: 64626, 2016: 79349, 2018: 75459, 2005: 52721, 2006: 41029, 2013: 65434,
+                  2002: 6553, 2003: 7123, 2007: 50337, 2008: 61088, 2011: 62613, 2020: 35745,
+                  1999: 10972, 2000: 6472, 2004: 7167, 2001: 5013}
+
+#Number of all abstracts in the pubmed table per year (they add up to n1 in sql_helper)
+PUBMED_YEAR_TOTALS = {2013: 848250, 2009: 659800, 2016: 952159, 2010: 694295, 2012: 805028, 2019: 1154895,
+                      2011: 741366, 2014: 891503, 2015: 925105, 2017: 967534, 2018: 1023659, 2020: 16711}
+
+DEFAULT_TOTALS = {'ct': CT_YEAR_TOTALS, 'pubmed': PUBMED_YEAR_TOTALS}
+
+
 def get_percent(num1, num2):
     percent = (num1/num2)*100
     return percent
 
 
-def get_count_dataframe(source_count_dict):
+def _as_arrays(totals):
+    years = np.array(sorted(totals), dtype='int64')
+    all_counts = np.array([totals[i] for i in years], dtype='int64')
+    years.flags.writeable = False
+    all_counts.flags.writeable = False
+    return years, all_counts
+
+
+@cache.memoize
+def _load_year_totals(source, engine):
+    with engine.connect() as con:
+        rs = con.execute("""
+        SELECT year, total
+        FROM year_totals
+        WHERE source = ?
+        ORDER BY year
+        """, (source,))
+        counts = rs.fetchall()
+
+    return _as_arrays(dict(counts))
+
+
+def get_year_totals(source, engine=None):
+    '''
+    Yearly totals for normalisation.
+
+    Arguments:
+        source: 'ct' (clinical trials) or 'pubmed' (abstracts)
+        engine: sqlalchemy engine. None: use the built-in totals
+    Returns:
+        years: sorted array of years
+        all_counts: array of totals for these years
+    '''
+    if engine is not None and sql_helper.has_table('year_totals', engine):
+        years, all_counts = _load_year_totals(source, engine)
+        if len(years):
+            return years, all_counts
+
+    return _as_arrays(DEFAULT_TOTALS[source])
+
+
+def _count_frame(source_dict, years, all_counts):
+    counts = pd.Series(source_dict, dtype='int64')
+    counts.index = counts.index.astype(float).astype(int) #years can come in as strings
+    counts = counts.groupby(level=0).sum().reindex(years, fill_value=0).to_numpy()
+
+    dis_counts = pd.DataFrame({'year': years, 'count': counts, 'total_count': all_counts})
+    dis_counts['percentage'] = get_percent(dis_counts['count'], dis_counts['total_count'])
+
+    return dis_counts
+
+
+def get_count_dataframe(source_count_dict, engine=None):
     '''
     Does necessary counts for clinical trials graph on dash.
     Counts % of disease trials to all trials at that year.
+
+    Arguments:
+        source_count_dict: dictionary year vs number of trials for a disease
+        engine: sqlalchemy engine for the yearly totals. None: built-in totals
+    Returns:
+        dis_counts: dataframe with columns year, count, total_count, percentage
     '''
-    
-    all_years = {2017: 74290, 2015: 74481, 2010: 60554, 2014: 69950, 2019: 77051, 2009: 62768,
-            2012: 64626, 2016: 79349, 2018: 75459, 2005: 52721, 2006: 41029, 2013: 65434,
-            2002: 6553, 2003: 7123, 2007: 50337, 2008: 61088, 2011: 62613, 2020: 35745, 
-            1999: 10972, 2000: 6472, 2004: 7167, 2001: 5013}
-    
-    dis_counts = pd.DataFrame(columns = ['year', 'count', 'total_count', 'percentage'])
-    dis_counts['year'] = [i for i in range(1999,2021)]
-    dis_counts['total_count'] = [all_years[i] for i in range(1999, 2021)]
-    
-    temp = {key: 0 for key in range(1999, 2021)}
-    for i in source_count_dict:
-        temp[int(i)] = source_count_dict[i]
-    dis_counts['count'] = [temp[i] for i in range(1999,2021)]
-    dis_counts = dis_counts.fillna(0)
-    dis_counts['percentage'] = dis_counts.apply(lambda row: get_percent(row['count'], row['total_count']), axis=1)
-    
-    
-    return dis_counts
+    years, all_counts = get_year_totals('ct', engine)
+
+    return _count_frame(source_count_dict, years, all_counts)
+
+
+
+def get_count_abstracts(source_dict, engine=None):
+    '''
+    Same as get_count_dataframe, for publications per year (% of all abstracts that year).
+    '''
+    years, all_counts = get_year_totals('pubmed', engine)
+
+    return _count_frame(source_dict, years, all_counts)
+
+
+def get_count_batch(source_dicts, source, engine=None):
+    '''
+    Batch version of get_count_dataframe/get_count_abstracts: counts and percentages for many diseases
+    in one matrix operation.
+
+    Arguments:
+        source_dicts: dictionary disease_id vs (dictionary year vs count)
+        source: 'ct' or 'pubmed'
+        engine: sqlalchemy engine for the yearly totals. None: built-in totals
+    Returns:
+        dis_counts: dataframe with columns disease_id, year, count, total_count, percentage
+    '''
+    years, all_counts = get_year_totals(source, engine)
+
+    column = {year: i for i, year in enumerate(years)}
+    counts = np.zeros((len(source_dicts), len(years)), dtype='int64')
+    for row, yr_counts in enumerate(source_dicts.values()):
+        for year, n in (yr_counts or {}).items():
+            i = column.get(int(float(year)))
+            if i is not None:
+                counts[row, i] += n
 
+    percentage = get_percent(counts, all_counts[np.newaxis, :])
 
+    dis_counts = pd.DataFrame({'disease_id': np.repeat(list(source_dicts), len(years)),
+                               'year': np.tile(years, len(source_dicts)),
+                               'count': counts.ravel(),
+                               'total_count': np.tile(all_counts, len(source_dicts)),
+                               'percentage': percentage.ravel()})
 
-def get_count_abstracts(source_dict):
-    
-    all_years = {2013: 848250, 2009: 659800, 2016: 952159, 2010: 694295, 2012: 805028, 2019: 1154895,
-                 2011: 741366, 2014: 891503, 2015: 925105, 2017: 967534, 2018: 1023659, 2020: 16711}
-    
-    
-    dis_counts = pd.DataFrame(columns = ['year', 'count', 'total_count', 'percentage'])
-    dis_counts['year'] = [i for i in range(2009,2021)]
-    dis_counts['total_count'] = [all_years[i] for i in range(2009, 2021)]
-    dis_counts['count'] = [source_dict[i] for i in range(2009, 2021)]
-    dis_counts['percentage'] = dis_counts.apply(lambda row: get_percent(row['count'], row['total_count']), axis=1)
-    
     return dis_counts
-    
-    
-    
-    
-    
-    
-    
\ No newline at end of file
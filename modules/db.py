@@ -0,0 +1,94 @@
+'''
+Read-only, pooled access to the SQLite database snapshot.
+The app only reads a dated snapshot, so connections are opened with mode=ro and (by default) immutable=1:
+SQLite then skips file locking and change detection on every query. Open connections are kept in a pool,
+so engine.connect() in sql_helper checks out a ready connection instead of opening the file and
+reading the schema again. The PRAGMAs below are set on every new connection.
+
+With immutable=1 SQLite assumes the file never changes: restart the app after replacing the snapshot
+(a deploy does that anyway). Scripts that write to the database (migrations.py, figures.prerender)
+use their own connections.
+'''
+
+import os
+import re
+import sqlite3
+import urllib.parse
+
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+
+
+#Values set on each new connection. None leaves the SQLite default
+DEFAULT_PRAGMAS = {'mmap_size': 256 * 2**20, #read pages through a memory map instead of read() calls
+                   'cache_size': -64 * 2**10, #page cache per connection, negative means KiB
+                   'temp_store': 'MEMORY', #sorts and temporary b-trees of GROUP BY/ORDER BY in memory
+                   'query_only': 'ON'} #any write fails, even if the file is writable
+
+
+def _pragma_sql(name, value):
+    #PRAGMA does not take bound parameters, so only known names and plain values are allowed
+    if name not in DEFAULT_PRAGMAS:
+        raise ValueError(f'Unsupported pragma: {name}')
+    if not re.fullmatch(r'-?\w+', str(value)):
+        raise ValueError(f'Invalid value for pragma {name}: {value}')
+    return f'PRAGMA {name} = {value}'
+
+
+def connect(db_path, immutable=True, pragmas=None):
+    '''
+    Opens a read-only sqlite3 connection to the database and sets the PRAGMAs.
+
+    Arguments:
+        db_path: path to the SQLite database
+        immutable: True: open with immutable=1 (no locking, file must not change while open)
+        pragmas: dictionary pragma name vs value, see DEFAULT_PRAGMAS
+    Returns:
+        con: sqlite3 connection. It can be used from any thread, but by one thread at a time (the pool ensures that)
+    '''
+    uri = f'file:{urllib.parse.quote(os.path.abspath(db_path))}?mode=ro'
+    if immutable:
+        uri += '&immutable=1'
+    con = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    for name, value in (pragmas or {}).items():
+        if value is not None:
+            con.execute(_pragma_sql(name, value))
+
+    return con
+
+
+def get_engine(db_path, immutable=True, pool_size=8, **pragmas):
+    '''
+    Creates a sqlalchemy engine for reading the database snapshot.
+    Up to pool_size connections stay open. Under a burst of more concurrent queries, up to pool_size extra
+    connections are opened and closed again after use.
+
+    Arguments:
+        db_path: path to the SQLite database
+        immutable: see connect
+        pool_size: number of connections kept open
+        pragmas: overrides of DEFAULT_PRAGMAS, e.g. mmap_size=0. None leaves the SQLite default
+    Returns:
+        engine: sqlalchemy engine. engine.url is the usual sqlite:/// url of the file, so cache keys do not change
+    '''
+    settings = dict(DEFAULT_PRAGMAS, **pragmas)
+    for name, value in settings.items():
+        if value is not None:
+            _pragma_sql(name, value)
+    if not os.path.exists(db_path):
+        #sqlite3 would only fail on first use, with a less helpful message
+        raise FileNotFoundError(f'Database not found: {db_path}')
+
+    engine = create_engine(f'sqlite:///{db_path}', echo=False,
+                           creator=lambda: connect(db_path, immutable, settings),
+                           poolclass=QueuePool, pool_size=pool_size, max_overflow=pool_size)
+
+    return engine
+
+
+def get_pragmas(engine):
+    '''
+    Returns the current values of the PRAGMAs in DEFAULT_PRAGMAS on a pooled connection, for checking the settings.
+    '''
+    with engine.connect() as con:
+        return {name: con.execute(f'PRAGMA {name}').scalar() for name in DEFAULT_PRAGMAS}
@@ -0,0 +1,306 @@
+'''
+Disease charts shown under the rankings table, and a cache of their serialized JSON.
+Building a plotly figure with secondary axes costs much more than the few numbers it shows,
+so each figure is built once per (chart, disease_id, DB snapshot) and kept as JSON:
+    - in cache.figures (in-process LRU, a SharedCache can be attached, see cache.py)
+    - optionally in a figure_json table of the snapshot itself, written offline by prerender()
+
+plotly is imported by the builders on first use: serving cached or pre-rendered JSON does not need it.
+
+Usage (pre-render charts of the 500 diseases ranked for most targets):
+    python modules/figures.py data/20200729pubmed_mini.db --top 500
+'''
+
+import argparse
+import sqlite3
+import textwrap
+
+from sqlalchemy import create_engine
+
+import cache
+import counts
+import lookup
+import sql_helper
+
+
+#Bump when the figure code changes, so pre-rendered figures of the old version are not used
+FIGURE_VERSION = 1
+
+#Figure JSON strings, keyed by chart, disease_id and DB snapshot
+figure_cache = cache.figures
+
+
+def pubmed_figure(disease_id, engine):
+    '''
+    Builds the publications per year figure for a disease.
+    Returns:
+        fig: plotly.go figure with bar chart of publications and line chart of % from all publications that year
+    '''
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+
+    disease_name = lookup.get_index(engine).get_disease_name(disease_id)
+
+    dis_print = '<br>'.join(textwrap.wrap(disease_name, width=40)) if len(disease_name)>40 else disease_name
+
+    dis_years = sql_helper.get_pubmed_year(disease_id, engine)
+    
+    if dis_years == []:
+        fig = go.Figure(
+        data = [
+               ],
+
+        layout = go.Layout(title=go.layout.Title(text = f'Publications not found:<br>{dis_print}', 
+                                                 font = dict(size=14)))
+        )
+    
+    
+    else:
+        dis_counts = counts.get_count_abstracts(dis_years, engine)
+        
+        fig = make_subplots(specs=[[{"secondary_y": True}]])
+
+        fig.add_trace(
+            go.Bar(x=dis_counts["year"], y=dis_counts["count"], name="No of publications", marker_color = 'rgb(2,21,70)'),
+            secondary_y=False
+        )
+
+        fig.add_trace(
+            go.Scatter(x=dis_counts["year"], y=dis_counts["percentage"], name="% from total", marker_color='red', mode='lines'),
+            secondary_y=True
+        )
+
+        fig.update_layout(
+            title_text=f"Publications per year:<br>{dis_print}",
+            titlefont = dict(size=14)
+        )
+
+        fig.update_yaxes(
+            title_text=f"Annual publications",
+            secondary_y=False
+        )
+
+        fig.update_yaxes(
+            title_text="% of publications that year",
+            secondary_y=True
+        )
+
+        fig.update_xaxes(
+            title_text="Year"
+        )
+        
+        fig.update_layout(legend=dict(
+            yanchor="bottom",
+            y=-0.5, 
+            xanchor="center",
+            x=0.5
+))
+
+    return fig
+
+
+def ct_figure(disease_id, engine):
+    '''
+    Builds the clinical trials per year figure (with forecast) for a disease.
+    Returns:
+        fig: plotly.go figure with bar charts of trials and forecast, line chart of % from all trials that year
+    '''
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+
+    disease_name = lookup.get_index(engine).get_disease_name(disease_id)
+    dis_print = '<br>'.join(textwrap.wrap(disease_name, width=50)) if len(disease_name)>50 else disease_name
+
+    ct_years = sql_helper.get_ct_year(disease_id, engine)
+    
+    if ct_years == []:
+        fig = go.Figure(
+        data = [
+               ],
+
+        layout = go.Layout(title=go.layout.Title(text = f'Trials not found:<br>{dis_print}', 
+                                                 font = dict(size=14)))
+        )
+    
+    
+    else:
+        dis_counts = counts.get_count_dataframe(ct_years, engine)
+        dis_pred = sql_helper.ct_forecast(disease_id, engine)
+        
+        
+        fig = make_subplots(specs=[[{"secondary_y": True}]])
+
+        fig.add_trace(
+            go.Bar(x=dis_counts["year"], y=dis_counts["count"], name="No of trials", marker_color = 'rgb(2,21,70)'),
+            secondary_y=False
+        )
+        if dis_pred == [0,0]:
+            fig.add_trace(
+                go.Scatter(x = [2020, 2021], y=[i for i in dis_pred], name = "Forecast", marker_color = 'green', mode='lines'),
+                secondary_y=False
+            )
+        else:
+            fig.add_trace(
+                go.Bar(x = [2020, 2021], y=[i for i in dis_pred], name = "Forecast", marker_color = 'green', ),
+                secondary_y=False
+            )
+        
+        fig.add_trace(
+            go.Scatter(x=dis_counts["year"], y=dis_counts["percentage"], name="% from total", marker_color='red', mode='lines'),
+            secondary_y=True
+        )
+        
+
+        fig.update_layout(
+            title_text=f"Clinical trials per year:<br>{dis_print}",
+            titlefont = dict(size=14),
+        )
+
+        fig.update_yaxes(
+            title_text=f"Annual trials",
+            secondary_y=False
+        )
+
+        fig.update_yaxes(
+            title_text="% of trials that year",
+            secondary_y=True
+        )
+
+        fig.update_xaxes(
+            title_text="Year",
+            #range = [1999, 2025]
+        )
+        
+        fig.update_layout(legend=dict(
+            yanchor="bottom",
+            y=-0.5, 
+            xanchor="center",
+            x=0.5
+))
+
+    return fig
+
+
+CHARTS = {'pubmed': pubmed_figure, 'ct': ct_figure}
+
+
+@cache.memoize
+def get_series(disease_id, engine):
+    '''
+    Compact numeric data behind both charts, for building the figures in the browser 
+    (see assets/charts.js). A few hundred bytes instead of the full figure JSON.
+    
+    Arguments:
+        disease_id: malacard disease_id
+        engine: sqlalchemy engine, connected to the database
+    Returns:
+        series: dictionary with disease name and, per chart, years, counts and percentages 
+            (ct also has the 2020/2021 forecast). A chart without data is None.
+    '''
+    series = {'name': lookup.get_index(engine).get_disease_name(disease_id), 'pubmed': None, 'ct': None}
+    
+    try:
+        dis_years = sql_helper.get_pubmed_year(disease_id, engine)
+    except IndexError:
+        dis_years = []
+    if dis_years != []:
+        dis_counts = counts.get_count_abstracts(dis_years, engine)
+        series['pubmed'] = {'year': dis_counts['year'].tolist(),
+                            'count': dis_counts['count'].tolist(),
+                            'percentage': dis_counts['percentage'].round(6).tolist()}
+    
+    ct_years = sql_helper.get_ct_year(disease_id, engine)
+    if ct_years != []:
+        dis_counts = counts.get_count_dataframe(ct_years, engine)
+        series['ct'] = {'year': dis_counts['year'].tolist(),
+                        'count': dis_counts['count'].tolist(),
+                        'percentage': dis_counts['percentage'].round(6).tolist(),
+                        'forecast': [float(i) for i in sql_helper.ct_forecast(disease_id, engine)]}
+    
+    return series
+
+
+@cache.memoize(cache=figure_cache)
+def get_figure_json(chart, disease_id, engine):
+    '''
+    Returns the serialized figure of a chart for a disease. Pre-rendered figures are read from the 
+    figure_json table when it exists, all others are built and then kept in figure_cache.
+    
+    Arguments:
+        chart: 'pubmed' or 'ct', see CHARTS
+        disease_id: malacard disease_id
+        engine: sqlalchemy engine, connected to the database
+    Returns:
+        fig_json: figure as JSON string
+    '''
+    if sql_helper.has_table('figure_json', engine):
+        with engine.connect() as con:
+            rs = con.execute("""
+            SELECT figure
+            FROM figure_json
+            WHERE chart = ? AND disease_id = ? AND version = ?
+            """, (chart, disease_id, FIGURE_VERSION))
+            figure = rs.fetchall()
+        if figure != []:
+            return figure[0][0]
+    
+    return CHARTS[chart](disease_id, engine).to_json()
+
+
+def prerender(db_path, top=500):
+    '''
+    Offline step: builds both charts for the diseases that are ranked for most targets 
+    and stores their JSON in the figure_json table of the snapshot.
+    
+    Arguments:
+        db_path: path to the SQLite database
+        top: number of diseases
+    Returns:
+        n_figures: number of figures written
+    '''
+    engine = create_engine(f'sqlite:///{db_path}', echo=False)
+    with engine.connect() as con:
+        rs = con.execute("""
+        SELECT disease_id
+        FROM target_disease
+        GROUP BY disease_id
+        ORDER BY COUNT(*) DESC
+        LIMIT ?
+        """, (top,))
+        disease_ids = [row[0] for row in rs.fetchall()]
+    
+    rows = []
+    for disease_id in disease_ids:
+        for chart, build in CHARTS.items():
+            try:
+                rows.append((chart, disease_id, FIGURE_VERSION, build(disease_id, engine).to_json()))
+            except (KeyError, IndexError):
+                #Disease missing from malacard or pubmed_disease_frequencies, built on request like before
+                continue
+    
+    con = sqlite3.connect(db_path)
+    with con:
+        con.execute("""
+        CREATE TABLE IF NOT EXISTS figure_json (
+            chart TEXT NOT NULL,
+            disease_id INTEGER NOT NULL,
+            version INTEGER NOT NULL,
+            figure TEXT NOT NULL,
+            PRIMARY KEY (chart, disease_id, version)
+        ) WITHOUT ROWID
+        """)
+        con.execute('DELETE FROM figure_json WHERE version != ?', (FIGURE_VERSION,))
+        con.executemany('INSERT OR REPLACE INTO figure_json VALUES (?, ?, ?, ?)', rows)
+    con.close()
+    
+    return len(rows)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Pre-renders disease charts into the database snapshot.')
+    parser.add_argument('db', help='path to the SQLite database')
+    parser.add_argument('--top', type=int, default=500, help='number of most ranked diseases to pre-render')
+    args = parser.parse_args()
+
+    print(f'figures written: {prerender(args.db, args.top)}')
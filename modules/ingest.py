@@ -0,0 +1,229 @@
+'''
+Incremental ingestion of new annotated articles into a database snapshot.
+A batch is a JSON lines file, one article per line:
+    {"pmid": 33000001, "year": 2021, "targets": [1841, 15], "diseases": [20411]}
+(targets and diseases are ids from the targets and malacard tables).
+
+Instead of rebuilding target_disease (cooccurrence.py), only what the new articles change is updated,
+in one transaction:
+    - pubmed, target_pubmed, disease_pubmed: the new rows
+    - corpus_stats n1, target_counts n2, disease_counts n3 (see migrations.migrate_corpus_counts)
+    - target_disease: n0 of the co-mentioned pairs (new pairs are added), n2 and n3 of the rows of mentioned
+      targets and diseases, which are re-scored with ranking.score_batch. All other rows only depend on n1:
+      f0 is recomputed and pmi shifted by log2(new n1 / old n1) with plain SQL arithmetic
+    - pubmed_disease_frequencies and the 'pubmed' year_totals (year columns are added when missing)
+    - figure_json: pre-rendered charts of the mentioned diseases are deleted
+    - the per-year cube of cooccurrence.build_year_cube, if the database has it (articles with a year only)
+Articles whose pmid is already in the pubmed table are skipped, so a batch can be ingested twice.
+
+target_disease needs the n0, n2 and n3 columns written by cooccurrence.py.
+The app opens the snapshot as immutable (see db.py): ingest into a copy and restart the app with it.
+
+Usage:
+    python modules/ingest.py data/20200729pubmed_mini.db new_articles.jsonl
+'''
+
+import argparse
+import json
+import math
+import sqlite3
+from collections import Counter
+
+import migrations
+import ranking
+
+
+def read_batch(path):
+    '''
+    Reads a JSON lines batch file. Returns a list of article dictionaries.
+    '''
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _tables(con):
+    return {row[0] for row in con.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+def _chunks(values, size=900):
+    #Stays under SQLite's limit of bound parameters per statement
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _rows_where_in(con, sql, values):
+    rows = []
+    for chunk in _chunks(values):
+        rows += con.execute(sql.format(placeholders=', '.join('?' * len(chunk))), chunk).fetchall()
+    return rows
+
+
+def _update_frequencies(con, year_counts):
+    '''
+    Adds (disease_id, year) counts to pubmed_disease_frequencies, which has one column per year.
+    '''
+    columns = [row[1] for row in con.execute('PRAGMA table_info(pubmed_disease_frequencies)')]
+    for year in sorted({year for _, year in year_counts}):
+        if str(year) not in columns:
+            con.execute(f'ALTER TABLE pubmed_disease_frequencies ADD COLUMN "{year}" INTEGER NOT NULL DEFAULT 0')
+            columns.append(str(year))
+
+    diseases = {disease_id for disease_id, _ in year_counts}
+    existing = {row[0] for row in _rows_where_in(con, """
+    SELECT disease_id
+    FROM pubmed_disease_frequencies
+    WHERE disease_id IN ({placeholders})
+    """, diseases)}
+    year_columns = [c for c in columns if c.isdigit()]
+    con.executemany(f"""
+    INSERT INTO pubmed_disease_frequencies (disease_id, {', '.join(f'"{c}"' for c in year_columns)})
+    VALUES (?{', 0' * len(year_columns)})
+    """, [(disease_id,) for disease_id in diseases - existing])
+
+    for (disease_id, year), n in year_counts.items():
+        con.execute(f'UPDATE pubmed_disease_frequencies SET "{year}" = "{year}" + ? WHERE disease_id = ?', (n, disease_id))
+
+
+def _update_year_cube(con, articles):
+    '''
+    Adds the counts of the articles to the per-year cube (see cooccurrence.build_year_cube).
+    '''
+    dated = [a for a in articles if a.get('year') is not None]
+    for table, key, column, counts in [
+            ('target_disease_year', 'target_id, year, disease_id', 'n0',
+             Counter((t, a['year'], d) for a in dated for t in a['targets'] for d in a['diseases'])),
+            ('corpus_year_counts', 'year', 'n1', Counter((a['year'],) for a in dated)),
+            ('target_year_counts', 'target_id, year', 'n2', Counter((t, a['year']) for a in dated for t in a['targets'])),
+            ('disease_year_counts', 'disease_id, year', 'n3', Counter((d, a['year']) for a in dated for d in a['diseases']))]:
+        con.executemany(f"""
+        INSERT INTO {table} ({key}, {column}) VALUES ({', '.join('?' * (key.count(',') + 2))})
+        ON CONFLICT ({key}) DO UPDATE SET {column} = {column} + excluded.{column}
+        """, [(*k, n) for k, n in counts.items()])
+
+
+def ingest(con, articles):
+    '''
+    Adds a batch of articles and updates all derived counts and rankings, see the module docstring.
+
+    Arguments:
+        con: sqlite3 connection to the database
+        articles: list of dictionaries with pmid, year, targets (list of target ids), diseases (list of disease ids)
+    Returns:
+        summary: dictionary with the numbers of new articles, n1 before and after,
+            rankings added and re-scored, and all rankings shifted for the new n1
+    '''
+    columns = [row[1] for row in con.execute('PRAGMA table_info(target_disease)')]
+    if not {'n0', 'n2', 'n3'} <= set(columns):
+        raise ValueError('target_disease has no n0, n2, n3 columns, build it with cooccurrence.py first')
+    tables = _tables(con)
+    if not {'corpus_stats', 'target_counts', 'disease_counts'} <= tables:
+        migrations.migrate_corpus_counts(con)
+
+    #Skip articles that are already in the database, and repeated pmids within the batch
+    known = {row[0] for row in _rows_where_in(con, """
+    SELECT pmid
+    FROM pubmed
+    WHERE pmid IN ({placeholders})
+    """, {a['pmid'] for a in articles})}
+    new = {}
+    for article in articles:
+        if article['pmid'] not in known:
+            new.setdefault(article['pmid'], article)
+    new = list(new.values())
+
+    n1_old = con.execute("SELECT value FROM corpus_stats WHERE name = 'n1'").fetchone()[0]
+    summary = {'articles': len(new), 'n1_before': n1_old, 'n1_after': n1_old,
+               'rankings_added': 0, 'rankings_rescored': 0, 'rankings_shifted': 0}
+    if not new:
+        return summary
+    n1 = n1_old + len(new)
+
+    #Duplicate ids in an article count twice, like duplicate rows in the link tables do in the joins
+    target_delta = Counter(t for a in new for t in a['targets'])
+    disease_delta = Counter(d for a in new for d in a['diseases'])
+    pair_delta = Counter((t, d) for a in new for t in a['targets'] for d in a['diseases'])
+    year_delta = Counter((d, a['year']) for a in new for d in a['diseases'] if a.get('year') is not None)
+
+    with con:
+        con.executemany('INSERT INTO pubmed (pmid, year) VALUES (?, ?)', [(a['pmid'], a.get('year')) for a in new])
+        con.executemany('INSERT INTO target_pubmed (pmid, target_id) VALUES (?, ?)',
+                        [(a['pmid'], t) for a in new for t in a['targets']])
+        con.executemany('INSERT INTO disease_pubmed (pmid, disease_id) VALUES (?, ?)',
+                        [(a['pmid'], d) for a in new for d in a['diseases']])
+
+        #n1, n2, n3
+        con.execute("UPDATE corpus_stats SET value = ? WHERE name = 'n1'", (n1,))
+        con.executemany("""
+        INSERT INTO target_counts VALUES (?, ?)
+        ON CONFLICT (target_id) DO UPDATE SET n2 = n2 + excluded.n2
+        """, list(target_delta.items()))
+        con.executemany("""
+        INSERT INTO disease_counts VALUES (?, ?)
+        ON CONFLICT (disease_id) DO UPDATE SET n3 = n3 + excluded.n3
+        """, list(disease_delta.items()))
+        n2 = dict(_rows_where_in(con, 'SELECT target_id, n2 FROM target_counts WHERE target_id IN ({placeholders})',
+                                 target_delta))
+        n3 = dict(_rows_where_in(con, 'SELECT disease_id, n3 FROM disease_counts WHERE disease_id IN ({placeholders})',
+                                 disease_delta))
+
+        #n0 of co-mentioned pairs. Metrics are set below
+        for (t, d), n in pair_delta.items():
+            cursor = con.execute('UPDATE target_disease SET n0 = n0 + ? WHERE target_id = ? AND disease_id = ?', (n, t, d))
+            if cursor.rowcount == 0:
+                con.execute('INSERT INTO target_disease (target_id, disease_id, n0, n2, n3) VALUES (?, ?, ?, ?, ?)',
+                            (t, d, n, n2[t], n3[d]))
+                summary['rankings_added'] += 1
+        con.executemany('UPDATE target_disease SET n2 = ? WHERE target_id = ?', [(v, k) for k, v in n2.items()])
+        con.executemany('UPDATE target_disease SET n3 = ? WHERE disease_id = ?', [(v, k) for k, v in n3.items()])
+
+        #Rows of other targets and diseases only change through n1
+        cursor = con.execute('UPDATE target_disease SET f0 = n0 * 1000000.0 / ?, pmi = pmi + ?',
+                             (n1, math.log2(n1 / n1_old)))
+        summary['rankings_shifted'] = cursor.rowcount
+
+        #Rows of mentioned targets and diseases are scored again
+        rows = {}
+        for column, ids in [('target_id', target_delta), ('disease_id', disease_delta)]:
+            rows.update((r[0], r[1:]) for r in _rows_where_in(con, f"""
+            SELECT rowid, n0, n2, n3
+            FROM target_disease
+            WHERE {column} IN ({{placeholders}})
+            """, ids))
+        if rows:
+            rowids = list(rows)
+            n0s, n2s, n3s = zip(*[rows[rowid] for rowid in rowids])
+            scores = ranking.score_batch(n0=n0s, n1=n1, n2=n2s, n3=n3s)
+            #NaN metrics are stored as NULL, like in cooccurrence.py
+            con.executemany('UPDATE target_disease SET f0 = ?, f1 = ?, f2 = ?, pmi = ? WHERE rowid = ?',
+                            zip(*[scores[col].tolist() for col in ['f0', 'f1', 'f2', 'pmi']], rowids))
+            summary['rankings_rescored'] = len(rowids)
+
+        #Data behind the disease charts
+        if 'pubmed_disease_frequencies' in tables and year_delta:
+            _update_frequencies(con, year_delta)
+        if 'year_totals' in tables:
+            con.executemany("""
+            INSERT INTO year_totals VALUES ('pubmed', ?, ?)
+            ON CONFLICT (source, year) DO UPDATE SET total = total + excluded.total
+            """, list(Counter(a['year'] for a in new if a.get('year') is not None).items()))
+        if 'figure_json' in tables:
+            con.executemany('DELETE FROM figure_json WHERE disease_id = ?', [(d,) for d in disease_delta])
+        if 'target_disease_year' in tables:
+            _update_year_cube(con, new)
+
+    summary['n1_after'] = n1
+
+    return summary
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Adds a batch of annotated articles to a database snapshot.')
+    parser.add_argument('db', help='path to the SQLite database')
+    parser.add_argument('batch', help='JSON lines file, one article per line')
+    args = parser.parse_args()
+
+    con = sqlite3.connect(args.db)
+    print(ingest(con, read_batch(args.batch)))
+    con.close()
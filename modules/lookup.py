@@ -0,0 +1,163 @@
+'''
+In-memory index for id <-> name lookups of targets and diseases.
+The "targets" and "malacard" tables are small and do not change for a given dated DB file,
+so they are loaded once and every lookup after that is a dictionary access instead of a query.
+Use get_index(engine) to get the shared index for a database.
+'''
+
+import threading
+
+
+class LookupIndex:
+    '''
+    Holds the "targets" and "malacard" tables as flat lists plus dictionaries from key to position.
+    Lookups return the same values as the matching functions in sql_helper.
+
+    Arguments:
+        engine: sqlalchemy engine, connected to the database
+    '''
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.reload()
+
+    def reload(self):
+        '''
+        (Re)loads both tables from the database. Call after the DB file is replaced.
+        The new data is built aside and swapped in at once, so lookups running in other threads
+        never see a half-built index.
+        '''
+        with self.engine.connect() as con:
+            targets = con.execute("""
+            SELECT target_id, targ_abbr, targ_name
+            FROM targets
+            ORDER BY rowid
+            """).fetchall()
+            diseases = con.execute("""
+            SELECT Disease_ID, Disease
+            FROM malacard
+            ORDER BY rowid
+            """).fetchall()
+
+        target_ids = [row[0] for row in targets]
+        target_abbrs = [row[1] for row in targets]
+        target_names = [row[2] for row in targets]
+
+        #First matching row wins, same as get_target_id
+        target_by_id = {}
+        target_by_term = {}
+        for pos, (target_id, abbr, name) in enumerate(targets):
+            target_by_id.setdefault(target_id, pos)
+            target_by_term.setdefault(abbr, pos)
+            target_by_term.setdefault(name, pos)
+
+        disease_by_id = {}
+        disease_by_name = {}
+        for disease_id, name in diseases:
+            disease_by_id.setdefault(disease_id, name)
+            disease_by_name.setdefault(name, disease_id)
+
+        self._data = {'target_ids': target_ids, 'target_abbrs': target_abbrs, 'target_names': target_names,
+                      'target_by_id': target_by_id, 'target_by_term': target_by_term,
+                      'disease_by_id': disease_by_id, 'disease_by_name': disease_by_name}
+
+    #Targets
+
+    def get_target_id(self, target_name):
+        '''
+        Same as sql_helper.get_target_id.
+
+        Arguments:
+            target_name: target abbreviation or full name
+        Returns:
+            info: tuple (target_id, targ_abbr, targ_name) or 'NaN' if not found
+        '''
+        data = self._data
+        pos = data['target_by_term'].get(target_name)
+        if pos is None:
+            return 'NaN'
+
+        return (data['target_ids'][pos], data['target_abbrs'][pos], data['target_names'][pos])
+
+    def get_target_name(self, target_id):
+        '''
+        Same as sql_helper.get_target_name: target id to abbreviation. Raises KeyError if not found.
+        '''
+        data = self._data
+
+        return data['target_abbrs'][data['target_by_id'][target_id]]
+
+    def get_target_names(self, target_ids):
+        '''
+        Batch version of get_target_name. Unknown ids give None.
+        '''
+        data = self._data
+        target_abbrs, target_by_id = data['target_abbrs'], data['target_by_id']
+
+        return [target_abbrs[target_by_id[i]] if i in target_by_id else None for i in target_ids]
+
+    #Diseases
+
+    def get_disease_name(self, disease_id):
+        '''
+        Same as sql_helper.get_disease_name. Raises KeyError if not found.
+        '''
+        return self._data['disease_by_id'][disease_id]
+
+    def get_disease_names(self, disease_ids):
+        '''
+        Batch version of get_disease_name. Unknown ids give None.
+        '''
+        disease_by_id = self._data['disease_by_id']
+
+        return [disease_by_id.get(i) for i in disease_ids]
+
+    def get_dis_id(self, dis_name):
+        '''
+        Same as sql_helper.get_dis_id: disease name to id, 'NaN' if not found.
+        '''
+        return self._data['disease_by_name'].get(dis_name, 'NaN')
+
+    def get_dis_ids(self, dis_names):
+        '''
+        Batch version of get_dis_id. Unknown names give 'NaN'.
+        '''
+        disease_by_name = self._data['disease_by_name']
+
+        return [disease_by_name.get(i, 'NaN') for i in dis_names]
+
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+def get_index(engine):
+    '''
+    Returns the LookupIndex for the database behind the engine, loading it on first use.
+
+    Arguments:
+        engine: sqlalchemy engine, connected to the database
+    Returns:
+        index: LookupIndex
+    '''
+    key = str(engine.url)
+    index = _indexes.get(key)
+    if index is None:
+        with _lock:
+            index = _indexes.get(key)
+            if index is None:
+                index = LookupIndex(engine)
+                _indexes[key] = index
+
+    return index
+
+
+def reload(engine):
+    '''
+    Reloads the index for the database behind the engine, e.g. after a new DB snapshot was copied in place.
+    '''
+    index = _indexes.get(str(engine.url))
+    if index is None:
+        get_index(engine)
+    else:
+        index.reload()
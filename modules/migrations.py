@@ -0,0 +1,237 @@
+'''
+Offline migrations of the SQLite database snapshot.
+They add derived tables that let the app read ready-made values instead of parsing or aggregating at request time.
+Every migration can be rerun: it drops and rebuilds its tables.
+
+Usage:
+    python modules/migrations.py data/20200729pubmed_mini.db ct_years year_totals
+    python modules/migrations.py data/20200729pubmed_mini.db all
+    python modules/migrations.py data/20200729pubmed_mini.db indexes --check
+--check runs the query plan check of query_plans.py afterwards and exits with status 1 if a query scans a table.
+'''
+
+import argparse
+import ast
+import sqlite3
+import sys
+from collections import Counter
+
+import counts
+import sql_helper
+
+
+def migrate_ct_years(con):
+    '''
+    Materializes ct_diseases.CT_trial_years (a Python-literal list of years stored as text)
+    into a typed table ct_year_counts (disease_id, year, count), keyed by malacard disease id.
+    sql_helper.get_ct_year reads this table when it exists.
+
+    Arguments:
+        con: sqlite3 connection to the database
+    Returns:
+        n_rows: number of (disease, year) rows written
+    '''
+    rows = con.execute("""
+    SELECT malacard.Disease_ID, ct_diseases.CT_trial_years
+    FROM ct_diseases
+    JOIN malacard ON malacard.Disease = ct_diseases.Disease
+    """).fetchall()
+
+    year_counts = {}
+    for disease_id, years in rows:
+        if disease_id in year_counts or not years:
+            continue
+        year_counts[disease_id] = Counter(int(year) for year in ast.literal_eval(years))
+
+    with con:
+        con.execute('DROP TABLE IF EXISTS ct_year_counts')
+        con.execute("""
+        CREATE TABLE ct_year_counts (
+            disease_id INTEGER NOT NULL,
+            year INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (disease_id, year)
+        ) WITHOUT ROWID
+        """)
+        con.executemany('INSERT INTO ct_year_counts VALUES (?, ?, ?)',
+                        [(disease_id, year, n) for disease_id, years in year_counts.items() for year, n in years.items()])
+
+    return sum(len(years) for years in year_counts.values())
+
+
+def migrate_year_totals(con):
+    '''
+    Creates year_totals (source, year, total) with the yearly totals used to normalise the disease charts
+    (see counts.py):
+        'pubmed': number of abstracts per year, counted from the pubmed table
+        'ct': number of all clinical trials per year. These are not in the database, 
+            the values from counts.CT_YEAR_TOTALS are used
+    
+    Arguments:
+        con: sqlite3 connection to the database
+    Returns:
+        n_rows: number of rows written
+    '''
+    pubmed = con.execute("""
+    SELECT year, COUNT(*)
+    FROM pubmed
+    WHERE year IS NOT NULL
+    GROUP BY year
+    """).fetchall()
+    rows = [('pubmed', int(year), n) for year, n in pubmed] + \
+           [('ct', year, n) for year, n in counts.CT_YEAR_TOTALS.items()]
+
+    with con:
+        con.execute('DROP TABLE IF EXISTS year_totals')
+        con.execute("""
+        CREATE TABLE year_totals (
+            source TEXT NOT NULL,
+            year INTEGER NOT NULL,
+            total INTEGER NOT NULL,
+            PRIMARY KEY (source, year)
+        ) WITHOUT ROWID
+        """)
+        con.executemany('INSERT INTO year_totals VALUES (?, ?, ?)', rows)
+
+    return len(rows)
+
+
+def migrate_corpus_counts(con, n1=None):
+    '''
+    Creates the counts behind the ranking metrics, which ingest.py updates when articles are added:
+        corpus_stats (name, value): 'n1', number of all articles
+        target_counts (target_id, n2): rows per target in target_pubmed
+        disease_counts (disease_id, n3): rows per disease in disease_pubmed
+
+    Arguments:
+        con: sqlite3 connection to the database
+        n1: number of all articles. None: keep the value already in corpus_stats, otherwise use
+            sql_helper.N1 (the target_disease table of the 2020 snapshots was computed with it)
+    Returns:
+        n_rows: number of rows written
+    '''
+    if n1 is None:
+        exists = con.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'corpus_stats'").fetchall()
+        row = con.execute("SELECT value FROM corpus_stats WHERE name = 'n1'").fetchone() if exists else None
+        n1 = row[0] if row else sql_helper.N1
+
+    target_rows = con.execute("""
+    SELECT target_id, COUNT(*)
+    FROM target_pubmed
+    WHERE target_id IS NOT NULL
+    GROUP BY target_id
+    """).fetchall()
+    disease_rows = con.execute("""
+    SELECT disease_id, COUNT(*)
+    FROM disease_pubmed
+    WHERE disease_id IS NOT NULL
+    GROUP BY disease_id
+    """).fetchall()
+
+    with con:
+        for table, key, value in [('corpus_stats', 'name TEXT', 'value INTEGER'),
+                                  ('target_counts', 'target_id INTEGER', 'n2 INTEGER'),
+                                  ('disease_counts', 'disease_id INTEGER', 'n3 INTEGER')]:
+            con.execute(f'DROP TABLE IF EXISTS {table}')
+            con.execute(f'CREATE TABLE {table} ({key} NOT NULL PRIMARY KEY, {value} NOT NULL) WITHOUT ROWID')
+        con.execute("INSERT INTO corpus_stats VALUES ('n1', ?)", (n1,))
+        con.executemany('INSERT INTO target_counts VALUES (?, ?)', target_rows)
+        con.executemany('INSERT INTO disease_counts VALUES (?, ?)', disease_rows)
+
+    return 1 + len(target_rows) + len(disease_rows)
+
+
+#Indexes for the queries in sql_helper: (name, table, columns).
+#Most are covering (they hold every column the query reads), so SQLite does not look up the table rows.
+#Tables read with SELECT * (and the wide drug table) only get an index on the filtered column.
+#Columns the table does not have are left out (n0: target_disease tables from before cooccurrence.py).
+INDEXES = [('idx_target_pubmed_target', 'target_pubmed', 'target_id, pmid'),
+           ('idx_target_pubmed_pmid', 'target_pubmed', 'pmid, target_id'),
+           ('idx_disease_pubmed_disease', 'disease_pubmed', 'disease_id, pmid'),
+           ('idx_disease_pubmed_pmid', 'disease_pubmed', 'pmid, disease_id'),
+           ('idx_pubmed_pmid', 'pubmed', 'pmid, year'),
+           #Ordered by pmi like the default rankings page, which then reads only the rows of the page.
+           #n0 is there for the minimum support filter (min_n0 in sql_helper.get_rankings)
+           ('idx_target_disease_target', 'target_disease', 'target_id, pmi DESC, disease_id, f0, f1, f2, n0'),
+           #Same for the targets of a disease (sql_helper.get_target_rankings)
+           ('idx_target_disease_disease', 'target_disease', 'disease_id, pmi DESC, target_id, f0, f1, f2, n0'),
+           #Per-year cube (cooccurrence.build_year_cube), by disease. The primary key covers the target side
+           ('idx_target_disease_year_disease', 'target_disease_year', 'disease_id, year, target_id, n0'),
+           ('idx_malacard_id', 'malacard', 'Disease_ID, Disease'),
+           ('idx_malacard_name', 'malacard', 'Disease, Disease_ID'),
+           ('idx_targets_id', 'targets', 'target_id, targ_abbr, targ_name'),
+           ('idx_targets_abbr', 'targets', 'targ_abbr, target_id, targ_name'),
+           ('idx_targets_name', 'targets', 'targ_name, target_id, targ_abbr'),
+           ('idx_drug_target_indication_target', 'drug_target_indication', 'target_id'),
+           ('idx_ct_diseases_disease', 'ct_diseases', 'Disease'),
+           ('idx_ct_forecast_disease', 'ct_forecast', 'disease_id'),
+           ('idx_pubmed_disease_frequencies_disease', 'pubmed_disease_frequencies', 'disease_id')]
+
+
+def create_indexes(con, tables=None):
+    '''
+    Creates (or rebuilds) the indexes in INDEXES. Tables missing from the snapshot are skipped.
+
+    Arguments:
+        con: sqlite3 connection to the database
+        tables: only index these tables. None: all tables in INDEXES
+    Returns:
+        n_indexes: number of indexes created
+    '''
+    existing = {row[0] for row in con.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    created = 0
+    with con:
+        for name, table, columns in INDEXES:
+            if table not in existing or (tables is not None and table not in tables):
+                continue
+            table_columns = {row[1] for row in con.execute(f'PRAGMA table_info({table})')}
+            columns = [c for c in columns.split(', ') if c.split()[0] in table_columns]
+            con.execute(f'DROP INDEX IF EXISTS {name}')
+            con.execute(f'CREATE INDEX {name} ON {table} ({", ".join(columns)})')
+            created += 1
+
+    return created
+
+
+def migrate_indexes(con):
+    '''
+    Creates the indexes in INDEXES (rebuilding existing ones) and runs ANALYZE, 
+    so the query planner has statistics to choose between them.
+
+    Arguments:
+        con: sqlite3 connection to the database
+    Returns:
+        n_indexes: number of indexes created
+    '''
+    created = create_indexes(con)
+    con.execute('ANALYZE')
+    con.commit()
+
+    return created
+
+
+MIGRATIONS = {'ct_years': migrate_ct_years,
+              'year_totals': migrate_year_totals,
+              'corpus_counts': migrate_corpus_counts,
+              'indexes': migrate_indexes}
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Adds derived tables to a database snapshot.')
+    parser.add_argument('db', help='path to the SQLite database')
+    parser.add_argument('migrations', nargs='+', choices=list(MIGRATIONS) + ['all'], help='migrations to run')
+    parser.add_argument('--check', action='store_true', help='check the query plans of sql_helper afterwards')
+    args = parser.parse_args()
+
+    names = list(MIGRATIONS) if 'all' in args.migrations else args.migrations
+    con = sqlite3.connect(args.db)
+    for name in names:
+        result = MIGRATIONS[name](con)
+        print(f'{name}: {result}')
+    con.close()
+
+    if args.check:
+        import query_plans
+        problems = query_plans.report(query_plans.check(args.db))
+        sys.exit(1 if problems else 0)
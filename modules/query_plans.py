@@ -0,0 +1,203 @@
+'''
+Query plan check for a serving database snapshot.
+Runs every query of sql_helper once (with ids and names taken from the snapshot), captures the SQL
+with its parameters and runs EXPLAIN QUERY PLAN on it. A query that scans a whole table instead of
+searching an index is reported: on the full snapshot that is seconds instead of milliseconds.
+Functions of sql_helper that take an engine but have no sample call in sample_calls are reported too,
+so a new query can not skip the check.
+
+Run it on every new snapshot, after the indexes migration (see migrations.py).
+
+Usage:
+    python modules/query_plans.py data/20200729pubmed_mini.db [-v]
+Exits with status 1 if there is a problem.
+'''
+
+import argparse
+import inspect
+import re
+import sys
+
+from sqlalchemy import event
+
+import db
+import sql_helper
+
+
+#Whole-table reads that are intended: (function, table). Reads of sqlite_master (the schema) are not checked
+EXPECTED_SCANS = {('find_similar', 'targets')} #scores every target abbreviation
+
+#'SCAN targets', 'SCAN targets USING COVERING INDEX ...' (full index scan), 'SCAN TABLE targets' before SQLite 3.36
+SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)')
+
+
+def sample_arguments(engine):
+    '''
+    Picks a target and a disease that are in the snapshot and have rankings and publication counts,
+    and the years of the per-year cube (None if the snapshot has none).
+    '''
+    with engine.connect() as con:
+        rs = con.execute("""
+        SELECT target_disease.target_id, target_disease.disease_id, targets.targ_abbr, malacard.Disease
+        FROM target_disease
+        JOIN targets ON targets.target_id = target_disease.target_id
+        JOIN malacard ON malacard.Disease_ID = target_disease.disease_id
+        JOIN pubmed_disease_frequencies ON pubmed_disease_frequencies.disease_id = target_disease.disease_id
+        LIMIT 1
+        """)
+        row = rs.fetchall()
+    if row == []:
+        raise ValueError('No target with rankings and publication counts in the database')
+    target_id, disease_id, targ_abbr, disease = row[0]
+
+    return {'target_id': target_id, 'disease_id': disease_id, 'targ_abbr': targ_abbr, 'disease': disease,
+            'years': sql_helper.get_year_range.uncached(engine)}
+
+
+def sample_calls(sample):
+    '''
+    Calls that together run every query in sql_helper: (function name, args, kwargs).
+    The per-year rankings are only called on snapshots with the per-year cube.
+    '''
+    t, d, years = sample['target_id'], sample['disease_id'], sample['years']
+    calls = [('get_disease_name', (d,), {}),
+            ('find_similar', (sample['targ_abbr'],), {}),
+            ('get_dis_year', (d,), {}),
+            ('get_dis_id', (sample['disease'],), {}),
+            ('get_target_id', (sample['targ_abbr'],), {}),
+            ('get_target_name', (t,), {}),
+            ('get_pubmed_year', (d,), {}),
+            ('has_table', ('ct_year_counts',), {}),
+            ('get_ct_year', (d,), {}),
+            ('get_drug_info', (t,), {}),
+            ('ct_forecast', (d,), {}),
+            ('get_n1', (), {}),
+            ('tg_count', (t,), {}),
+            ('tg_dis_counts', (t,), {}),
+            ('dis_count', (d,), {}),
+            ('dis_counts', ([d],), {}),
+            ('tg_per_disease', ({d: 1},), {}),
+            ('tg_dis_joint_counts', (t,), {}),
+            ('get_rankings', (t,), {}),
+            ('get_rankings', (t,), {'fast': False}),
+            ('get_rankings', (t,), {'metric': 'f1', 'top_k': 10, 'min_n0': 2}),
+            ('has_column', ('target_disease', 'n0'), {}),
+            ('get_rankings_page', (t,), {}),
+            ('get_rankings_page', (t,), {'page_current': 1, 'sort_by': (('disease', True),),
+                                         'filters': (('pmi', 'ge', 1.0),)}),
+            ('get_rankings_page', (t,), {'top_k': 50, 'min_n0': 2}),
+            ('get_target_rankings', (d,), {}),
+            ('get_target_rankings', (d,), {'top_k': 10, 'min_n0': 2}),
+            ('get_target_rankings_page', (d,), {}),
+            ('get_target_rankings_page', (d,), {'page_current': 1, 'sort_by': (('target', True),),
+                                                'filters': (('pmi', 'ge', 1.0),)}),
+            ('get_year_range', (), {})]
+    if years:
+        calls += [('get_year_rankings', (t,), {'years': years, 'half_life': 3}),
+                  ('get_year_rankings', (d,), {'direction': 'disease', 'years': (years[1], years[1])}),
+                  ('get_year_rankings_page', (t,), {'years': years, 'top_k': 10, 'min_n0': 1})]
+
+    return calls
+
+
+def query_functions():
+    '''
+    Names of the sql_helper functions that query the database (they take an engine argument).
+    Private helpers (_name) run through the public functions that call them.
+    '''
+    return {name for name, func in inspect.getmembers(sql_helper, inspect.isfunction)
+            if func.__module__ == sql_helper.__name__ and 'engine' in inspect.signature(func).parameters
+            and not name.startswith('_')}
+
+
+def check(db_path):
+    '''
+    Runs the sample calls on the database and explains every query they run.
+
+    Arguments:
+        db_path: path to the SQLite database
+    Returns:
+        results: list of dictionaries with function, sql, plan (list of plan lines),
+            scans (tables read in full, not counting EXPECTED_SCANS) and error (exception of the call, if any)
+        missing: sql_helper functions without a sample call
+    '''
+    engine = db.get_engine(db_path, immutable=False)
+    sample = sample_arguments(engine)
+    calls = sample_calls(sample)
+
+    captured = []
+    current = [None]
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        captured.append((current[0], statement, tuple(parameters or ())))
+
+    errors = {}
+    event.listen(engine, 'before_cursor_execute', capture)
+    try:
+        for name, args, kwargs in calls:
+            func = getattr(sql_helper, name)
+            current[0] = name
+            try:
+                #Memoized functions would not query again for the same arguments
+                getattr(func, 'uncached', func)(*args, engine, **kwargs)
+            except Exception as e:
+                errors[name] = repr(e)
+    finally:
+        event.remove(engine, 'before_cursor_execute', capture)
+        engine.dispose()
+
+    con = db.connect(db_path, immutable=False)
+    tables = {row[0] for row in con.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    results = []
+    for name, statement, parameters in captured:
+        plan = [row[3] for row in con.execute('EXPLAIN QUERY PLAN ' + statement, parameters)]
+        #Names that are not tables are subqueries (e.g. 'joint' in tg_dis_joint_counts)
+        scans = [m.group(1) for m in map(SCAN.match, plan) if m and m.group(1) in tables]
+        results.append({'function': name, 'sql': ' '.join(statement.split()), 'plan': plan,
+                        'scans': [table for table in scans if (name, table) not in EXPECTED_SCANS],
+                        'error': errors.pop(name, None)})
+    con.close()
+    #Calls that failed before running a query
+    results += [{'function': name, 'sql': None, 'plan': [], 'scans': [], 'error': error} for name, error in errors.items()]
+
+    #Names of all sample calls, also those left out for this snapshot
+    missing = sorted(query_functions() - {name for name, _, _ in sample_calls(dict(sample, years=(0, 0)))})
+
+    return results, missing
+
+
+def report(checked, verbose=False):
+    '''
+    Prints the problems found by check (all plans if verbose).
+    Returns:
+        problems: list of problem descriptions, empty if all queries use indexes
+    '''
+    results, missing = checked
+    problems = []
+    for result in results:
+        if result['scans']:
+            problems.append(f"{result['function']}: full scan of {', '.join(result['scans'])}\n    {result['sql']}")
+        if result['error']:
+            problems.append(f"{result['function']}: call failed: {result['error']}")
+        if verbose:
+            print(f"{result['function']}: {result['sql']}")
+            for line in result['plan']:
+                print(f'    {line}')
+    problems += [f'{name}: no sample call in query_plans.sample_calls' for name in missing]
+
+    for problem in problems:
+        print(f'FAIL {problem}')
+    print(f'{len(results)} queries checked, {len(problems)} problems')
+
+    return problems
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Checks that the sql_helper queries use indexes on a database snapshot.')
+    parser.add_argument('db', help='path to the SQLite database')
+    parser.add_argument('-v', '--verbose', action='store_true', help='print every query plan')
+    args = parser.parse_args()
+
+    problems = report(check(args.db), verbose=args.verbose)
+    sys.exit(1 if problems else 0)
@@ -2,6 +2,9 @@
 
 import math
 
+import numpy as np
+import pandas as pd
+
 def f0(n0, n1, r=False):
     '''
     Returns a metric for ranking disease-target associations, 
@@ -125,4 +128,67 @@ def pmi(n0, n1, n2, n3, r=False):
     
     except:
         return 'NaN'
-        
\ No newline at end of file
+
+
+
+def score_batch(n0, n1, n2, n3, r=False):
+    '''
+    Vectorised version of f0, f1, f2 and pmi. Computes all four metrics for many 
+    disease-target pairs in one pass instead of calling the scalar functions row by row.
+    Any of the counts can be a scalar (e.g. n1 and n2 for a single target) or an array/Series.
+    Where the scalar functions return 'NaN' (division by zero, log of zero), 
+    the result here is np.nan, so the columns stay numeric.
+    
+    Arguments:
+        n0: counts of joint occurrences target + disease
+        n1: number of all texts
+        n2: number of all texts that mention target
+        n3: number of all texts that mention disease
+        r: boolean. True: round to 5 digits. False: return as is.
+        
+    Returns:
+        scores: dataframe with columns f0, f1, f2, pmi. 
+            Keeps the index of n0 if it is a Series.
+    '''
+    index = n0.index if isinstance(n0, pd.Series) else None
+    
+    n0, n1, n2, n3 = np.broadcast_arrays(*[np.atleast_1d(np.asarray(n, dtype='float64')) for n in (n0, n1, n2, n3)])
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        f0 = (n0/n1)*(10**6)
+        f1 = n0/n2
+        f2 = n0/n3
+        
+        P_xy = n0/n1
+        P_x = n2/n1
+        P_y = n3/n1
+        pmi = np.log2(P_xy/(P_x*P_y))
+    
+    scores = pd.DataFrame({'f0': f0, 'f1': f1, 'f2': f2, 'pmi': pmi}, index=index)
+    #Same cases where the scalar functions fail: zero denominators and log2 of zero
+    scores = scores.replace([np.inf, -np.inf], np.nan)
+    
+    if r:
+        scores = scores.round(5)
+    
+    return scores
+
+
+def year_weights(years, half_life=None, ref_year=None):
+    '''
+    Weights of publication years for rankings over a range of years (see sql_helper.get_year_rankings).
+    Without half_life all years count the same. With it, counts decay exponentially with age:
+    an article from half_life years before ref_year counts half.
+    
+    Arguments:
+        years: (first, last) year, both included
+        half_life: half-life in years. None: no decay
+        ref_year: year with weight 1. None: the last year
+    
+    Returns:
+        weights: dictionary year: weight
+    '''
+    first, last = years
+    ref_year = last if ref_year is None else ref_year
+    
+    return {year: 1.0 if not half_life else 0.5 ** ((ref_year - year) / half_life) for year in range(first, last + 1)}
@@ -1,7 +1,8 @@
 '''
 Given target name, connects to the SQLite database and pulls frequencies necessary for ranking.
 The main function, get_rankings, returns a database with disease name and rankings.
-Requires ranking module in same dir.
+Requires ranking and cache modules in same dir.
+Results of the functions used by the dashboard are memoized, see cache.py.
 '''
 
 import sqlite3
@@ -10,14 +11,17 @@ import sqlalchemy
 from sqlalchemy import create_engine
 
 import ranking
-
-from fuzzywuzzy import fuzz
-from fuzzywuzzy import process
+import cache
 
 import ast
 from collections import Counter
 
 
+#Number of all articles in the 2020 snapshots, used for the metrics. 
+#Databases with a corpus_stats table (see migrations.py and ingest.py) have their own value, see get_n1
+N1 = 9680305
+
+
 #Lookup functions: names and ids
 
 def get_disease_name(disease_id, engine):
@@ -43,6 +47,9 @@ def find_similar(targ_abbr, engine):
     Returns:
         clean_matches: list of 5 top matches to the target
     '''
+    #Only needed here (the app uses suggest.py), so it is not loaded with the module
+    from fuzzywuzzy import process
+    
     with engine.connect() as con:
         rs = con.execute("""
         SELECT targ_abbr
@@ -150,6 +157,7 @@ def get_target_name(target_id, engine):
 #Lookup for clinical trials
 
 
+@cache.memoize
 def get_pubmed_year(disease_id, engine):
     '''
     Get number of publications per year for a given disease_id.
@@ -176,36 +184,80 @@ def get_pubmed_year(disease_id, engine):
     
     return yr_counts
 
-def get_ct_year(dis_name, engine):
+@cache.memoize
+def has_table(table_name, engine):
+    '''
+    Checks if the database has a table, e.g. one added by migrations.py.
+    Memoized, so this costs one query per DB snapshot.
     '''
-    Get number of clinical trial per year for a given disease_name.
-    TODO change to id
+    with engine.connect() as con:
+        rs = con.execute("""
+            SELECT 1
+            FROM sqlite_master
+            WHERE type = 'table' AND name = ?
+        """, (table_name,))
+        counts = rs.fetchall()
+    
+    return counts != []
+
+
+@cache.memoize
+def has_column(table_name, column_name, engine):
+    '''
+    Checks if a table has a column, e.g. n0 in target_disease tables built by cooccurrence.py.
+    '''
+    with engine.connect() as con:
+        rs = con.execute(f"PRAGMA table_info('{table_name}')")
+        counts = rs.fetchall()
+
+    return any(row[1] == column_name for row in counts)
+
+
+@cache.memoize
+def get_ct_year(disease_id, engine):
+    '''
+    Get number of clinical trial per year for a given disease_id.
+    Reads the typed ct_year_counts table (see migrations.py). On older snapshots without it, 
+    falls back to parsing ct_diseases.CT_trial_years, matched to the id through the malacard table.
     
     Arguments:
-        dis_name: disease_name
+        disease_id: malacard disease_id
         engine: connection to SQLite database
     
     Returns:
         counts: dictionary with counts of how many clinical trials we found for given disease per year
     '''
-    with engine.connect() as con:
+    if has_table('ct_year_counts', engine):
         with engine.connect() as con:
             rs = con.execute("""
-                SELECT CT_trial_years
-                FROM ct_diseases
-                WHERE Disease = ?
-            """,(dis_name,))
+                SELECT year, count
+                FROM ct_year_counts
+                WHERE disease_id = ?
+            """,(disease_id,))
             counts = rs.fetchall()
-            if counts == []:
-                yr_counts = []
-                return yr_counts
-            else:
-                info = counts[0][0]
-                years = ast.literal_eval(info)
-                yr_counts = dict(Counter(years))
-            
-                return yr_counts
+        yr_counts = dict(counts) if counts != [] else []
+        
+        return yr_counts
+    
+    with engine.connect() as con:
+        rs = con.execute("""
+            SELECT ct_diseases.CT_trial_years
+            FROM malacard
+            JOIN ct_diseases ON ct_diseases.Disease = malacard.Disease
+            WHERE malacard.Disease_ID = ?
+        """,(disease_id,))
+        counts = rs.fetchall()
+        if counts == []:
+            yr_counts = []
+            return yr_counts
+        else:
+            info = counts[0][0]
+            years = ast.literal_eval(info)
+            yr_counts = dict(Counter(years))
+        
+            return yr_counts
 
+@cache.memoize
 def get_drug_info(target_id, engine):
     '''
     Takes target id and checks the DB for all the drugs that are in work related to the target.
@@ -226,6 +278,7 @@ def get_drug_info(target_id, engine):
         
         return df_sql            
 
+@cache.memoize
 def ct_forecast(dis_id, engine):
     '''
     Gets data with timeseries forecast for number of trials for a given disease.
@@ -250,6 +303,26 @@ def ct_forecast(dis_id, engine):
             
 #Counting functions for ranking table
 
+@cache.memoize
+def get_n1(engine):
+    '''
+    Number of all articles (n1 in the metrics). Read from the corpus_stats table, which ingest.py 
+    updates when articles are added. Snapshots without it use N1.
+    '''
+    if has_table('corpus_stats', engine):
+        with engine.connect() as con:
+            rs = con.execute("""
+            SELECT value
+            FROM corpus_stats
+            WHERE name = 'n1'
+            """)
+            counts = rs.fetchall()
+        if counts != []:
+            return counts[0][0]
+    
+    return N1
+
+
 def tg_count(target_id, engine):
     '''
     Connects to a SQLite DB and counts in how many articles is the given target mentioned.
@@ -287,15 +360,15 @@ def tg_dis_counts(target_id, engine):
     '''
     
     with engine.connect() as con:
-        df_sql = pd.read_sql_query(f"""
-        SELECT disease_pubmed.pmid, target_id, disease_pubmed.disease_id  FROM target_pubmed
+        rs = con.execute("""
+        SELECT disease_pubmed.disease_id, COUNT(*)
+        FROM target_pubmed
         JOIN disease_pubmed ON target_pubmed.pmid = disease_pubmed.pmid
-        WHERE target_id = {target_id}
-
-        """, con)
-    con.close()
-    #df_sql
-    target_disease_counts = df_sql.groupby('disease_id').size().to_dict()
+        WHERE target_pubmed.target_id = ?
+        GROUP BY disease_pubmed.disease_id
+        """, (target_id,))
+        counts = rs.fetchall()
+    target_disease_counts = dict(counts)
     
     return target_disease_counts
 
@@ -324,6 +397,37 @@ def dis_count(disease_id, engine):
     return num_dis
 
 
+def dis_counts(disease_ids, engine, chunk_size=900):
+    '''
+    Same as dis_count, but for many diseases at once: one grouped query per chunk of ids
+    instead of one query per disease.
+    Chunks keep the number of bound parameters under the SQLite limit (999 on older builds).
+    
+    Arguments:
+        disease_ids: iterable of disease ids
+        engine: sqlalchemy engine, connected to the database
+        chunk_size: number of ids per query
+    Returns:
+        num_dis: dictionary, disease_id vs number of articles that mention the disease
+    '''
+    disease_ids = list(disease_ids)
+    num_dis = {i: 0 for i in disease_ids}
+    
+    with engine.connect() as con:
+        for start in range(0, len(disease_ids), chunk_size):
+            chunk = disease_ids[start:start + chunk_size]
+            placeholders = ', '.join('?' for _ in chunk)
+            rs = con.execute(f"""
+            SELECT disease_id, COUNT(*)
+            FROM disease_pubmed
+            WHERE disease_id IN ({placeholders})
+            GROUP BY disease_id
+            """, tuple(chunk))
+            num_dis.update(rs.fetchall())
+    
+    return num_dis
+
+
 def tg_per_disease(target_disease_count, engine):
     '''
     Takes in the resulting dictionary from tg_dis_counts (disease_id vs no of mentions together with target)
@@ -338,21 +442,113 @@ def tg_per_disease(target_disease_count, engine):
         
     '''
     
+    separate = dis_counts(target_disease_count.keys(), engine)
+    
     disease_dict = {}
     
     for key, val in target_disease_count.items():
-        separate = dis_count(key, engine)
-        local_dict = {'joined': val, 'separate': separate}
+        local_dict = {'joined': val, 'separate': separate[key]}
         disease_dict[key] = local_dict
         
     return disease_dict
 
 
-def get_rankings(target_id, engine, fast=True, full=False):
+def tg_dis_joint_counts(target_id, engine):
+    '''
+    Counts n0 (mentions of disease together with the target) and n3 (all mentions of disease)
+    for every disease co-mentioned with a given target, in a single grouped query.
+    Disease names are joined in from the malacard table.
+    Replaces the tg_dis_counts + tg_per_disease pair, which needs one query per disease.
+    
+    Arguments:
+        target_id: target id (as defined by ids in the "targets" table)
+        engine: sqlalchemy engine, connected to the database
+    Returns:
+        df_counts: dataframe with columns disease_id, disease, joined (n0), separate (n3)
+    '''
+    with engine.connect() as con:
+        df_counts = pd.read_sql_query("""
+        SELECT joint.disease_id, malacard.Disease AS disease, joint.joined, COUNT(*) AS separate
+        FROM (
+            SELECT disease_pubmed.disease_id, COUNT(*) AS joined
+            FROM target_pubmed
+            JOIN disease_pubmed ON target_pubmed.pmid = disease_pubmed.pmid
+            WHERE target_pubmed.target_id = ?
+            GROUP BY disease_pubmed.disease_id
+        ) AS joint
+        JOIN disease_pubmed ON disease_pubmed.disease_id = joint.disease_id
+        LEFT JOIN malacard ON malacard.Disease_ID = joint.disease_id
+        GROUP BY joint.disease_id
+        """, con, params=(target_id,))
+    
+    return df_counts
+
+
+#Metrics that rankings can be ordered and cut by (top_k)
+RANKING_METRICS = ('f0', 'f1', 'f2', 'pmi')
+
+#Id of the ranked rows, by the column searched by. Rows with the same metric are ordered by it,
+#so a top_k cut takes the same rows on every path
+RANKING_TIE_BREAK = {'target_id': 'disease_id', 'disease_id': 'target_id'}
+
+
+def _n0_sql(engine):
+    '''
+    SQL expression for n0 (number of articles mentioning target and disease) of a target_disease row.
+    Tables from before cooccurrence.py have no n0 column, there it is recovered from f0 = n0 / n1 * 10**6.
+    '''
+    if has_column('target_disease', 'n0', engine):
+        return 'target_disease.n0'
+
+    return f'ROUND(target_disease.f0 * {int(get_n1(engine))} / 1000000.0)'
+
+
+def _ranking_selection(key, key_id, engine, metric='pmi', top_k=None, min_n0=None):
+    '''
+    WHERE condition (and its parameters) for the rankings of one target or disease:
+    rows with at least min_n0 joint articles, and only the top_k of them by metric.
+
+    Arguments:
+        key: 'target_id' or 'disease_id', the column searched by
+        key_id: id of the searched target or disease
+        engine: sqlalchemy engine, connected to the database
+        metric: one of RANKING_METRICS
+        top_k: number of rows to keep. None: all
+        min_n0: minimum number of joint articles. None: no minimum
+    Returns:
+        conditions: list of SQL conditions to be joined with AND
+        params: list of parameters for the conditions
+    '''
+    if metric not in RANKING_METRICS:
+        raise ValueError(f'Unsupported metric: {metric}')
+
+    conditions = [f'target_disease.{key} = ?']
+    params = [key_id]
+    if min_n0:
+        conditions.append(f'{_n0_sql(engine)} >= ?')
+        params.append(min_n0)
+    if top_k:
+        #The index on (key, pmi DESC, ...) gives the top rows by pmi without sorting,
+        #other metrics sort the rows of this target or disease only
+        conditions = [f'''target_disease.rowid IN (
+            SELECT target_disease.rowid
+            FROM target_disease
+            WHERE {' AND '.join(conditions)}
+            ORDER BY target_disease.{metric} DESC, target_disease.{RANKING_TIE_BREAK[key]}
+            LIMIT ?)''']
+        params.append(top_k)
+
+    return conditions, params
+
+
+@cache.memoize
+def get_rankings(target_id, engine, fast=True, full=False, metric='pmi', top_k=None, min_n0=None):
     '''
     Overarching function that combines all the functions in this module.
     Takes target id and returns a dataframe with 4 metrics for each disease associated with target in articles.
-    
+    With top_k and min_n0 only the strongest rows are returned. On the fast path the cut is done in SQL,
+    so heavy targets do not read thousands of single co-mention rows.
+
     Arguments:
         target_id: target id (as defined by Malacard ids in the DB, defined in "targets" table)
         engine: sqlalchemy engine, connected to the database
@@ -362,49 +558,354 @@ def get_rankings(target_id, engine, fast=True, full=False):
         fast:
             True: takes precomputed values
             Fast: checks DB and computes at the background. Tends to get slow on weak computers.
-    
+        metric: one of RANKING_METRICS, rows are sorted by it (descending)
+        top_k: only return the top_k rows by metric. None: all
+        min_n0: only return diseases mentioned with the target in at least min_n0 articles. None: all
+
     Returns:
         df_counts: dataframe with rankings for diseases
     '''
-    
+
     if fast:
-        
+        conditions, params = _ranking_selection('target_id', target_id, engine, metric, top_k, min_n0)
+
         with engine.connect() as con:
 
+            #Names are joined in, so this is one query no matter how many diseases are returned
             df_sql = pd.read_sql_query(f"""
-            SELECT *
+            SELECT malacard.Disease AS disease, target_disease.f0, target_disease.f1, target_disease.f2, target_disease.pmi
             FROM target_disease
-            WHERE target_id = {target_id}
-            """, con)
-        df_sql['disease'] = df_sql.apply(lambda row: get_disease_name(row['disease_id'], engine), axis=1)
+            LEFT JOIN malacard ON malacard.Disease_ID = target_disease.disease_id
+            WHERE {' AND '.join(conditions)}
+            ORDER BY target_disease.{metric} DESC, target_disease.disease_id
+            """, con, params=tuple(params))
         df_sql = df_sql[['disease', 'f0', 'f1', 'f2', 'pmi']]
-        df_sql = df_sql.round(4)
-    
-        return df_sql.sort_values(by='pmi', ascending = False)
-          
+
+        return df_sql.round(4)
+
     else:
-        n1 = 9680305 #Number of all articles in the DB. Computing separately takes more time. 
-        n2 = tg_count(target_id, engine)
+        if metric not in RANKING_METRICS:
+            raise ValueError(f'Unsupported metric: {metric}')
 
-        target_disease = tg_dis_counts(target_id, engine)
-        taget_disease_count = tg_per_disease(target_disease, engine)
+        n1 = get_n1(engine) #Number of all articles in the DB. Counting them takes more time. 
+        n2 = tg_count(target_id, engine)
 
-        df_counts = pd.DataFrame.from_dict(taget_disease_count, orient='index')
-        df_counts = df_counts.reset_index().rename(columns = {'index': 'disease_id'})
+        df_counts = tg_dis_joint_counts(target_id, engine)
 
-        df_counts['disease'] = df_counts.apply(lambda row: get_disease_name(row['disease_id'], engine), axis=1)
-        df_counts['f0'] = df_counts.apply(lambda row: ranking.f0(n0=row['joined'], n1=n1, r=True), axis=1)
-        df_counts['f1'] = df_counts.apply(lambda row: ranking.f1(n0=row['joined'], n2=n2, r=True), axis=1)
-        df_counts['f2'] = df_counts.apply(lambda row: ranking.f2(n0=row['joined'], n3=row['separate'], r=True), axis=1)
-        df_counts['pmi'] = df_counts.apply(lambda row: ranking.pmi(n0=row['joined'], n1=n1, n2=n2, n3=row['separate'], r=True), axis=1)
+        if min_n0:
+            df_counts = df_counts[df_counts['joined'] >= min_n0]
+        scores = ranking.score_batch(n0=df_counts['joined'], n1=n1, n2=n2, n3=df_counts['separate'])
+        #Same order and rounding as the fast path
+        df_counts = df_counts.join(scores).sort_values(by=[metric, 'disease_id'], ascending=[False, True], ignore_index=True)
+        if top_k:
+            df_counts = df_counts.head(top_k)
+        df_counts = df_counts.round({col: 4 for col in RANKING_METRICS})
 
         if full:
-            return df_counts.sort_values(by='pmi', ascending = False)
+            return df_counts
         else:
-            return df_counts[['disease', 'f0', 'f1', 'f2', 'pmi']].sort_values(by='pmi', ascending = False)
+            return df_counts[['disease', 'f0', 'f1', 'f2', 'pmi']]
+    
+
+
+@cache.memoize
+def get_target_rankings(disease_id, engine, metric='pmi', top_k=None, min_n0=None):
+    '''
+    Inverse of get_rankings: takes a disease id and returns a dataframe with the 4 metrics for each target
+    associated with the disease in articles. Reads the precomputed target_disease table
+    (same values as get_rankings with fast=True), through its index on disease_id.
+
+    Arguments:
+        disease_id: disease id (as defined by Malacard ids in the DB, "malacard" table)
+        engine: sqlalchemy engine, connected to the database
+        metric, top_k, min_n0: see get_rankings
+    Returns:
+        df_sql: dataframe with target abbreviation and rankings, sorted by metric
+    '''
+    conditions, params = _ranking_selection('disease_id', disease_id, engine, metric, top_k, min_n0)
+
+    with engine.connect() as con:
+        df_sql = pd.read_sql_query(f"""
+        SELECT targets.targ_abbr AS target, target_disease.f0, target_disease.f1, target_disease.f2, target_disease.pmi
+        FROM target_disease
+        LEFT JOIN targets ON targets.target_id = target_disease.target_id
+        WHERE {' AND '.join(conditions)}
+        ORDER BY target_disease.{metric} DESC, target_disease.target_id
+        """, con, params=tuple(params))
     
+    return df_sql.round(4)
+
+
+#Server-side paging, sorting and filtering of precomputed rankings (DataTable page_action='custom')
+
+#Columns of the rankings table as shown in the app, and the SQL expressions behind them
+RANKING_COLUMNS = {'disease': 'malacard.Disease',
+                   'f0': 'ROUND(target_disease.f0, 4)',
+                   'f1': 'ROUND(target_disease.f1, 4)',
+                   'f2': 'ROUND(target_disease.f2, 4)',
+                   'pmi': 'ROUND(target_disease.pmi, 4)'}
+
+#Same for the rankings of targets for a disease (get_target_rankings_page)
+TARGET_RANKING_COLUMNS = {'target': 'targets.targ_abbr',
+                          **{col: expr for col, expr in RANKING_COLUMNS.items() if col != 'disease'}}
+
+#DataTable filter operators and their SQL equivalents
+FILTER_OPERATORS = {'eq': '=', 'ne': '!=', 'lt': '<', 'le': '<=', 'gt': '>', 'ge': '>=',
+                    'contains': 'LIKE', 'datestartswith': 'LIKE'}
+
+
+def ranking_filter_sql(filters, columns=RANKING_COLUMNS):
+    '''
+    Turns parsed DataTable filters into a SQL condition on the rankings columns.
+    Values are passed as parameters, column names and operators are checked against 
+    columns and FILTER_OPERATORS, anything else raises ValueError.
     
+    Arguments:
+        filters: iterable of (column, operator, value), e.g. ('pmi', 'ge', 3)
+        columns: RANKING_COLUMNS or TARGET_RANKING_COLUMNS
+    Returns:
+        conditions: list of SQL conditions to be joined with AND
+        params: list of parameters for the conditions
+    '''
+    conditions = []
+    params = []
+    for col_name, operator, value in filters:
+        if col_name not in columns or operator not in FILTER_OPERATORS:
+            raise ValueError(f'Unsupported filter: {col_name} {operator}')
+        if operator in ('contains', 'datestartswith'):
+            #The table parses numbers as floats, '2' should not become '2.0'
+            text = f'{value:g}' if isinstance(value, float) else str(value)
+            value = f'%{text}%' if operator == 'contains' else f'{text}%'
+        conditions.append(f'{columns[col_name]} {FILTER_OPERATORS[operator]} ?')
+        params.append(value)
+    
+    return conditions, params
+
+
+#Both directions of the rankings table: (column searched by, id column of the rows, join of the row names, columns)
+RANKING_DIRECTIONS = {'target': ('target_id', 'disease_id', 'LEFT JOIN malacard ON malacard.Disease_ID = target_disease.disease_id',
+                                 RANKING_COLUMNS),
+                      'disease': ('disease_id', 'target_id', 'LEFT JOIN targets ON targets.target_id = target_disease.target_id',
+                                  TARGET_RANKING_COLUMNS)}
+
+
+def _rankings_page(direction, key_id, engine, page_current=0, page_size=10, sort_by=(), filters=(),
+                   metric='pmi', top_k=None, min_n0=None):
+    '''
+    Shared by get_rankings_page and get_target_rankings_page, see there.
+    
+    Arguments:
+        direction: 'target' (diseases of a target) or 'disease' (targets of a disease), see RANKING_DIRECTIONS
+        key_id: id of the searched target or disease
+    '''
+    key, row_id, join, columns = RANKING_DIRECTIONS[direction]
+    selection, selection_params = _ranking_selection(key, key_id, engine, metric, top_k, min_n0)
+    conditions, params = ranking_filter_sql(filters, columns)
+    where = ' AND '.join(selection + conditions)
+    params = selection_params + params
+    
+    for col_name, _ in sort_by:
+        if col_name not in columns:
+            raise ValueError(f'Unsupported sort column: {col_name}')
+    order = [f'{columns[col]} {"ASC" if asc else "DESC"}' for col, asc in sort_by] or [f'target_disease.{metric} DESC']
+    order.append(f'target_disease.{row_id}')
+    
+    select = ', '.join([f'target_disease.{row_id}'] + [f'{expr} AS {col}' for col, expr in columns.items()])
+    
+    with engine.connect() as con:
+        rs = con.execute(f"""
+        SELECT COUNT(*)
+        FROM target_disease
+        {join}
+        WHERE {where}
+        """, tuple(params))
+        total = rs.fetchall()[0][0]
+        
+        df_sql = pd.read_sql_query(f"""
+        SELECT {select}
+        FROM target_disease
+        {join}
+        WHERE {where}
+        ORDER BY {', '.join(order)}
+        LIMIT ? OFFSET ?
+        """, con, params=tuple(params + [page_size, page_current*page_size]))
     
+    return df_sql, total
+
+
+@cache.memoize
+def get_rankings_page(target_id, engine, page_current=0, page_size=10, sort_by=(), filters=(),
+                      metric='pmi', top_k=None, min_n0=None):
+    '''
+    Returns one page of precomputed rankings for a target, with sorting, filtering and 
+    LIMIT/OFFSET done in SQL, so only the rows shown are read and sent to the browser.
+    Without sort_by, rows are sorted by metric, same as get_rankings.
+    With top_k, sorting, filtering and paging apply to the top_k rows by metric.
+    Rows also carry disease_id, so later lookups for a selected row do not need the name.
+    
+    Arguments:
+        target_id: target id (as defined by ids in the "targets" table)
+        engine: sqlalchemy engine, connected to the database
+        page_current: page number, starting from 0
+        page_size: number of rows per page
+        sort_by: tuple of (column, ascending) pairs, e.g. (('pmi', False),)
+        filters: tuple of (column, operator, value), e.g. (('disease', 'contains', 'cancer'),)
+        metric, top_k, min_n0: see get_rankings
+    Returns:
+        df_sql: dataframe with disease_id, disease name and rankings for the requested page
+        total: number of rows matching the filters, over all pages
+    '''
+    return _rankings_page('target', target_id, engine, page_current, page_size, sort_by, filters, metric, top_k, min_n0)
+
+
+@cache.memoize
+def get_target_rankings_page(disease_id, engine, page_current=0, page_size=10, sort_by=(), filters=(),
+                             metric='pmi', top_k=None, min_n0=None):
+    '''
+    Same as get_rankings_page for the targets of a disease (see get_target_rankings).
+    Columns are target_id, target (abbreviation) and the rankings; sort_by and filters use TARGET_RANKING_COLUMNS.
+    '''
+    return _rankings_page('disease', disease_id, engine, page_current, page_size, sort_by, filters, metric, top_k, min_n0)
+
+
+#Rankings over a range of publication years, from the per-year cube (see cooccurrence.build_year_cube)
+
+@cache.memoize
+def get_year_range(engine):
+    '''
+    First and last publication year of the per-year cube, None if the database has none.
+    '''
+    if not has_table('corpus_year_counts', engine):
+        return None
+
+    with engine.connect() as con:
+        #Two subqueries: each reads one end of the primary key, MIN and MAX together would scan it
+        rs = con.execute("""
+        SELECT (SELECT MIN(year) FROM corpus_year_counts), (SELECT MAX(year) FROM corpus_year_counts)
+        """)
+        counts = rs.fetchall()
+    first, last = counts[0]
+
+    return None if first is None else (first, last)
+
+
+#Both directions of the per-year rankings: (column searched by, its counts table and column,
+#id column of the rows, their counts table and column, join and column of the row names)
+YEAR_DIRECTIONS = {'target': ('target_id', 'target_year_counts', 'n2', 'disease_id', 'disease_year_counts', 'n3',
+                              'LEFT JOIN malacard ON malacard.Disease_ID = pairs.row_id', 'malacard.Disease AS disease'),
+                   'disease': ('disease_id', 'disease_year_counts', 'n3', 'target_id', 'target_year_counts', 'n2',
+                               'LEFT JOIN targets ON targets.target_id = pairs.row_id', 'targets.targ_abbr AS target')}
+
+
+@cache.memoize
+def get_year_rankings(key_id, engine, direction='target', years=None, half_life=None):
+    '''
+    Rankings of a target (or of a disease, direction='disease') computed from the articles of a range of years,
+    optionally weighting recent years more (see ranking.year_weights).
+    n0, n1, n2 and n3 are weighted sums over the years of the per-year cube, read by primary key ranges,
+    and go into the same metrics as get_rankings.
+
+    Arguments:
+        key_id: target id, or disease id with direction='disease'
+        engine: sqlalchemy engine, connected to the database
+        direction: 'target' (diseases of a target) or 'disease' (targets of a disease)
+        years: (first, last) year, both included. None: all years of the cube
+        half_life: half-life of the recency decay in years, counted back from the last year. None: no decay
+    Returns:
+        df: dataframe with the row id (disease_id or target_id), name (disease or target),
+            n0 (articles mentioning both in the years, not weighted) and rankings, sorted by pmi
+    '''
+    key, key_table, key_count, row_id, row_table, row_count, join, name = YEAR_DIRECTIONS[direction]
+    years = years or get_year_range(engine)
+    if years is None:
+        raise ValueError('The database has no per-year counts, build them with cooccurrence.py --years')
+
+    weights = ranking.year_weights(years, half_life)
+    cte = f"WITH w(year, weight) AS (VALUES {', '.join(['(?, ?)'] * len(weights))})"
+    weight_params = [value for item in weights.items() for value in item]
+
+    with engine.connect() as con:
+        rs = con.execute(f"""
+        {cte}
+        SELECT (SELECT SUM(corpus_year_counts.n1 * w.weight)
+                FROM w
+                JOIN corpus_year_counts ON corpus_year_counts.year = w.year),
+               (SELECT SUM({key_table}.{key_count} * w.weight)
+                FROM w
+                JOIN {key_table} ON {key_table}.{key} = ? AND {key_table}.year = w.year)
+        """, tuple(weight_params + [key_id]))
+        n1, n_key = rs.fetchall()[0]
+
+        df = pd.read_sql_query(f"""
+        {cte},
+        pairs AS (
+            SELECT target_disease_year.{row_id} AS row_id, SUM(target_disease_year.n0) AS articles,
+                   SUM(target_disease_year.n0 * w.weight) AS n0
+            FROM w
+            JOIN target_disease_year ON target_disease_year.{key} = ? AND target_disease_year.year = w.year
+            GROUP BY target_disease_year.{row_id})
+        SELECT pairs.row_id AS {row_id}, {name}, pairs.articles, pairs.n0,
+               (SELECT SUM({row_table}.{row_count} * w.weight)
+                FROM w
+                JOIN {row_table} ON {row_table}.{row_id} = pairs.row_id AND {row_table}.year = w.year) AS n_row
+        FROM pairs
+        {join}
+        """, con, params=tuple(weight_params + [key_id]))
+
+    n2, n3 = (n_key, df['n_row']) if direction == 'target' else (df['n_row'], n_key)
+    scores = ranking.score_batch(n0=df['n0'], n1=n1, n2=n2, n3=n3).round(4)
+    df = df[[row_id, name.split()[-1]]].assign(n0=df['articles']).join(scores)
+
+    return df.sort_values(by=['pmi', row_id], ascending=[False, True], ignore_index=True)
+
+
+#Pandas versions of the SQL filter operators of ranking_filter_sql
+FRAME_OPERATORS = {'eq': 'eq', 'ne': 'ne', 'lt': 'lt', 'le': 'le', 'gt': 'gt', 'ge': 'ge'}
+
+
+@cache.memoize
+def get_year_rankings_page(key_id, engine, direction='target', years=None, half_life=None, page_current=0, page_size=10,
+                           sort_by=(), filters=(), metric='pmi', top_k=None, min_n0=None):
+    '''
+    One page of get_year_rankings, with the same arguments and results as get_rankings_page
+    (or get_target_rankings_page with direction='disease'). The metrics are computed for the whole range
+    of years first, so the cuts, sorting and filtering are done in pandas on the result of get_year_rankings.
+    '''
+    row_id, columns = RANKING_DIRECTIONS[direction][1], RANKING_DIRECTIONS[direction][3]
+    if metric not in RANKING_METRICS:
+        raise ValueError(f'Unsupported metric: {metric}')
+    df = get_year_rankings(key_id, engine, direction, years, half_life)
+
+    if min_n0:
+        df = df[df['n0'] >= min_n0]
+    if top_k:
+        df = df.sort_values(by=[metric, row_id], ascending=[False, True]).head(top_k)
+
+    for col_name, operator, value in filters:
+        if col_name not in columns or operator not in FILTER_OPERATORS:
+            raise ValueError(f'Unsupported filter: {col_name} {operator}')
+        if operator in ('contains', 'datestartswith'):
+            #Same as LIKE: case-insensitive, numbers written as in ranking_filter_sql
+            text = f'{value:g}' if isinstance(value, float) else str(value)
+            values = df[col_name].astype(str).str.lower()
+            mask = values.str.contains(text.lower(), regex=False) if operator == 'contains' else values.str.startswith(text.lower())
+        else:
+            mask = getattr(df[col_name], FRAME_OPERATORS[operator])(value)
+        df = df[mask.fillna(False)]
+
+    for col_name, _ in sort_by:
+        if col_name not in columns:
+            raise ValueError(f'Unsupported sort column: {col_name}')
+    if sort_by:
+        df = df.sort_values(by=[col for col, _ in sort_by] + [row_id], ascending=[asc for _, asc in sort_by] + [True])
+    else:
+        df = df.sort_values(by=[metric, row_id], ascending=[False, True])
+
+    start = page_current*page_size
+
+    return df.iloc[start:start + page_size].drop(columns='n0').reset_index(drop=True), len(df)
+
+
 if __name__ == '__main__':
 
     engine = create_engine('sqlite:///./data/20200723pubmed.db', echo=False)
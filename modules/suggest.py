@@ -0,0 +1,166 @@
+'''
+Pre-built fuzzy search index for target and disease suggestions ("Maybe you meant: ...").
+sql_helper.find_similar reads the whole targets column and scores every entry with fuzzywuzzy on each miss.
+Here a trigram inverted index over target abbreviations and full names is built once.
+A query only scores the targets whose terms share the most trigrams with it, and those are re-ranked
+with the same fuzzywuzzy scorer that process.extract uses (WRatio), on their best matching term.
+
+WRatio costs 20-40 us per call, so the size of the re-ranked pool (candidates * limit targets) trades latency
+for agreement with find_similar, see benchmarks/bench_suggest.py. 100 typo queries, top 5, on a generated
+database with 2000 targets (find_similar: median 65 ms):
+    candidates=1: median 0.6 ms, p95 0.7 ms, 58% of the find_similar top 5 also suggested
+    candidates=4 (default): median 0.6 ms, p95 1.1 ms, 66% of its top 5
+    candidates=8: median 1.5 ms, p95 2.2 ms, 73% of its top 5
+The first suggestion is the same for 98% of the queries. Most of the other differences are picks among targets
+that score the same, but some suggestions (about 11% with the default) score below find_similar's 5th:
+targets that look alike to WRatio but share few trigrams with the query are not found.
+'''
+
+import threading
+from collections import defaultdict
+
+import numpy as np
+from fuzzywuzzy import fuzz
+from fuzzywuzzy import utils
+
+
+def trigrams(term):
+    '''
+    Splits a normalised term into a set of character trigrams.
+    Padding makes short abbreviations (1-2 letters) produce trigrams too, and weights the start of a term.
+    '''
+    padded = f'  {term} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SuggestionIndex:
+    '''
+    Trigram inverted index. Each searchable term (abbreviation or full name) points to a label,
+    which is what gets suggested (the target abbreviation).
+
+    Arguments:
+        terms: list of (term, label) pairs
+        candidates: number of labels with most shared trigrams that are re-ranked with fuzzywuzzy,
+            per suggestion asked for (limit)
+    '''
+
+    def __init__(self, terms, candidates=4):
+        self.candidates = candidates
+        self.terms = []
+        self.labels = []
+        label_ids = {}
+        term_labels = []
+
+        postings = defaultdict(list)
+        for term, label in terms:
+            if not term:
+                continue
+            clean = utils.full_process(term)
+            if not clean:
+                continue
+            pos = len(self.terms)
+            self.terms.append(clean)
+            term_labels.append(label_ids.setdefault(label, len(label_ids)))
+            for gram in trigrams(clean):
+                postings[gram].append(pos)
+
+        self.postings = {gram: np.array(ids, dtype=np.int32) for gram, ids in postings.items()}
+        self.sizes = np.array([len(trigrams(t)) for t in self.terms], dtype=np.float32)
+        #Label number of each term, and the labels by number
+        self.term_labels = np.array(term_labels, dtype=np.int32)
+        self.labels = list(label_ids)
+
+    @classmethod
+    def from_engine(cls, engine, **kwargs):
+        '''
+        Builds the index from the "targets" table: both targ_abbr and targ_name point to targ_abbr.
+        '''
+        with engine.connect() as con:
+            rs = con.execute("""
+            SELECT targ_abbr, targ_name
+            FROM targets
+            """)
+            rows = rs.fetchall()
+        terms = [(abbr, abbr) for abbr, _ in rows] + [(name, abbr) for abbr, name in rows]
+
+        return cls(terms, **kwargs)
+
+    @classmethod
+    def from_diseases(cls, engine, **kwargs):
+        '''
+        Builds the index from the disease names of the "malacard" table, for the disease search mode.
+        '''
+        with engine.connect() as con:
+            rs = con.execute("""
+            SELECT Disease
+            FROM malacard
+            """)
+            names = [row[0] for row in rs.fetchall() if row[0]]
+
+        return cls([(name, name) for name in names], **kwargs)
+
+    def suggest(self, query, limit=5):
+        '''
+        Gets the top matches to the search term.
+
+        Arguments:
+            query: search term
+            limit: number of suggestions to return
+        Returns:
+            clean_matches: list of up to `limit` distinct labels, best match first
+        '''
+        clean = utils.full_process(query or '')
+        if not clean or not self.terms:
+            return []
+
+        grams = trigrams(clean)
+        hits = [self.postings[g] for g in grams if g in self.postings]
+        if not hits:
+            return []
+
+        #Dice coefficient on trigram sets picks the candidates, the best term of each label counts,
+        #so an abbreviation and a name of the same target do not take two places
+        ids, shared = np.unique(np.concatenate(hits), return_counts=True)
+        dice = 2 * shared / (self.sizes[ids] + len(grams))
+        order = np.argsort(-dice, kind='stable')
+        labels, first = np.unique(self.term_labels[ids[order]], return_index=True)
+        n = min(self.candidates * limit, len(labels))
+        best = ids[order[np.sort(first)[:n]]]
+
+        #One WRatio per candidate label, on its term with the most shared trigrams
+        scored = sorted(((fuzz.WRatio(clean, self.terms[i], full_process=False), -rank, self.term_labels[i])
+                         for rank, i in enumerate(best)), reverse=True)
+
+        clean_matches = [self.labels[label] for _, _, label in scored[:limit]]
+
+        return clean_matches
+
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+def _get(key, build):
+    index = _indexes.get(key)
+    if index is None:
+        with _lock:
+            index = _indexes.get(key)
+            if index is None:
+                index = build()
+                _indexes[key] = index
+
+    return index
+
+
+def get_index(engine):
+    '''
+    Returns the SuggestionIndex of targets for the database behind the engine, building it on first use.
+    '''
+    return _get(('targets', str(engine.url)), lambda: SuggestionIndex.from_engine(engine))
+
+
+def get_disease_index(engine):
+    '''
+    Returns the SuggestionIndex of diseases for the database behind the engine, building it on first use.
+    '''
+    return _get(('diseases', str(engine.url)), lambda: SuggestionIndex.from_diseases(engine))
@@ -0,0 +1,206 @@
+'''
+Generator of synthetic database snapshots of a chosen size, with the schema of the app's database,
+for scaling studies and benchmarks (see benchmarks/).
+Writes the tables the app reads:
+    pubmed, target_pubmed, disease_pubmed, targets, malacard, target_disease,
+    ct_diseases, ct_forecast, drug_target_indication, pubmed_disease_frequencies
+Targets and diseases are named like in the mini snapshot ('T12X', 'Target protein 12', 'Disease number 7').
+How often a target or disease is mentioned follows a Zipf distribution over a random order of the ids,
+so a few are in many articles and most in few, like in PubMed. The number of mentions per article is Poisson
+distributed and the number of articles grows by a constant factor per year.
+Popular diseases also get more clinical trials.
+
+target_disease is built from the generated articles with cooccurrence.build_target_disease, so rankings,
+the slow path of get_rankings and the corpus counts agree. By default the migrations are run as well
+(derived tables and indexes, see migrations.py), with --years also the per-year cube.
+
+Usage:
+    python modules/synthetic.py /tmp/synthetic_medium.db --size medium
+    python modules/synthetic.py /tmp/synthetic.db --targets 5000 --articles 1000000 --zipf 1.2 --seed 3 --years
+'''
+
+import argparse
+import os
+import sqlite3
+
+import numpy as np
+
+import cooccurrence
+import migrations
+
+
+#Presets of --size. small is about the size of the mini snapshot, large about a fifth of the full corpus
+SIZES = {'small': {'n_targets': 50, 'n_diseases': 80, 'n_articles': 5000},
+         'medium': {'n_targets': 2000, 'n_diseases': 5000, 'n_articles': 300000},
+         'large': {'n_targets': 10000, 'n_diseases': 10000, 'n_articles': 2000000}}
+
+#Same as the snapshot the app ships with
+SCHEMA = '''
+CREATE TABLE pubmed(pmid INTEGER, year INTEGER);
+CREATE TABLE target_pubmed(pmid INTEGER, target_id INTEGER);
+CREATE TABLE disease_pubmed(pmid INTEGER, disease_id INTEGER);
+CREATE TABLE targets(target_id INTEGER, targ_abbr TEXT, targ_name TEXT);
+CREATE TABLE malacard(Disease_ID INTEGER, Disease TEXT);
+CREATE TABLE ct_diseases(Disease TEXT, CT_trial_years TEXT);
+CREATE TABLE ct_forecast(disease_id INTEGER, y2020 REAL, y2021 REAL);
+CREATE TABLE drug_target_indication(target_id INTEGER, Drug_name TEXT, Drug_status TEXT, INDICATI TEXT);
+'''
+
+DRUG_STATUSES = ['Approved', 'Phase 3', 'Phase 2', 'Phase 1']
+DRUG_STATUS_WEIGHTS = [0.4, 0.2, 0.25, 0.15]
+
+
+def zipf_weights(n, s, rng):
+    '''
+    Probabilities of n items under a Zipf distribution with exponent s, in a random order of the items.
+    '''
+    ranks = rng.permutation(n) + 1
+    weights = ranks ** -float(s)
+
+    return weights / weights.sum()
+
+
+def mentions(pmids, ids, weights, per_article, rng):
+    '''
+    Draws the (pmid, id) rows of a link table: a Poisson number of mentions per article,
+    each one of ids with the given probabilities. Repeated mentions in an article are dropped.
+
+    Returns:
+        pmids, ids: int64 arrays, sorted by pmid
+    '''
+    counts = rng.poisson(per_article, len(pmids))
+    rows = np.repeat(pmids, counts)
+    cols = ids[rng.choice(len(ids), size=len(rows), p=weights)]
+    pairs = np.unique(np.stack([rows, cols], axis=1), axis=0)
+
+    return pairs[:, 0], pairs[:, 1]
+
+
+def generate(db_path, n_targets=50, n_diseases=80, n_articles=5000, first_year=2009, last_year=2020, zipf=1.1,
+             targets_per_article=1.0, diseases_per_article=1.0, growth=1.05, drugs_per_target=2.0,
+             trials_per_disease=15.0, seed=0, workers=1, migrate=True, years=False):
+    '''
+    Writes a new synthetic database, see the module docstring.
+
+    Arguments:
+        db_path: path of the new SQLite database, must not exist
+        n_targets, n_diseases, n_articles: numbers of targets, diseases and articles
+        first_year, last_year: publication years of the articles
+        zipf: exponent of the Zipf distributions of target and disease mentions (and trials)
+        targets_per_article, diseases_per_article: mean numbers of mentions per article
+        growth: factor by which the number of articles grows from one year to the next
+        drugs_per_target: mean number of drugs per target
+        trials_per_disease: mean number of clinical trials per disease
+        seed: seed of the random numbers, the same arguments and seed give the same database
+        workers: worker processes of cooccurrence.build_target_disease
+        migrate: run all migrations (derived tables and indexes)
+        years: build the per-year cube (cooccurrence.build_year_cube)
+    Returns:
+        counts: dictionary of table name: number of rows
+    '''
+    if os.path.exists(db_path):
+        raise FileExistsError(f'{db_path} exists, the generator only writes new databases')
+    rng = np.random.default_rng(seed)
+
+    target_ids = np.arange(1, n_targets + 1)
+    disease_ids = np.arange(1, n_diseases + 1)
+    pmids = np.arange(1, n_articles + 1)
+    year_range = np.arange(first_year, last_year + 1)
+    year_weights = growth ** (year_range - first_year)
+    article_years = rng.choice(year_range, size=n_articles, p=year_weights / year_weights.sum())
+    target_weights = zipf_weights(n_targets, zipf, rng)
+    disease_weights = zipf_weights(n_diseases, zipf, rng)
+    disease_names = [f'Disease number {i}' for i in disease_ids]
+
+    con = sqlite3.connect(db_path)
+    #A new file that is thrown away if generation fails: no journal needed
+    con.execute('PRAGMA journal_mode = OFF')
+    con.execute('PRAGMA synchronous = OFF')
+    con.executescript(SCHEMA)
+    con.execute(f'''CREATE TABLE pubmed_disease_frequencies(disease_id INTEGER, {
+                ", ".join(f'"{year}" INTEGER' for year in year_range)})''')
+
+    with con:
+        con.executemany('INSERT INTO targets VALUES (?, ?, ?)',
+                        [(i, f'T{i}X', f'Target protein {i}') for i in target_ids.tolist()])
+        con.executemany('INSERT INTO malacard VALUES (?, ?)', zip(disease_ids.tolist(), disease_names))
+        con.executemany('INSERT INTO pubmed VALUES (?, ?)', zip(pmids.tolist(), article_years.tolist()))
+        for table, ids, weights, per_article in [('target_pubmed', target_ids, target_weights, targets_per_article),
+                                                 ('disease_pubmed', disease_ids, disease_weights, diseases_per_article)]:
+            rows, cols = mentions(pmids, ids, weights, per_article, rng)
+            con.executemany(f'INSERT INTO {table} VALUES (?, ?)', zip(rows.tolist(), cols.tolist()))
+
+        #Publications per disease and year, from the generated articles
+        con.execute(f'''
+        INSERT INTO pubmed_disease_frequencies
+        SELECT malacard.Disease_ID, {", ".join(f"COUNT(CASE WHEN pubmed.year = {year} THEN 1 END)" for year in year_range)}
+        FROM malacard
+        LEFT JOIN disease_pubmed ON disease_pubmed.disease_id = malacard.Disease_ID
+        LEFT JOIN pubmed ON pubmed.pmid = disease_pubmed.pmid
+        GROUP BY malacard.Disease_ID
+        ''')
+
+        #Trial start years (a Python-literal list stored as text), from 10 years before the articles.
+        #Diseases without trials have no ct_diseases and ct_forecast rows
+        n_trials = rng.poisson(trials_per_disease * n_diseases * disease_weights)
+        trial_years = np.arange(first_year - 10, last_year + 1)
+        for disease_id, name, n in zip(disease_ids.tolist(), disease_names, n_trials.tolist()):
+            if n == 0:
+                continue
+            starts = rng.choice(trial_years, size=n).tolist()
+            con.execute('INSERT INTO ct_diseases VALUES (?, ?)', (name, str(starts)))
+            recent = sum(year > last_year - 3 for year in starts) / 3
+            con.execute('INSERT INTO ct_forecast VALUES (?, ?, ?)',
+                        (disease_id, *(recent * rng.uniform(0.8, 1.2, 2)).tolist()))
+
+        drugs = []
+        for target_id, n in zip(target_ids.tolist(), rng.poisson(drugs_per_target, n_targets).tolist()):
+            statuses = rng.choice(DRUG_STATUSES, size=n, p=DRUG_STATUS_WEIGHTS).tolist()
+            indications = rng.choice(n_diseases, size=n, p=disease_weights).tolist()
+            drugs += [(target_id, f'drug{target_id}_{k}', statuses[k], disease_names[indications[k]]) for k in range(n)]
+        con.executemany('INSERT INTO drug_target_indication VALUES (?, ?, ?, ?)', drugs)
+    con.close()
+
+    cooccurrence.build_target_disease(db_path, workers=workers)
+    if years:
+        cooccurrence.build_year_cube(db_path)
+    con = sqlite3.connect(db_path)
+    if migrate:
+        for migration in migrations.MIGRATIONS.values():
+            migration(con)
+    counts = {table: con.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] for (table,) in
+              con.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name").fetchall()}
+    con.close()
+
+    return counts
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Writes a synthetic database with the schema of the app.')
+    parser.add_argument('db', help='path of the new SQLite database')
+    parser.add_argument('--size', choices=list(SIZES), default='small', help='preset numbers of targets, diseases and articles')
+    parser.add_argument('--targets', type=int, default=None, help='number of targets (overrides --size)')
+    parser.add_argument('--diseases', type=int, default=None, help='number of diseases (overrides --size)')
+    parser.add_argument('--articles', type=int, default=None, help='number of articles (overrides --size)')
+    parser.add_argument('--first-year', type=int, default=2009, help='first publication year')
+    parser.add_argument('--last-year', type=int, default=2020, help='last publication year')
+    parser.add_argument('--zipf', type=float, default=1.1, help='exponent of the Zipf distributions of mentions')
+    parser.add_argument('--targets-per-article', type=float, default=1.0, help='mean target mentions per article')
+    parser.add_argument('--diseases-per-article', type=float, default=1.0, help='mean disease mentions per article')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random numbers')
+    parser.add_argument('--workers', type=int, default=1, help='worker processes to build target_disease')
+    parser.add_argument('--no-migrations', action='store_true', help='do not add derived tables and indexes')
+    parser.add_argument('--years', action='store_true', help='also build the per-year cube')
+    args = parser.parse_args()
+
+    size = dict(SIZES[args.size])
+    for key, value in [('n_targets', args.targets), ('n_diseases', args.diseases), ('n_articles', args.articles)]:
+        if value is not None:
+            size[key] = value
+
+    counts = generate(args.db, first_year=args.first_year, last_year=args.last_year, zipf=args.zipf,
+                      targets_per_article=args.targets_per_article, diseases_per_article=args.diseases_per_article,
+                      seed=args.seed, workers=args.workers, migrate=not args.no_migrations, years=args.years, **size)
+    for table, n in counts.items():
+        print(f'{table}: {n}')
@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'modules'))
+
+import synthetic
+
+
+@pytest.fixture(scope='session')
+def synthetic_db(tmp_path_factory):
+    '''
+    Path of a small synthetic database with the per-year cube, shared by the tests: copy it before writing to it.
+    '''
+    path = str(tmp_path_factory.mktemp('synthetic') / 'small.db')
+    synthetic.generate(path, n_targets=40, n_diseases=60, n_articles=3000, seed=1, years=True)
+
+    return path
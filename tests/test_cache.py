@@ -0,0 +1,64 @@
+import itertools
+
+import pytest
+from sqlalchemy import create_engine
+
+import cache
+
+
+@pytest.fixture
+def engine(tmp_path):
+    path = tmp_path / 'snapshot.db'
+    path.write_bytes(b'')
+    return create_engine(f'sqlite:///{path}')
+
+
+def test_result_cache_evicts_least_recently_used():
+    results = cache.ResultCache(max_entries=2)
+    results.set('a', 1)
+    results.set('b', 2)
+    assert results.get('a') == (True, 1)
+    results.set('c', 3)
+
+    assert results.get('b') == (False, None)
+    assert results.get('a') == (True, 1)
+    assert results.get('c') == (True, 3)
+    assert results.stats()['evictions'] == 1
+
+
+def test_result_cache_evicts_by_size():
+    results = cache.ResultCache(max_bytes=2500)
+    results.set('a', b'x' * 1000)
+    results.set('b', b'x' * 1000)
+    results.set('c', b'x' * 1000)
+    results.set('too big', b'x' * 3000)
+
+    assert [results.get(key)[0] for key in ['a', 'b', 'c', 'too big']] == [False, True, True, False]
+    assert results.stats()['bytes'] <= 2500
+
+
+def test_shared_cache_evicts_least_recently_used(tmp_path, engine, monkeypatch):
+    #Distinct access times, in call order
+    clock = itertools.count(1)
+    monkeypatch.setattr(cache.time, 'time', lambda: next(clock))
+    shared = cache.SharedCache(str(tmp_path / 'shared'), engine, max_bytes=2500)
+    shared.set('a', b'x' * 1000)
+    shared.set('b', b'x' * 1000)
+    assert shared.get('a') == (True, b'x' * 1000)
+    shared.set('c', b'x' * 1000)
+
+    assert shared.get('b') == (False, None)
+    assert shared.get('a')[0] and shared.get('c')[0]
+    assert shared.stats()['evictions'] == 1
+    assert 'path' not in shared.stats()
+
+
+def test_shared_cache_is_seen_by_other_processes_caches(tmp_path, engine):
+    directory = str(tmp_path / 'shared')
+    first, second = cache.ResultCache(), cache.ResultCache()
+    first.attach(cache.SharedCache(directory, engine))
+    second.attach(cache.SharedCache(directory, engine))
+    first.set(('key', 1), {'rows': [1, 2]})
+
+    assert second.get(('key', 1)) == (True, {'rows': [1, 2]})
+    assert second.stats()['shared_hits'] == 1
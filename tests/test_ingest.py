@@ -0,0 +1,77 @@
+import shutil
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+import cooccurrence
+import ingest
+
+HELD_OUT = 500
+
+
+def held_out_articles(con, n):
+    '''
+    The last n articles of the database, in the batch format of ingest.py.
+    '''
+    articles = {pmid: {'pmid': pmid, 'year': year, 'targets': [], 'diseases': []} for pmid, year in
+                con.execute('SELECT pmid, year FROM pubmed ORDER BY pmid DESC LIMIT ?', (n,))}
+    for table, column, key in [('target_pubmed', 'target_id', 'targets'), ('disease_pubmed', 'disease_id', 'diseases')]:
+        for pmid, i in con.execute(f'SELECT pmid, {column} FROM {table} WHERE pmid >= ?', (min(articles),)):
+            articles[pmid][key].append(i)
+
+    return [articles[pmid] for pmid in sorted(articles)]
+
+
+def table(db_path, sql):
+    con = sqlite3.connect(db_path)
+    df = pd.read_sql_query(sql, con)
+    con.close()
+
+    return df
+
+
+def test_ingest_matches_full_rebuild(synthetic_db, tmp_path):
+    con = sqlite3.connect(synthetic_db)
+    articles = held_out_articles(con, HELD_OUT)
+    con.close()
+
+    #The same database without the held-out articles, rebuilt from scratch, then given them back
+    path = str(tmp_path / 'partial.db')
+    shutil.copy(synthetic_db, path)
+    con = sqlite3.connect(path)
+    with con:
+        for name in ['pubmed', 'target_pubmed', 'disease_pubmed']:
+            con.execute(f'DELETE FROM {name} WHERE pmid >= ?', (articles[0]['pmid'],))
+    con.close()
+    cooccurrence.build_target_disease(path, workers=1)
+    cooccurrence.build_year_cube(path)
+
+    con = sqlite3.connect(path)
+    summary = ingest.ingest(con, articles)
+    con.close()
+    assert summary['articles'] == HELD_OUT
+
+    sql = 'SELECT * FROM target_disease ORDER BY target_id, disease_id'
+    full, updated = table(synthetic_db, sql), table(path, sql)
+    pd.testing.assert_frame_equal(updated[['target_id', 'disease_id', 'n0', 'n2', 'n3']],
+                                  full[['target_id', 'disease_id', 'n0', 'n2', 'n3']])
+    for metric in ['f0', 'f1', 'f2', 'pmi']:
+        np.testing.assert_allclose(updated[metric], full[metric], rtol=1e-9, atol=1e-12)
+
+    for name, _, key in cooccurrence.YEAR_TABLES:
+        sql = f'SELECT * FROM {name} ORDER BY {key}'
+        pd.testing.assert_frame_equal(table(path, sql), table(synthetic_db, sql))
+
+
+def test_ingest_skips_known_articles(synthetic_db, tmp_path):
+    path = str(tmp_path / 'copy.db')
+    shutil.copy(synthetic_db, path)
+    con = sqlite3.connect(path)
+    articles = held_out_articles(con, 10)
+    summary = ingest.ingest(con, articles)
+    con.close()
+
+    assert summary['articles'] == 0
+    sql = 'SELECT * FROM target_disease ORDER BY target_id, disease_id'
+    pd.testing.assert_frame_equal(table(path, sql), table(synthetic_db, sql))
@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+
+import ranking
+
+
+def scalar(func, *args):
+    value = func(*args)
+    return np.nan if value == 'NaN' else value
+
+
+def test_score_batch_matches_scalar_functions():
+    rng = np.random.default_rng(0)
+    n1 = 10000
+    n2 = rng.integers(0, 500, 300)
+    n3 = rng.integers(0, 500, 300)
+    n0 = np.minimum(rng.integers(0, 50, 300), np.minimum(n2, n3))
+    #Zero counts: division by zero and log of zero give NaN
+    n0[:5] = 0
+    n2[5:10] = 0
+    n3[10:15] = 0
+
+    for r in [False, True]:
+        scores = ranking.score_batch(n0, n1, n2, n3, r=r)
+        expected = pd.DataFrame({'f0': [scalar(ranking.f0, a, n1, r) for a in n0],
+                                 'f1': [scalar(ranking.f1, a, b, r) for a, b in zip(n0, n2)],
+                                 'f2': [scalar(ranking.f2, a, c, r) for a, c in zip(n0, n3)],
+                                 'pmi': [scalar(ranking.pmi, a, n1, b, c, r) for a, b, c in zip(n0, n2, n3)]})
+        pd.testing.assert_frame_equal(scores[['f0', 'f1', 'f2', 'pmi']], expected, check_exact=False, rtol=1e-12)
+
+
+def test_score_batch_keeps_series_index_and_broadcasts_scalars():
+    n0 = pd.Series([1, 2, 3], index=[7, 8, 9])
+    scores = ranking.score_batch(n0, 100, 10, pd.Series([5, 6, 7], index=[7, 8, 9]))
+
+    assert list(scores.index) == [7, 8, 9]
+    assert scores['f1'].tolist() == [0.1, 0.2, 0.3]